@@ -0,0 +1,57 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+# Only the script of chosen command is loaded, so e.g. offline audit never imports requests
+import sys
+import os
+import runpy
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Command -> (script, description)
+COMMANDS = {
+	"download": ("download-policy-xml.py", "download policy XML files into folder or policy store"),
+	"audit-online": ("online-policy-audit.py", "audit all policies fetched from AMP API"),
+	"audit-offline": ("offline-policy-audit.py", "audit policy file, folder, glob pattern or policy store"),
+	"diff": ("diff-policy-snapshots.py", "show security relevant changes between two snapshots"),
+	"exclusions": ("exclusion-analysis.py", "analyze path exclusions of policies"),
+	"matrix": ("settings-matrix.py", "fleet-wide statistics of settings checked by audit rules"),
+	"findings": ("query-findings.py", "query findings database"),
+}
+
+def usage():
+	lines = ["usage: {} COMMAND [options]".format(os.path.basename(sys.argv[0])), "", "commands:"]
+	for name in sorted(COMMANDS):
+		lines.append("  {:<15} {}".format(name, COMMANDS[name][1]))
+	lines.append("")
+	lines.append("Run '{} COMMAND -h' for options of command.".format(os.path.basename(sys.argv[0])))
+	return "\n".join(lines)
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+# argparse is not needed to pick the command, script of the command parses its own options
+def main():
+	if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+		print(usage())
+		sys.exit(0 if len(sys.argv) >= 2 else 2)
+	command = sys.argv[1]
+	if command not in COMMANDS:
+		sys.stderr.write(usage() + "\n")
+		sys.stderr.write("{}: error: unknown command '{}'\n".format(os.path.basename(sys.argv[0]), command))
+		sys.exit(2)
+	script = os.path.join(ROOT, COMMANDS[command][0])
+	# Script runs exactly as if it was started on its own (worker processes included)
+	sys.argv = [script] + sys.argv[2:]
+	if ROOT not in sys.path:
+		sys.path.insert(0, ROOT)
+	runpy.run_path(script, run_name="__main__")
+
+if __name__ == "__main__":
+	main()
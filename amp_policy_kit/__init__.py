@@ -0,0 +1,3 @@
+#####################################################################################
+# amp-policy-kit shared code used by download / online / offline scripts
+#####################################################################################
@@ -0,0 +1,100 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# URL of AMP API endpoint. 'domainIP' from config is normally bare host name and https is used,
+# full base URL with scheme (e.g. 'http://127.0.0.1:8080' of local mock server) is used as it is.
+def api_url(domainIP, path):
+	base = domainIP if "://" in domainIP else "https://{}".format(domainIP)
+	return "{}/{}".format(base.rstrip("/"), path.lstrip("/"))
+
+# Raised when API answers request with status code other than 200 (after retries)
+class APIError(Exception):
+	pass
+
+# Walk all pages of AMP API listing (e.g. /v1/groups) following 'metadata.links.next', yields items of 'data'.
+# Raises APIError if a page is not returned, so listing which stopped half way is never taken for a complete one.
+def iter_pages(limiter, session, url, **kwargs):
+	while url:
+		response = limiter.get(session, url, **kwargs)
+		if response.status_code != 200:
+			raise APIError("{} returned status code {}".format(url, response.status_code))
+		response_json = response.json()
+		for item in response_json.get('data', []):
+			yield item
+		url = response_json.get('metadata', {}).get('links', {}).get('next')
+
+#####################################################################################
+# PAGED LISTING
+#####################################################################################
+
+# Paginated AMP API listing (e.g. /v1/policies). First page is read when listing is created, so 'total' is known
+# straight away. Iterating yields items of all pages following 'metadata.links.next'; the next page is requested
+# in background thread as soon as a page arrives, while its items are being processed. 'session_factory' has
+# to return session usable from calling thread (requests.Session is not shared between threads).
+# After iteration 'complete' tells if every page was read, 'error' says why not.
+class PagedListing(object):
+	def __init__(self, limiter, session_factory, url, prefetch=True, **kwargs):
+		self.limiter = limiter
+		self.session_factory = session_factory
+		self.kwargs = kwargs
+		self.executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+		self.pages = 0
+		self.count = 0
+		self.complete = False
+		self.error = None
+		self.page = self._fetch(url)
+		self.total = None
+		if self.page is not None:
+			self.total = self.page.get('metadata', {}).get('results', {}).get('total')
+		self.pending = self._prefetch(self.page)
+
+	# Decoded page, None if API did not return it (error status, connection failed after retries, body is not JSON)
+	def _fetch(self, url):
+		try:
+			response = self.limiter.get(self.session_factory(), url, **self.kwargs)
+			if response.status_code != 200:
+				self.error = "{} returned status code {}".format(url, response.status_code)
+				return None
+			page = response.json()
+		except (OSError, ValueError) as e:
+			self.error = "{} failed: {}".format(url, e)
+			return None
+		self.pages += 1
+		return page
+
+	def _next_url(self, page):
+		return page.get('metadata', {}).get('links', {}).get('next')
+
+	# Start fetching page which follows 'page' in background, returns future (None if there is nothing to fetch)
+	def _prefetch(self, page):
+		if self.executor is None or page is None or not self._next_url(page):
+			return None
+		return self.executor.submit(self._fetch, self._next_url(page))
+
+	def __iter__(self):
+		page, self.page = self.page, None
+		try:
+			while page is not None:
+				next_url = self._next_url(page)
+				pending = self.pending
+				for item in page.get('data', []):
+					self.count += 1
+					yield item
+				if not next_url:
+					self.complete = True
+					break
+				page = pending.result() if pending is not None else self._fetch(next_url)
+				self.pending = self._prefetch(page)
+		finally:
+			self.close()
+
+	def close(self):
+		if self.executor is not None:
+			self.executor.shutdown(wait=True)
@@ -0,0 +1,178 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from itertools import islice
+from urllib.parse import unquote
+from amp_policy_kit.policyxml import parse_policy_config, parse_policy_outline, stream_config_items, AUDITED_SECTIONS
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+from amp_policy_kit.rules import POLICY_RULES, MISSING, compile_path, format_message
+from amp_policy_kit.findings import WILDCARD_RULES, FindingCollector
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Products which have security settings audited, other policy types (network, android...) are skipped
+AUDITED_PRODUCTS = ("windows", "mac", "linux")
+
+# Exclusion lists reported item by item, in report order
+EXCLUSION_ITEMS = ("exclusions/info/item", "exclusions/certissuer/name", "exclusions/process/item")
+
+# Policy XML larger than this has exclusion items streamed instead of parsed into dictionaries (tens of
+# thousands of exclusions) - memory stays flat for a second, shorter pass over the XML
+STREAM_BYTES = 1024 * 1024
+
+# Quick validation of key elements before they are parsed
+def validate_json_element(file_json, fields):
+	try:
+		x = file_json[fields]
+		return True
+	except KeyError:
+		return False
+	except TypeError:
+		return False
+
+# Policy XML does not say what product it belongs to, so it is guessed from paths in exclusions
+def detect_product(index):
+	if index.mentions('exclusions', 'Spotlight') or index.mentions('exclusions', 'Library'):
+		return "mac"
+	if index.mentions('exclusions', 'CSIDL_WINDOWS'):
+		return "windows"
+	return "linux"
+
+# Print exclusion, exclusions with wildcard are reported as findings
+def report_exclusion(out, kind, exclusion):
+	if ("*" in exclusion):
+		out.finding(WILDCARD_RULES[kind], "medium", "Wildcard {} exclusion: {}".format(kind, unquote(exclusion)), unquote(exclusion), line="\tWARNING, wildecard : {} ".format(unquote(exclusion)))
+	else:
+		out.text("\t {}".format(unquote(exclusion)))
+
+#####################################################################################
+# PARSERS
+#####################################################################################
+
+# Check security settings of the policy. Checks are defined as data in amp_policy_kit.rules
+def parse_agentsettings(json_agent,json_object,product_type,out):
+	if (product_type == 'windows' or product_type == 'mac' or product_type == 'linux'):
+		out.text("[+] Specific Policy Misconfiguration:")
+	for rule, value in POLICY_RULES.evaluate(json_object['ns0:Signature']['ns0:Object']['ns0:config'], product_type):
+		# Setting which is not in the policy at all has no value
+		out.finding(rule.rule_id, rule.severity, format_message(rule, value), None if value is MISSING else value)
+
+# Define parser for basic policy metadata stored in header
+def parse_header(json_header, product, out):
+	if(len(json_header) != 0 ):
+		if validate_json_element(json_header,'ns0:policy'):
+			# Findings which follow belong to this policy
+			out.begin_policy(json_header['ns0:policy'].get('ns0:uuid'), product, json_header['ns0:policy'].get('ns0:name'))
+			if(len(json_header['ns0:policy']) > 1 ):
+				out.text("[+] Policy Name: {}".format(json_header['ns0:policy']['ns0:name']))
+				out.text("[+] Policy Product: {}".format(product))
+				out.text("[+] Policy GUID: {}".format(json_header['ns0:policy']['ns0:uuid']))
+				out.text("[+] Policy Version: {}".format(json_header['ns0:policy']['ns0:serial_number']))
+				out.text("[+] Business GUID: {}".format(json_header['ns0:business']['ns0:uuid']))
+				out.last_change(json_header['ns0:policy']['ns0:updated'])
+
+# Define parser for policy exclusions. 'items(path)' returns items of exclusion list, None if there are none.
+def parse_exclusions(json_exclusion, items, out):
+	if(len(json_exclusion) != 0 ):
+		path_items = items('exclusions/info/item')
+		if path_items is not None:
+			out.text("[+] File Exclusions in policy: ")
+			for e in path_items:
+				report_exclusion(out, "path", e.split("|")[4])
+		else:
+			out.text("[+] No path exclusions are defined")
+		certificate_items = items('exclusions/certissuer/name')
+		if certificate_items is not None:
+			out.text("[+] Certificate Exclusions in policy: ")
+			for e in certificate_items:
+				report_exclusion(out, "certificate", e)
+		else:
+			out.text("[+] No certificate issuer exclusions are defined")
+
+		process_items = items('exclusions/process/item')
+		if process_items is not None:
+			out.text("[+] Process Exclusions in policy: ")
+			for e in process_items:
+				report_exclusion(out, "process", e)
+		else:
+			out.text("[+] No process exclusions are defined")
+
+# Exclusion items streamed out of policy XML by second pass, handed out list by list in report order
+class StreamedItems(object):
+	def __init__(self, xml_data, counts):
+		self.counts = counts
+		self.stream = stream_config_items(xml_data, [(path, counts.get(path, 0)) for path in EXCLUSION_ITEMS])
+
+	def __call__(self, path):
+		if not self.counts.get(path):
+			return None
+		return (item for item_path, item in islice(self.stream, self.counts[path]))
+
+#####################################################################################
+# AUDIT
+#####################################################################################
+
+# Parsed policy (see parse_policy_config) ready to be audited. Raises KeyError if policy has no header,
+# e.g. Network-only policy. Product is detected from exclusions unless given (online audit gets it from API).
+# 'streamed' is (policy XML, item counts, markers found) of exclusion items left out by parse_policy_outline().
+class PolicyAudit(object):
+	def __init__(self, json_object, product=None, streamed=None):
+		self.json_object = json_object
+		config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		self.config = config
+		# Policy header is in every policy
+		self.header = config['ns0:janus']
+		# Index policy structure once, so parsers do not have to search through (stringified) subtrees
+		self.index = PolicyIndex(config, PRODUCT_MARKERS if product is None else ())
+		self.streamed = streamed
+		if streamed is not None:
+			self.index.add_mentions('exclusions', streamed[2])
+		self.exclusions = config['ns0:exclusions'] if validate_json_element(config, 'ns0:exclusions') else None
+		self.agentconfig = config['ns0:agent'] if validate_json_element(config, 'ns0:agent') else None
+		self.product = product if product is not None else detect_product(self.index)
+
+	# Audit of raw policy XML (bytes, str or file object). Exclusion items of big policies are only counted
+	# while the XML is parsed and streamed out of it again as they are reported.
+	@classmethod
+	def from_xml(cls, xml_data, product=None):
+		if hasattr(xml_data, "read"):
+			xml_data = xml_data.read()
+		if len(xml_data) < STREAM_BYTES:
+			return cls(parse_policy_config(xml_data), product)
+		json_object, counts, marked = parse_policy_outline(xml_data, AUDITED_SECTIONS, EXCLUSION_ITEMS, PRODUCT_MARKERS if product is None else ())
+		return cls(json_object, product, (xml_data, counts, marked))
+
+	# Items of exclusion list of parsed policy
+	def indexed_items(self, path):
+		if not self.index.has(path):
+			return None
+		value = self.config
+		for key in compile_path(path):
+			value = value[key]
+		return self.index.items(path, value)
+
+	# Report policy to emitter 'out'. Policies without exclusions and agent settings, or of products
+	# which are not audited, report nothing.
+	def report(self, out):
+		if self.product not in AUDITED_PRODUCTS:
+			return
+		if self.exclusions is not None:
+			parse_header(self.header, self.product, out)
+			parse_exclusions(self.exclusions, self.indexed_items if self.streamed is None else StreamedItems(self.streamed[0], self.streamed[1]), out)
+			if self.agentconfig is not None:
+				parse_agentsettings(self.agentconfig, self.json_object, self.product, out)
+		# Attempt to parse settings even if exclusion list is not present
+		elif self.agentconfig is not None:
+			parse_header(self.header, self.product, out)
+			parse_agentsettings(self.agentconfig, self.json_object, self.product, out)
+
+# Library entry point - audit raw policy XML (bytes, str or file object) and return list of Finding records,
+# nothing is printed. Product is detected from exclusions if not given. Raises KeyError if policy has no
+# security settings (e.g. Network-only policy) and xml.etree.ElementTree.ParseError if XML is broken.
+def audit_policy(xml_data, product=None):
+	out = FindingCollector()
+	PolicyAudit.from_xml(xml_data, product).report(out)
+	return out.findings
@@ -0,0 +1,127 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import json
+import time
+import hashlib
+from amp_policy_kit import audit, policyxml, policyindex, rules, findings
+from amp_policy_kit.manifest import atomic_write
+from amp_policy_kit.rules import POLICY_RULES
+from amp_policy_kit.findings import json_value
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Bump when layout of cache entries changes
+CACHE_FORMAT = 1
+
+# Modules whose code decides what an audit reports, entries written by any other version of them are not replayed
+REPORT_MODULES = (audit, policyxml, policyindex, rules, findings)
+
+# Hash of source files of the code reports depend on, computed once per cache (not per policy)
+def code_version(paths):
+	digest = hashlib.sha256()
+	for path in paths:
+		with open(path, "rb") as f:
+			digest.update(f.read())
+		digest.update(b"\0")
+	return digest.hexdigest()[:16]
+
+ENTRY_SUFFIX = ".json"
+
+#####################################################################################
+# AUDIT CACHE
+#####################################################################################
+
+# On-disk cache of audit reports, content-addressed by hash of raw policy XML, rule set version and anything
+# else report depends on (e.g. product type reported by API), and by hash of the reporting code - REPORT_MODULES
+# and 'sources' (script which prints part of the report itself). Entry holds recorded emitter events of the audit,
+# so on a hit report is replayed without parsing policy at all. Entries live in two level folder structure
+# (<dir>/ab/abcdef....json), are written atomically and are safe to share between worker processes.
+# Least recently used entries are evicted once cache grows over 'max_bytes' or entry is older than 'max_age' seconds.
+class AuditCache(object):
+	def __init__(self, folder, max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 3600, clock=time.time, sources=()):
+		self.folder = folder
+		self.version = code_version([module.__file__ for module in REPORT_MODULES] + list(sources))
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self.clock = clock
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(folder, exist_ok=True)
+
+	def key(self, xml_data, *extra):
+		digest = hashlib.sha256()
+		digest.update("{}|{}|{}|{}".format(CACHE_FORMAT, self.version, POLICY_RULES.version, "|".join(str(e) for e in extra)).encode("utf-8"))
+		digest.update(b"\0")
+		digest.update(xml_data)
+		return digest.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.folder, key[:2], key + ENTRY_SUFFIX)
+
+	# Returns (result, events) or None on miss. Expired entry is a miss.
+	def get(self, key):
+		path = self._path(key)
+		try:
+			if self.max_age is not None and self.clock() - os.path.getmtime(path) > self.max_age:
+				self.misses += 1
+				return None
+			with open(path, "rb") as f:
+				entry = json.loads(f.read().decode("utf-8"))
+			# Touch entry so eviction drops least recently used entries first
+			os.utime(path)
+		except (OSError, ValueError):
+			self.misses += 1
+			return None
+		self.hits += 1
+		return entry["result"], [(name, tuple(args)) for name, args in entry["events"]]
+
+	def put(self, key, result, events):
+		path = self._path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		# Finding values which are not JSON data (marker of missing setting) are replayed as None
+		atomic_write(path, json.dumps({"result": result, "events": events}, separators=(",", ":"), default=json_value))
+
+	# Remove expired entries and then least recently used ones until cache fits into 'max_bytes'.
+	# Returns number of removed entries.
+	def prune(self):
+		now = self.clock()
+		entries = []
+		total = 0
+		removed = 0
+		for root, dirs, files in os.walk(self.folder):
+			for name in files:
+				if not name.endswith(ENTRY_SUFFIX):
+					continue
+				path = os.path.join(root, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				if self.max_age is not None and now - st.st_mtime > self.max_age:
+					removed += self._remove(path)
+					continue
+				entries.append((st.st_mtime, st.st_size, path))
+				total += st.st_size
+		if self.max_bytes is not None and total > self.max_bytes:
+			entries.sort()
+			for mtime, size, path in entries:
+				if total <= self.max_bytes:
+					break
+				removed += self._remove(path)
+				total -= size
+		return removed
+
+	def _remove(self, path):
+		try:
+			os.remove(path)
+			return 1
+		except OSError:
+			return 0
+
+	def summary(self):
+		return "Audit cache: {} hits, {} misses".format(self.hits, self.misses)
@@ -0,0 +1,135 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import json
+import time
+from collections import deque
+from amp_policy_kit.manifest import atomic_write
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Name of checkpoint file kept in output folder of download script (next to store it is '<store>.checkpoint.json')
+CHECKPOINT_NAME = "download-checkpoint.json"
+
+# Seconds between checkpoint writes - hard kill loses at most this much of downloads, manifest of big
+# tenant is not rewritten after every policy
+CHECKPOINT_SECONDS = 15
+
+# Policies retried after the listing pass. If that many fail, API is not serving policies at all and
+# run is better stopped (and resumed later) than spending budget on requests which keep failing.
+RETRY_QUEUE_LIMIT = 100
+
+# Checkpoint of download into output folder or policy store
+def checkpoint_path(folder=None, store=None):
+	if store is not None:
+		return store + ".checkpoint.json"
+	return os.path.join(folder, CHECKPOINT_NAME)
+
+#####################################################################################
+# CHECKPOINT
+#####################################################################################
+
+# Progress of a download run: GUID and serial number of every policy completed by the run (and whether it
+# was pretty printed), failed policies and options of the run. Manifest (or store) is saved before the
+# checkpoint, so checkpoint never claims a policy which is not on disk. Removed once run completes.
+class DownloadCheckpoint(object):
+	def __init__(self, path, manifest, options, clock=time.monotonic):
+		self.path = path
+		self.manifest = manifest
+		self.options = options
+		self.clock = clock
+		# guid -> {"serial_number", "pretty"}
+		self.completed = {}
+		# guid -> last error of policies which could not be downloaded
+		self.failed = {}
+		self.saved_at = clock()
+
+	# Checkpoint of interrupted run, None if there is none (or it is broken - run then starts over)
+	@classmethod
+	def load(cls, path, manifest, clock=time.monotonic):
+		if not os.path.exists(path):
+			return None
+		with open(path, "r") as f:
+			try:
+				data = json.load(f)
+			except ValueError:
+				return None
+		checkpoint = cls(path, manifest, data.get("options", {}), clock)
+		checkpoint.completed = data.get("completed", {})
+		checkpoint.failed = data.get("failed", {})
+		return checkpoint
+
+	# Policy was completed by the run and did not change since
+	def is_completed(self, guid, serial_number):
+		entry = self.completed.get(guid)
+		return entry is not None and entry["serial_number"] == str(serial_number)
+
+	def is_pretty(self, guid):
+		return guid in self.completed and self.completed[guid]["pretty"]
+
+	def complete(self, guid, serial_number):
+		self.completed[guid] = {"serial_number": str(serial_number), "pretty": False}
+		self.failed.pop(guid, None)
+		self.save_due()
+
+	def prettified(self, guid):
+		self.completed[guid]["pretty"] = True
+		self.save_due()
+
+	def fail(self, guid, error):
+		self.failed[guid] = error
+
+	# Save if the last save is older than CHECKPOINT_SECONDS
+	def save_due(self):
+		if self.clock() - self.saved_at >= CHECKPOINT_SECONDS:
+			self.save()
+
+	def save(self):
+		self.manifest.save()
+		atomic_write(self.path, json.dumps({"options": self.options, "completed": self.completed, "failed": self.failed}, indent=1, sort_keys=True))
+		self.saved_at = self.clock()
+
+	def remove(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+#####################################################################################
+# RETRY QUEUE
+#####################################################################################
+
+# Policies which failed to download, retried once the listing pass is done (rate limit window has moved on
+# by then). Every policy gets at most 'retries' more attempts, queue holds at most 'limit' policies.
+class RetryQueue(object):
+	def __init__(self, retries=2, limit=RETRY_QUEUE_LIMIT):
+		self.retries = retries
+		self.limit = limit
+		self.queue = deque()
+		self.attempts = {}
+		# guid -> last error of policies which ran out of retries
+		self.failed = {}
+
+	def __len__(self):
+		return len(self.queue)
+
+	# Queue policy after failed attempt, policy which ran out of retries is recorded as failed.
+	# Returns False if queue is full.
+	def put(self, policy_detail, error):
+		guid = policy_detail['guid']
+		self.attempts[guid] = self.attempts.get(guid, 0) + 1
+		if self.attempts[guid] > self.retries:
+			self.failed[guid] = error
+			return True
+		if len(self.queue) >= self.limit:
+			self.failed[guid] = error
+			return False
+		self.queue.append(policy_detail)
+		return True
+
+	# Next policy to retry and number of its attempt
+	def get(self):
+		policy_detail = self.queue.popleft()
+		return policy_detail, self.attempts[policy_detail['guid']] + 1
@@ -0,0 +1,110 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from amp_policy_kit.api import api_url, PagedListing
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Largest page AMP API serves - 100k computers are listed in 200 requests
+COMPUTERS_PAGE_SIZE = 500
+
+# Findings affecting the same connectors are ranked by severity
+SEVERITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+#####################################################################################
+# COMPUTER INDEX
+#####################################################################################
+
+# Number of connectors by policy (and by group and policy), built from single pass over /v1/computers. Computers are
+# counted as pages arrive and are not kept, so memory depends on number of groups and policies, not on computers.
+class ComputerIndex(object):
+	def __init__(self):
+		# policy guid -> computers, every computer record says which policy it runs
+		self.by_policy = {}
+		# group guid -> {policy guid -> computers}, policy guid is None if listing does not say (only shown in summary)
+		self.by_group = {}
+		self.computers = 0
+		# Computers listed without policy, group alone does not tell which of its policies (products) they run
+		self.unassigned = 0
+		self.pages = 0
+		self.complete = True
+		self.error = None
+
+	def add(self, computer):
+		self.computers += 1
+		policy = computer.get('policy')
+		policy_guid = policy.get('guid') if isinstance(policy, dict) else None
+		counts = self.by_group.setdefault(computer.get('group_guid'), {})
+		counts[policy_guid] = counts.get(policy_guid, 0) + 1
+		if policy_guid is None:
+			self.unassigned += 1
+		else:
+			self.by_policy[policy_guid] = self.by_policy.get(policy_guid, 0) + 1
+
+	# Connectors running policy. Does not depend on group listing, so it is right even if some groups could not be read.
+	# Computers listed without policy are not counted.
+	def endpoints_for(self, policy_guid):
+		return self.by_policy.get(policy_guid, 0)
+
+	def summary(self):
+		return "Computers: {} in {} groups ({} without policy, not counted), listed in {} requests".format(self.computers, len(self.by_group), self.unassigned, self.pages)
+
+	# Page through /v1/computers once, next page is fetched while current one is counted
+	@classmethod
+	def build(cls, limiter, session_factory, domainIP, **kwargs):
+		index = cls()
+		listing = PagedListing(limiter, session_factory, api_url(domainIP, 'v1/computers?limit={}'.format(COMPUTERS_PAGE_SIZE)), **kwargs)
+		for computer in listing:
+			index.add(computer)
+		index.pages = listing.pages
+		index.complete = listing.complete
+		index.error = listing.error
+		return index
+
+#####################################################################################
+# IMPACT
+#####################################################################################
+
+# Wraps emitter so every finding carries number of connectors using the policy, and keeps findings of
+# each policy and rule (not every finding) to rank them by blast radius at the end of the run.
+# 'endpoints_for' returns number of connectors of policy GUID, it can be set once computers are listed.
+class ImpactEmitter(object):
+	def __init__(self, emitter, endpoints_for=None):
+		self.emitter = emitter
+		self.endpoints_for = endpoints_for
+		# (policy guid, rule id) -> [endpoints, findings, first finding]
+		self.impact = {}
+
+	def __getattr__(self, name):
+		return getattr(self.emitter, name)
+
+	def begin_policy(self, guid, product, name=None):
+		self.emitter.begin_policy(guid, product, name)
+		if self.endpoints_for is not None:
+			self.emitter.endpoints = self.endpoints_for(guid)
+
+	def finding(self, rule_id, severity, message, value=None, line=None):
+		finding = self.emitter.finding(rule_id, severity, message, value, line)
+		entry = self.impact.get((finding.policy_guid, rule_id))
+		if entry is None:
+			self.impact[(finding.policy_guid, rule_id)] = [finding.endpoints or 0, 1, finding]
+		else:
+			entry[1] += 1
+		return finding
+
+	# Findings grouped by policy and rule, most connectors first: list of (endpoints, findings, first finding)
+	def ranking(self, limit=None):
+		entries = sorted(self.impact.values(), key=lambda e: (-e[0], SEVERITY_ORDER.get(e[2].severity, 3), e[2].policy_name or "", e[2].rule_id))
+		return [tuple(e) for e in entries[:limit]]
+
+	# Connectors affected by each rule (policies counted once per rule): list of (rule id, endpoints, policies)
+	def rule_ranking(self):
+		rules = {}
+		for endpoints, count, finding in self.impact.values():
+			entry = rules.setdefault(finding.rule_id, [0, 0])
+			entry[0] += endpoints
+			entry[1] += 1
+		return sorted(((rule_id, e[0], e[1]) for rule_id, e in rules.items()), key=lambda r: (-r[1], r[0]))
@@ -0,0 +1,376 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import re
+from urllib.parse import unquote
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# How exclusion path is matched
+PREFIX = "prefix"
+GLOB = "glob"
+REGEX = "regex"
+
+# Windows exclusions can start with CSIDL variable instead of folder. Per-user folders expand to wildcard.
+CSIDL_FOLDERS = {
+	"CSIDL_WINDOWS": "C:\\Windows",
+	"CSIDL_SYSTEM": "C:\\Windows\\System32",
+	"CSIDL_SYSTEMX86": "C:\\Windows\\SysWOW64",
+	"CSIDL_PROGRAM_FILES": "C:\\Program Files",
+	"CSIDL_PROGRAM_FILESX86": "C:\\Program Files (x86)",
+	"CSIDL_PROGRAM_FILES_COMMON": "C:\\Program Files\\Common Files",
+	"CSIDL_PROGRAM_FILES_COMMONX86": "C:\\Program Files (x86)\\Common Files",
+	"CSIDL_COMMON_APPDATA": "C:\\ProgramData",
+	"CSIDL_COMMON_DOCUMENTS": "C:\\Users\\Public\\Documents",
+	"CSIDL_PROFILE": "C:\\Users\\*",
+	"CSIDL_APPDATA": "C:\\Users\\*\\AppData\\Roaming",
+	"CSIDL_LOCAL_APPDATA": "C:\\Users\\*\\AppData\\Local",
+}
+_CSIDL = re.compile(r"^(CSIDL_[A-Z0-9_]+)(?=\\|$)")
+
+# Type (1st field) of path exclusion item - plain path, or wildcard / regular expression
+PATH_ITEM = "1"
+PATTERN_ITEM = "3"
+
+# Things which do not appear in wildcard but do in regular expression
+_REGEX_HINTS = re.compile(r"^\^|\$$|\.\*|\.\+|\\\\|\\\.|\[[^\]]*\]|\(\?|\{\d+(,\d*)?\}")
+
+# Separator of paths for given product
+def separator(product):
+	return "\\" if product == "windows" else "/"
+
+# Exclusion item is pipe delimited, path is 5th field (URL quoted)
+def decode_exclusion(item):
+	fields = item.split("|")
+	if len(fields) < 5:
+		return None, unquote(item)
+	return fields[0], unquote(fields[4])
+
+# Process exclusion item is pipe delimited as well, executable path is 4th field. Its 1st field is not
+# the path type, so type is not returned.
+def decode_process_exclusion(item):
+	fields = item.split("|")
+	if len(fields) < 4:
+		return None, unquote(item)
+	return None, unquote(fields[3])
+
+# Expand leading CSIDL variable of Windows exclusion
+def expand_csidl(path):
+	m = _CSIDL.match(path)
+	if m and m.group(1) in CSIDL_FOLDERS:
+		return CSIDL_FOLDERS[m.group(1)] + path[m.end():]
+	return path
+
+# Regular expression, wildcard (glob) or plain folder / file prefix. Item type tells plain paths (which may
+# contain anything, e.g. 'C:\Users\bob\.vscode\') from patterns, only patterns are told apart by their characters.
+# Without item type (process exclusions, malformed items) style is guessed from characters alone.
+def classify(path, kind=None):
+	if kind == PATH_ITEM:
+		return PREFIX
+	if _REGEX_HINTS.search(path):
+		return REGEX
+	if kind == PATTERN_ITEM or "*" in path or "?" in path:
+		return GLOB
+	return PREFIX
+
+# Wildcard to regular expression. '*' and '?' do not cross path separator, '**' does.
+def glob_to_regex(path, sep):
+	esc_sep = re.escape(sep)
+	out = []
+	i = 0
+	while i < len(path):
+		c = path[i]
+		if path.startswith("**", i):
+			out.append(".*")
+			i += 2
+			continue
+		if c == "*":
+			out.append("[^{}]*".format(esc_sep))
+		elif c == "?":
+			out.append("[^{}]".format(esc_sep))
+		else:
+			out.append(re.escape(c))
+		i += 1
+	# Wildcard for a file has to match whole name, folder covers everything below it
+	if not path.endswith(sep):
+		out.append("(?:{}|$)".format(esc_sep))
+	return "".join(out)
+
+# True if pattern has '|' outside of groups and character classes - alternatives may start with anything
+def top_level_alternation(pattern):
+	depth = 0
+	in_class = False
+	i = 0
+	while i < len(pattern):
+		c = pattern[i]
+		if c == "\\":
+			i += 2
+			continue
+		if in_class:
+			if c == "]":
+				in_class = False
+		elif c == "[":
+			in_class = True
+			# ']' right after '[' (or '[^') is a literal member of the class
+			if pattern.startswith("]", i + 1):
+				i += 1
+			elif pattern.startswith("^]", i + 1):
+				i += 2
+		elif c == "(":
+			depth += 1
+		elif c == ")":
+			depth -= 1
+		elif c == "|" and depth == 0:
+			return True
+		i += 1
+	return False
+
+# Literal text regular expression starts with (up to first special character), with escapes resolved.
+# Empty if pattern has top level alternatives, literal text of the first one says nothing about the others.
+def literal_prefix(pattern):
+	if top_level_alternation(pattern):
+		return ""
+	out = []
+	i = 1 if pattern.startswith("^") else 0
+	while i < len(pattern):
+		c = pattern[i]
+		if c == "\\" and i + 1 < len(pattern):
+			n = pattern[i + 1]
+			if n.isalnum():
+				break
+			out.append(n)
+			i += 2
+			continue
+		if c in ".^$*+?{}[]()|":
+			# Quantifier applies to previous character, so it is not part of literal prefix either
+			if c in "*?{" and out:
+				out.pop()
+			break
+		out.append(c)
+		i += 1
+	return "".join(out)
+
+#####################################################################################
+# EXCLUSION
+#####################################################################################
+
+# Single path exclusion of a policy
+class Exclusion(object):
+	def __init__(self, index, item, product, decode=decode_exclusion):
+		self.index = index
+		self.item = item
+		self.kind, self.path = decode(item)
+		self.sep = separator(product)
+		self.ignore_case = product == "windows"
+		path = expand_csidl(self.path) if product == "windows" else self.path
+		self.style = classify(path, self.kind)
+		if self.style == PREFIX and "*" in path:
+			self.style = GLOB
+		self.expanded = path
+		self.pattern = None
+		self.regex = None
+		self.error = None
+		if self.style == REGEX:
+			self.pattern = path
+		elif self.style == GLOB:
+			self.pattern = glob_to_regex(path, self.sep)
+		if self.pattern is not None:
+			try:
+				self.regex = re.compile(self.pattern, re.IGNORECASE if self.ignore_case else 0)
+			except re.error as e:
+				self.error = str(e)
+
+	# Path split into (case folded) components, trailing separator does not make a difference
+	def components(self):
+		if self.style == PREFIX:
+			return split_path(self.expanded, self.sep, self.ignore_case)
+		# For wildcards and regular expressions only the literal beginning is known - complete components of it
+		if self.style == REGEX:
+			literal = literal_prefix(self.pattern)
+		else:
+			literal = self.expanded.split("*")[0].split("?")[0]
+		parts = split_path(literal, self.sep, self.ignore_case)
+		if literal and not literal.endswith(self.sep) and parts:
+			parts = parts[:-1]
+		return parts
+
+	def __repr__(self):
+		return "Exclusion({!r}, {})".format(self.path, self.style)
+
+def split_path(path, sep, ignore_case):
+	if ignore_case:
+		path = path.lower()
+	return tuple(p for p in path.split(sep) if p != "")
+
+#####################################################################################
+# MATCHER
+#####################################################################################
+
+# All path exclusions of one policy compiled for fast matching. Plain prefixes go into a trie of path components,
+# walked once per path. Wildcards and regular expressions hang in the same trie under the literal folder they start
+# with, so only those on the walked branch are tried. The ones without literal folder are tried together as a single
+# combined expression, which rejects paths matching none of them in one pass.
+# Like plain exclusions, wildcards and regular expressions are matched from the start of the path.
+class ExclusionMatcher(object):
+	def __init__(self, items, product, decode=decode_exclusion):
+		self.product = product
+		self.sep = separator(product)
+		self.ignore_case = product == "windows"
+		self.exclusions = [Exclusion(i, item, product, decode) for i, item in enumerate(items)]
+		self.invalid = [e for e in self.exclusions if e.style != PREFIX and e.regex is None]
+		self.patterns = [e for e in self.exclusions if e.regex is not None]
+		# component -> [exclusions ending at this component, patterns starting with it, child components, combined patterns]
+		self.trie = {}
+		self.root_patterns = []
+		for e in self.exclusions:
+			if e.style != PREFIX and e.regex is None:
+				continue
+			parts = e.components()
+			if not parts:
+				if e.style != PREFIX:
+					self.root_patterns.append(e)
+				continue
+			node = self.trie
+			for part in parts[:-1]:
+				node = node.setdefault(part, [[], [], {}, None])[2]
+			entry = node.setdefault(parts[-1], [[], [], {}, None])
+			if e.style == PREFIX:
+				entry[0].append(e.index)
+			else:
+				entry[1].append(e)
+		self.combined = self._combine(self.root_patterns)
+		stack = [self.trie]
+		while stack:
+			node = stack.pop()
+			for entry in node.values():
+				entry[3] = self._combine(entry[1])
+				stack.append(entry[2])
+
+	# Single expression matching if any of the patterns does
+	def _combine(self, patterns):
+		if len(patterns) < 2:
+			return None
+		try:
+			return re.compile("|".join("(?:{})".format(e.pattern) for e in patterns), re.IGNORECASE if self.ignore_case else 0)
+		except re.error:
+			# e.g. numbered back references do not survive concatenation, patterns are tried one by one then
+			return None
+
+	# Indexes of exclusions matching given path, in definition order
+	def match(self, path):
+		matched = []
+		if self.ignore_case and "/" in path:
+			path = path.replace("/", "\\")
+		node = self.trie
+		for part in split_path(path, self.sep, self.ignore_case):
+			entry = node.get(part)
+			if entry is None:
+				break
+			matched.extend(entry[0])
+			if entry[1] and (entry[3] is None or entry[3].match(path)):
+				for e in entry[1]:
+					if e.regex.match(path):
+						matched.append(e.index)
+			node = entry[2]
+		if self.root_patterns and (self.combined is None or self.combined.match(path)):
+			for e in self.root_patterns:
+				if e.regex.match(path):
+					matched.append(e.index)
+		if len(matched) > 1:
+			matched.sort()
+		return matched
+
+	# Exclusions which do not add anything because another exclusion already covers them.
+	# Returns list of (exclusion, covering exclusion, reason).
+	def shadowing(self):
+		found = []
+		seen = {}
+		for e in self.exclusions:
+			if e.style == PREFIX:
+				key = (e.style, e.components())
+			else:
+				key = (e.style, e.expanded.lower() if self.ignore_case else e.expanded)
+			if key in seen:
+				found.append((e, seen[key], "duplicate"))
+			else:
+				seen[key] = e
+		duplicates = set(id(e) for e, by, reason in found)
+		for e in self.exclusions:
+			if id(e) in duplicates or e in self.invalid:
+				continue
+			by = self._covering_prefix(e)
+			if by is not None:
+				found.append((e, by, "below folder excluded by"))
+				continue
+			if e.style == PREFIX:
+				# Plain path matched by wildcard / regular expression together with anything below it
+				probe = self.sep.join(e.components())
+				if self.product != "windows":
+					probe = self.sep + probe
+				for other in self.patterns:
+					if other.regex.match(probe) and other.regex.match(probe + self.sep + "probe"):
+						found.append((e, other, "matched by pattern"))
+						break
+		found.sort(key=lambda f: f[0].index)
+		return found
+
+	# Plain prefix exclusion which covers everything given exclusion can match
+	def _covering_prefix(self, e):
+		parts = e.components()
+		node = self.trie
+		depth = len(parts) if e.style == PREFIX else len(parts) + 1
+		for i, part in enumerate(parts):
+			entry = node.get(part)
+			if entry is None:
+				return None
+			# Prefix exclusion itself is terminal at its own last component, it only counts if it is shorter
+			for index in entry[0]:
+				if index != e.index and i + 1 < depth:
+					return self.exclusions[index]
+			node = entry[2]
+		return None
+
+#####################################################################################
+# CORPUS
+#####################################################################################
+
+# Per policy statistics of path corpus scan
+class CorpusStats(object):
+	def __init__(self, matcher, samples=5):
+		self.matcher = matcher
+		self.samples = samples
+		self.excluded = 0
+		# exclusion index -> [paths matched, paths matched by this exclusion only, sample paths]
+		self.by_exclusion = dict((e.index, [0, 0, []]) for e in matcher.exclusions)
+
+	def add(self, path, matched):
+		self.excluded += 1
+		for index in matched:
+			entry = self.by_exclusion[index]
+			entry[0] += 1
+			if len(matched) == 1:
+				entry[1] += 1
+			if len(entry[2]) < self.samples:
+				entry[2].append(path)
+
+# Stream path corpus (iterable of lines) through matchers of several policies. Nothing but counters and
+# a few sample paths is kept, 'on_match(policy_key, path)' callback receives every excluded path.
+# Returns (number of paths, {policy_key: CorpusStats}).
+def scan_corpus(matchers, lines, samples=5, on_match=None):
+	stats = dict((key, CorpusStats(matcher, samples)) for key, matcher in matchers.items())
+	total = 0
+	for line in lines:
+		path = line.rstrip("\r\n")
+		if not path:
+			continue
+		total += 1
+		for key, matcher in matchers.items():
+			matched = matcher.match(path)
+			if matched:
+				stats[key].add(path, matched)
+				if on_match is not None:
+					on_match(key, path)
+	return total, stats
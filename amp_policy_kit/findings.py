@@ -0,0 +1,213 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import io
+import csv
+import json
+import datetime
+from collections import namedtuple
+
+#####################################################################################
+# FINDING
+#####################################################################################
+
+# Single audit finding. Immutable and without per-instance dictionary, so millions of them are cheap.
+# 'endpoints' is number of connectors using the policy, only known to online audit with --impact.
+class Finding(namedtuple("Finding", ["policy_guid", "policy_name", "product", "rule_id", "severity", "message", "value", "endpoints"], defaults=(None,))):
+	__slots__ = ()
+
+	def as_dict(self):
+		return dict(self._asdict())
+
+# Findings which are not driven by settings rules
+WILDCARD_RULES = {
+	"path": "exclusion-wildcard-path",
+	"certificate": "exclusion-wildcard-certificate",
+	"process": "exclusion-wildcard-process",
+}
+
+# SARIF has only 'error', 'warning' and 'note' levels
+SARIF_LEVELS = {"high": "error", "medium": "warning", "low": "note"}
+
+# Observed values which are not JSON data are written as null - e.g. marker object rules engine uses for
+# missing setting, the setting has no value to report
+def json_value(value):
+	return None
+
+#####################################################################################
+# EMITTERS
+#####################################################################################
+
+# Human readable report, exactly as scripts always printed it. Also base class for other formats.
+# Parsers call begin_policy() / text() / finding() / end_policy() while auditing, records are written
+# as they come to (buffered) output stream so nothing is kept in memory across policies.
+class TextEmitter(object):
+	def __init__(self, stream=None):
+		self.stream = stream if stream is not None else sys.stdout
+		self.policy_guid = None
+		self.policy_name = None
+		self.product = None
+		# Connectors using current policy, set by ImpactEmitter (amp_policy_kit.computers)
+		self.endpoints = None
+		self.count = 0
+
+	# Called once before first policy (headers of CSV / SARIF)
+	def start(self):
+		pass
+
+	# Called once after last policy
+	def close(self):
+		self.stream.flush()
+		if self.stream is not sys.stdout:
+			self.stream.close()
+
+	def begin_policy(self, guid, product, name=None):
+		self.policy_guid = guid
+		self.policy_name = name
+		self.product = product
+
+	def end_policy(self):
+		self.policy_guid = None
+		self.policy_name = None
+		self.product = None
+		self.endpoints = None
+
+	# Line which is only part of human readable report
+	def text(self, line):
+		self.stream.write(line + "\n")
+
+	# Progress / summary line of the script, kept out of machine readable output
+	def status(self, line):
+		self.stream.write(line + "\n")
+
+	# Age of last policy change is worked out when the line is written, so replayed (cached) reports stay correct
+	def last_change(self, timestamp):
+		current_time_utc = datetime.datetime.utcnow()
+		converted_d1 = datetime.datetime.fromtimestamp(round(int(timestamp) / 1000))
+		self.text("[!] WARNING, Last policy change: {} ago".format((current_time_utc - converted_d1)))
+
+	# Record finding of current policy, 'line' is how it looks in human readable report
+	def finding(self, rule_id, severity, message, value=None, line=None):
+		finding = Finding(self.policy_guid, self.policy_name, self.product, rule_id, severity, message, value, self.endpoints)
+		self.count += 1
+		self.write_finding(finding, line if line is not None else "\t[!]WARNING, " + message)
+		return finding
+
+	def write_finding(self, finding, line):
+		self.stream.write(line + "\n")
+
+# Base for machine readable formats - text lines are dropped and status goes to stderr
+class _RecordEmitter(TextEmitter):
+	def text(self, line):
+		pass
+
+	def status(self, line):
+		sys.stderr.write(line + "\n")
+
+# One JSON object per line
+class JsonLinesEmitter(_RecordEmitter):
+	def write_finding(self, finding, line):
+		self.stream.write(json.dumps(finding.as_dict(), sort_keys=True, default=json_value) + "\n")
+
+class CsvEmitter(_RecordEmitter):
+	def start(self):
+		self.writer = csv.writer(self.stream, lineterminator="\n")
+		self.writer.writerow(Finding._fields)
+
+	def write_finding(self, finding, line):
+		self.writer.writerow(["" if v is None else v for v in finding])
+
+# SARIF 2.1.0 log. Results are streamed one by one, tool section (with rules seen) is written at the end,
+# JSON does not care about key order.
+class SarifEmitter(_RecordEmitter):
+	def start(self):
+		self.rules = {}
+		self.stream.write('{"$schema": "https://json.schemastore.org/sarif-2.1.0.json", "version": "2.1.0", "runs": [{"results": [\n')
+
+	def write_finding(self, finding, line):
+		if finding.rule_id not in self.rules:
+			self.rules[finding.rule_id] = finding
+		result = {
+			"ruleId": finding.rule_id,
+			"level": SARIF_LEVELS.get(finding.severity, "warning"),
+			"message": {"text": finding.message},
+			"locations": [{"logicalLocations": [{"name": finding.policy_name, "fullyQualifiedName": finding.policy_guid, "kind": "resource"}]}],
+			"properties": {"product": finding.product, "value": finding.value, "endpoints": finding.endpoints},
+		}
+		self.stream.write((",\n" if self.count > 1 else "") + json.dumps(result, sort_keys=True, default=json_value))
+
+	def close(self):
+		rules = [{"id": f.rule_id, "shortDescription": {"text": f.message}, "defaultConfiguration": {"level": SARIF_LEVELS.get(f.severity, "warning")}} for f in self.rules.values()]
+		tool = {"driver": {"name": "amp-policy-kit", "informationUri": "https://github.com/CiscoCXSecurity/amp-policy-kit", "rules": rules}}
+		self.stream.write('\n], "tool": ' + json.dumps(tool, sort_keys=True) + '}]}\n')
+		_RecordEmitter.close(self)
+
+# Collects calls in child process (batch mode), replayed into real emitter by parent in policy order
+class RecordingEmitter(TextEmitter):
+	def __init__(self):
+		TextEmitter.__init__(self, io.StringIO())
+		self.events = []
+
+	def begin_policy(self, guid, product, name=None):
+		TextEmitter.begin_policy(self, guid, product, name)
+		self.events.append(("begin_policy", (guid, product, name)))
+
+	def end_policy(self):
+		TextEmitter.end_policy(self)
+		self.events.append(("end_policy", ()))
+
+	def text(self, line):
+		self.events.append(("text", (line,)))
+
+	def status(self, line):
+		self.events.append(("status", (line,)))
+
+	def last_change(self, timestamp):
+		self.events.append(("last_change", (timestamp,)))
+
+	def finding(self, rule_id, severity, message, value=None, line=None):
+		self.events.append(("finding", (rule_id, severity, message, value, line)))
+
+# Keeps Finding records in memory and drops report lines, used by library API (amp_policy_kit.audit.audit_policy)
+class FindingCollector(TextEmitter):
+	def __init__(self):
+		TextEmitter.__init__(self, io.StringIO())
+		self.findings = []
+
+	def close(self):
+		pass
+
+	def text(self, line):
+		pass
+
+	def status(self, line):
+		pass
+
+	def last_change(self, timestamp):
+		pass
+
+	def write_finding(self, finding, line):
+		self.findings.append(finding)
+
+def replay(events, emitter):
+	for name, args in events:
+		getattr(emitter, name)(*args)
+
+FORMATS = {
+	"text": TextEmitter,
+	"jsonl": JsonLinesEmitter,
+	"csv": CsvEmitter,
+	"sarif": SarifEmitter,
+}
+
+# Create emitter for given format writing to file (or stdout if path is None or '-') with large write buffer
+def open_emitter(fmt, path=None):
+	if path is None or path == "-":
+		stream = sys.stdout
+	else:
+		stream = open(path, "w", buffering=1024 * 1024, newline="")
+	emitter = FORMATS[fmt](stream)
+	emitter.start()
+	return emitter
@@ -0,0 +1,302 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import time
+import sqlite3
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Bump when schema changes
+FINDINGS_DB_FORMAT = 1
+
+# Findings buffered in memory before they are written with single executemany()
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+	run_id INTEGER PRIMARY KEY,
+	started REAL NOT NULL,
+	finished REAL,
+	tool TEXT,
+	source TEXT,
+	policies INTEGER NOT NULL DEFAULT 0,
+	findings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS run_policies (
+	run_id INTEGER NOT NULL,
+	policy_guid TEXT NOT NULL,
+	policy_name TEXT,
+	product TEXT,
+	PRIMARY KEY (run_id, policy_guid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS findings (
+	run_id INTEGER NOT NULL,
+	policy_guid TEXT,
+	product TEXT,
+	rule_id TEXT NOT NULL,
+	severity TEXT,
+	message TEXT,
+	value TEXT
+);
+-- Per run totals written once run is finished, trends across all runs never touch findings table
+CREATE TABLE IF NOT EXISTS run_rules (
+	run_id INTEGER NOT NULL,
+	product TEXT NOT NULL,
+	rule_id TEXT NOT NULL,
+	findings INTEGER NOT NULL,
+	policies INTEGER NOT NULL,
+	PRIMARY KEY (run_id, product, rule_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS run_products (
+	run_id INTEGER NOT NULL,
+	product TEXT NOT NULL,
+	findings INTEGER NOT NULL,
+	policies INTEGER NOT NULL,
+	PRIMARY KEY (run_id, product)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS run_policies_guid ON run_policies (policy_guid, run_id);
+-- Covering indexes: top-N of a run reads only run index, per product queries product index,
+-- per policy history and streaks only policy index
+CREATE INDEX IF NOT EXISTS findings_run ON findings (run_id, rule_id, product, policy_guid);
+CREATE INDEX IF NOT EXISTS findings_product ON findings (product, run_id, rule_id);
+CREATE INDEX IF NOT EXISTS findings_policy ON findings (policy_guid, rule_id, run_id);
+"""
+
+# Observed value of finding as stored - strings and numbers are kept, anything else (MISSING setting, subtree) is stored as NULL
+def stored_value(value):
+	if value is None or isinstance(value, (str, int, float)):
+		return value
+	return None
+
+# SQL condition and parameters for optional filters, None filter is left out
+def conditions(prefix="", **filters):
+	clauses = []
+	params = []
+	for column, value in sorted(filters.items()):
+		if value is not None:
+			clauses.append("{}{} = ?".format(prefix, column))
+			params.append(value)
+	return clauses, params
+
+#####################################################################################
+# FINDINGS DATABASE
+#####################################################################################
+
+# Findings of audit runs kept in single SQLite file. Every run records the policies it audited (so it is known
+# when a finding went away) and findings it reported, indexed by run, policy GUID, product and rule so trend and
+# top-N queries only touch index pages instead of scanning millions of rows.
+class FindingsDB(object):
+	def __init__(self, path, readonly=False):
+		self.path = path
+		if readonly:
+			if not os.path.isfile(path):
+				raise ValueError("{} does not exist".format(path))
+			self.db = sqlite3.connect("file:{}?mode=ro".format(os.path.abspath(path)), uri=True)
+		else:
+			self.db = sqlite3.connect(path)
+			# Queries can run while audit is writing, run is still committed at once
+			self.db.execute("PRAGMA journal_mode = WAL")
+			self.db.execute("PRAGMA synchronous = NORMAL")
+			# Findings go to three indexes in different order, larger page cache keeps batch inserts from spilling
+			self.db.execute("PRAGMA cache_size = -65536")
+			self.db.executescript(SCHEMA)
+			self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('format', ?)", (str(FINDINGS_DB_FORMAT),))
+			self.db.commit()
+		try:
+			row = self.db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+		except sqlite3.DatabaseError:
+			row = None
+		if row is None or int(row[0]) != FINDINGS_DB_FORMAT:
+			raise ValueError("{} is not a findings database of format {}".format(path, FINDINGS_DB_FORMAT))
+
+	# Start recording new run, findings are written in batches and committed in one transaction by RunWriter.finish()
+	def begin_run(self, tool, source=None, started=None):
+		return RunWriter(self, tool, source, time.time() if started is None else started)
+
+	def close(self):
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	#################################################################################
+	# QUERIES
+	#################################################################################
+
+	# Finished runs, newest first
+	def runs(self, limit=None):
+		query = "SELECT run_id, started, finished, tool, source, policies, findings FROM runs WHERE finished IS NOT NULL ORDER BY run_id DESC"
+		if limit is not None:
+			query += " LIMIT {:d}".format(limit)
+		return self.db.execute(query).fetchall()
+
+	# Id of newest finished run (optionally of given tool), None if there is none
+	def latest_run(self, tool=None):
+		clauses, params = conditions(tool=tool)
+		query = "SELECT MAX(run_id) FROM runs WHERE finished IS NOT NULL" + "".join(" AND " + c for c in clauses)
+		return self.db.execute(query, params).fetchone()[0]
+
+	# Top 'limit' rules, policies or products of one run by number of findings: list of (key, findings, policies)
+	def top(self, run_id, by="rule_id", limit=10, product=None, rule_id=None, severity=None):
+		if by not in ("rule_id", "policy_guid", "product"):
+			raise ValueError("can not group findings by {}".format(by))
+		clauses, params = conditions(product=product, rule_id=rule_id, severity=severity)
+		query = "SELECT {0}, COUNT(*), COUNT(DISTINCT policy_guid) FROM findings WHERE run_id = ?{1} GROUP BY {0} ORDER BY 2 DESC, 1 LIMIT ?".format(
+			by, "".join(" AND " + c for c in clauses))
+		return self.db.execute(query, [run_id] + params + [limit]).fetchall()
+
+	# Findings and affected policies in every finished run: list of (run_id, started, tool, findings, policies).
+	# Totals come from per run tables, only history of single policy is counted from findings.
+	def trend(self, product=None, rule_id=None, policy_guid=None, since=None):
+		if policy_guid is not None:
+			clauses, params = conditions(product=product, rule_id=rule_id, policy_guid=policy_guid)
+			totals = "SELECT run_id, COUNT(*) AS findings, COUNT(DISTINCT policy_guid) AS policies FROM findings WHERE {} GROUP BY run_id".format(" AND ".join(clauses))
+		else:
+			# Policies of different products never overlap, so their counts add up
+			clauses, params = conditions(product=product, rule_id=rule_id)
+			totals = "SELECT run_id, findings, policies FROM {}{}".format("run_rules" if rule_id is not None else "run_products", "".join(
+				(" AND " if i else " WHERE ") + c for i, c in enumerate(clauses)))
+		query = """SELECT r.run_id, r.started, r.tool, COALESCE(SUM(t.findings), 0), COALESCE(SUM(t.policies), 0)
+			FROM runs r LEFT JOIN ({}) t ON t.run_id = r.run_id
+			WHERE r.finished IS NOT NULL{} GROUP BY r.run_id ORDER BY r.run_id""".format(totals, "" if since is None else " AND r.started >= ?")
+		if since is not None:
+			params.append(since)
+		return self.db.execute(query, params).fetchall()
+
+	# Policies which had finding of 'rule_id' in given run and in every run which audited them since 'before' (epoch seconds).
+	# Returns list of (policy_guid, policy_name, product, first seen in current streak) sorted by streak start.
+	def persistent(self, rule_id, run_id, before=None, product=None):
+		clauses, params = conditions("f.", product=product)
+		# Streak starts with first run after the last one which audited policy without the finding
+		query = """SELECT p.policy_guid, p.policy_name, p.product, (
+				SELECT MIN(r.started) FROM run_policies rp JOIN runs r ON r.run_id = rp.run_id
+				WHERE rp.policy_guid = p.policy_guid AND r.finished IS NOT NULL AND rp.run_id > COALESCE((
+					SELECT MAX(clean.run_id) FROM run_policies clean JOIN runs cr ON cr.run_id = clean.run_id
+					WHERE clean.policy_guid = p.policy_guid AND clean.run_id < p.run_id AND cr.finished IS NOT NULL AND NOT EXISTS (
+						SELECT 1 FROM findings f2 WHERE f2.policy_guid = clean.policy_guid AND f2.rule_id = ? AND f2.run_id = clean.run_id)), 0)
+			) AS streak
+			FROM run_policies p
+			WHERE p.run_id = ? AND p.policy_guid IN (SELECT f.policy_guid FROM findings f WHERE f.run_id = ? AND f.rule_id = ?{})""".format(
+			"".join(" AND " + c for c in clauses))
+		rows = self.db.execute(query, [rule_id, run_id, run_id, rule_id] + params).fetchall()
+		if before is not None:
+			rows = [row for row in rows if row[3] is not None and row[3] <= before]
+		return sorted(rows, key=lambda row: (row[3], row[0]))
+
+	# Findings of one run, optionally filtered
+	def findings(self, run_id, product=None, rule_id=None, policy_guid=None, severity=None):
+		clauses, params = conditions(product=product, rule_id=rule_id, policy_guid=policy_guid, severity=severity)
+		query = "SELECT policy_guid, product, rule_id, severity, message, value FROM findings WHERE run_id = ?{} ORDER BY policy_guid, rule_id".format(
+			"".join(" AND " + c for c in clauses))
+		return self.db.execute(query, [run_id] + params)
+
+#####################################################################################
+# RUN WRITER
+#####################################################################################
+
+# Collects policies and findings of single audit run. Rows are buffered and written with executemany() in batches,
+# whole run is one transaction - interrupted run leaves nothing behind and never shows up in queries.
+class RunWriter(object):
+	def __init__(self, findings_db, tool, source, started):
+		self.findings_db = findings_db
+		self.db = findings_db.db
+		cursor = self.db.execute("INSERT INTO runs (started, tool, source) VALUES (?, ?, ?)", (started, tool, source))
+		self.run_id = cursor.lastrowid
+		self.policies = {}
+		self.pending = []
+		self.count = 0
+		# (product, rule_id) / product -> [findings, set of policy GUIDs]
+		self.rule_totals = {}
+		self.product_totals = {}
+		self.finished = False
+
+	# Policy audited in this run, policies without findings are recorded too
+	def add_policy(self, guid, product, name=None):
+		if guid is None:
+			return
+		previous = self.policies.get(guid)
+		# Online audit announces policy from API listing and again from policy header, keep what is known
+		if previous is not None:
+			product = product or previous[0]
+			name = name or previous[1]
+		self.policies[guid] = (product, name)
+
+	def add(self, finding):
+		self.pending.append((self.run_id, finding.policy_guid, finding.product, finding.rule_id, finding.severity, finding.message, stored_value(finding.value)))
+		self.count += 1
+		product = finding.product or ""
+		for totals, key in ((self.rule_totals, (product, finding.rule_id)), (self.product_totals, product)):
+			entry = totals.get(key)
+			if entry is None:
+				entry = [0, set()]
+				totals[key] = entry
+			entry[0] += 1
+			entry[1].add(finding.policy_guid)
+		if len(self.pending) >= BATCH_SIZE:
+			self.flush()
+
+	def flush(self):
+		if self.pending:
+			self.db.executemany("INSERT INTO findings (run_id, policy_guid, product, rule_id, severity, message, value) VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending)
+			self.pending = []
+
+	# Commit the run, only complete runs should be finished
+	def finish(self):
+		self.flush()
+		self.db.executemany("INSERT OR REPLACE INTO run_policies (run_id, policy_guid, product, policy_name) VALUES (?, ?, ?, ?)",
+			[(self.run_id, guid, product, name) for guid, (product, name) in self.policies.items()])
+		self.db.executemany("INSERT INTO run_rules (run_id, product, rule_id, findings, policies) VALUES (?, ?, ?, ?, ?)",
+			[(self.run_id, product, rule_id, count, len(guids)) for (product, rule_id), (count, guids) in self.rule_totals.items()])
+		self.db.executemany("INSERT INTO run_products (run_id, product, findings, policies) VALUES (?, ?, ?, ?)",
+			[(self.run_id, product, count, len(guids)) for product, (count, guids) in self.product_totals.items()])
+		self.db.execute("UPDATE runs SET finished = ?, policies = ?, findings = ? WHERE run_id = ?", (time.time(), len(self.policies), self.count, self.run_id))
+		self.db.commit()
+		self.finished = True
+
+	def summary(self):
+		return "Findings database: run {} with {} findings in {} policies saved to {}".format(self.run_id, self.count, len(self.policies), self.findings_db.path)
+
+	# Run which was not finished is rolled back
+	def close(self):
+		if not self.finished:
+			self.pending = []
+			self.db.rollback()
+		self.findings_db.close()
+
+#####################################################################################
+# EMITTER
+#####################################################################################
+
+# Passes everything to wrapped emitter and records policies and findings of the run into findings database
+class DatabaseEmitter(object):
+	def __init__(self, emitter, run):
+		self.emitter = emitter
+		self.run = run
+
+	def __getattr__(self, name):
+		return getattr(self.emitter, name)
+
+	def begin_policy(self, guid, product, name=None):
+		self.emitter.begin_policy(guid, product, name)
+		self.run.add_policy(guid, product, name)
+
+	def finding(self, rule_id, severity, message, value=None, line=None):
+		finding = self.emitter.finding(rule_id, severity, message, value, line)
+		self.run.add(finding)
+		return finding
+
+	def close(self):
+		self.emitter.close()
+		self.run.close()
+
+# Wrap emitter 'out' so findings of this run are recorded into findings database at 'path'
+def record_findings(out, path, tool, source=None):
+	return DatabaseEmitter(out, FindingsDB(path).begin_run(tool, source))
@@ -0,0 +1,67 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from amp_policy_kit.api import APIError, iter_pages, api_url
+from amp_policy_kit.workers import ordered_map
+
+#####################################################################################
+# GROUP INDEX
+#####################################################################################
+
+# In-memory index of policy GUID -> groups the policy is used in.
+# Built once from the groups endpoint instead of asking /v1/policies/{guid} for 'used_in_groups' of every policy.
+class GroupIndex(object):
+	def __init__(self):
+		self.groups = {}
+		self.by_policy = {}
+		# False if some groups could not be read, policies may then be used in more groups than index says
+		self.complete = True
+		self.error = None
+
+	def add(self, group, policies):
+		entry = {'name': group.get('name'), 'description': group.get('description'), 'guid': group['guid']}
+		self.groups[group['guid']] = entry
+		for policy in policies or []:
+			self.by_policy.setdefault(policy['guid'], []).append(entry)
+
+	# Groups given policy is used in, in the same format as 'used_in_groups' of policy details
+	def groups_for(self, policy_guid):
+		return self.by_policy.get(policy_guid, [])
+
+	# Page through /v1/groups once. Listing does not always carry group policies, in that case group
+	# details are fetched (concurrently, through the same rate limiter) - one request per group, not per policy.
+	# Groups which can not be read are left out and index is marked incomplete.
+	@classmethod
+	def build(cls, limiter, session_factory, domainIP, workers=1, **kwargs):
+		index = cls()
+		groups_url = api_url(domainIP, 'v1/groups')
+		missing = []
+		try:
+			for group in iter_pages(limiter, session_factory(), groups_url, **kwargs):
+				if 'policies' in group:
+					index.add(group, group['policies'])
+				else:
+					missing.append(group)
+		except (APIError, OSError, IOError) as e:
+			index.complete = False
+			index.error = str(e)
+
+		# Returns (policies of group, None), or (None, reason why group could not be read)
+		def fetch_group(group):
+			group_url = api_url(domainIP, 'v1/groups/{}'.format(group['guid']))
+			try:
+				response = limiter.get(session_factory(), group_url, **kwargs)
+			except (OSError, IOError) as e:
+				return None, "{} failed: {}".format(group_url, e)
+			if response.status_code != 200:
+				return None, "{} returned status code {}".format(group_url, response.status_code)
+			return response.json()['data'].get('policies') or [], None
+
+		for group, (policies, error) in ordered_map(fetch_group, missing, workers):
+			if policies is None:
+				index.complete = False
+				index.error = error
+			else:
+				index.add(group, policies)
+		return index
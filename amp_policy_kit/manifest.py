@@ -0,0 +1,89 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import json
+import hashlib
+import tempfile
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Name of manifest file kept in output folder of download script
+MANIFEST_NAME = "manifest.json"
+
+# Hex digest used to identify content of policy file
+def content_hash(data):
+	if isinstance(data, str):
+		data = data.encode("utf-8")
+	return hashlib.sha256(data).hexdigest()
+
+# Write file atomically - write to temporary file in the same folder and rename it over the target
+def atomic_write(path, data):
+	if isinstance(data, str):
+		data = data.encode("utf-8")
+	folder = os.path.dirname(os.path.abspath(path))
+	fd, tmp_path = tempfile.mkstemp(dir=folder, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+#####################################################################################
+# MANIFEST
+#####################################################################################
+
+# Manifest of downloaded policies: GUID -> serial_number, file name and content hash.
+# Lets download script fetch only policies whose serial number changed since the last run.
+class PolicyManifest(object):
+	def __init__(self, folder):
+		self.folder = folder
+		self.path = os.path.join(folder, MANIFEST_NAME)
+		self.policies = {}
+		if os.path.exists(self.path):
+			with open(self.path, "r") as f:
+				try:
+					self.policies = json.load(f).get("policies", {})
+				except ValueError:
+					# Broken manifest means full download, nothing worse
+					self.policies = {}
+
+	# Policy is current if serial number did not change and file is still in place
+	# (under expected name, if given - e.g. compression of policy files was changed)
+	def is_current(self, guid, serial_number, filename=None):
+		entry = self.policies.get(guid)
+		if entry is None or str(entry.get("serial_number")) != str(serial_number):
+			return False
+		if filename is not None and entry["filename"] != filename:
+			return False
+		return os.path.exists(os.path.join(self.folder, entry["filename"]))
+
+	def update(self, guid, serial_number, filename, digest, product=None):
+		groups = self.policies.get(guid, {}).get("groups", [])
+		self.policies[guid] = {"serial_number": serial_number, "filename": filename, "sha256": digest, "product": product, "groups": groups}
+
+	# Groups policy is used in (name / description / guid), so offline tools do not need to ask API
+	def set_groups(self, guid, groups):
+		if guid in self.policies:
+			self.policies[guid]["groups"] = groups
+
+	# Delete files (and entries) of policies which are not listed anymore, returns list of removed GUIDs
+	def remove_stale(self, listed_guids):
+		removed = []
+		for guid in list(self.policies):
+			if guid not in listed_guids:
+				filename = os.path.join(self.folder, self.policies[guid]["filename"])
+				if os.path.exists(filename):
+					os.remove(filename)
+				del self.policies[guid]
+				removed.append(guid)
+		return removed
+
+	def save(self):
+		atomic_write(self.path, json.dumps({"policies": self.policies}, indent=1, sort_keys=True))
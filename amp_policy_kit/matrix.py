@@ -0,0 +1,252 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import csv
+from array import array
+from amp_policy_kit.policyxml import parse_policy_outline
+from amp_policy_kit.store import read_policy, source_identity
+from amp_policy_kit.rules import POLICY_RULES, OPERATORS, MISSING
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+from amp_policy_kit.audit import detect_product, EXCLUSION_ITEMS
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Sections needed for product detection and all rule paths
+MATRIX_SECTIONS = ("janus", "exclusions", "agent", "orbital", "ui")
+
+# Values of a row as they are stored in columns and passed between processes: False - setting is missing,
+# True - subtree (not a single value) is present, otherwise the string (or None for empty XML element)
+def encode_value(value):
+	if value is MISSING:
+		return False
+	if isinstance(value, dict):
+		return True
+	if isinstance(value, list):
+		# Rules compare repeated elements as strings too
+		return str(value)
+	return value
+
+# Stored value back to what rule predicates expect. Subtree is any dictionary - it never equals or exceeds anything.
+def decode_value(value):
+	if value is False:
+		return MISSING
+	if value is True:
+		return {}
+	return value
+
+# Bytewise AND of two 0/1 masks, done on big integers so it runs in C
+def mask_and(a, b):
+	return (int.from_bytes(a, "little") & int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+# Row of parsed policy (see parse_policy_config): (guid, name, product, encoded values of all rule paths).
+# Raises KeyError if policy has no security settings (e.g. Network-only). 'marked' are product markers found in
+# exclusion items left out by parse_policy_outline().
+def policy_row(json_object, product=None, rules=POLICY_RULES, marked=()):
+	config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+	# Policy header is in every policy
+	header = config['ns0:janus']
+	if product is None:
+		# Only exclusions are indexed, rules resolve their paths without index
+		index = PolicyIndex({'ns0:exclusions': config.get('ns0:exclusions')}, PRODUCT_MARKERS)
+		index.add_mentions('exclusions', marked)
+		product = detect_product(index)
+	policy = header.get('ns0:policy') if isinstance(header, dict) else None
+	if not isinstance(policy, dict):
+		policy = {}
+	return policy.get('ns0:uuid'), policy.get('ns0:name'), product, [encode_value(v) for v in rules.resolver().resolve(config)]
+
+# Row of one policy file, runs in worker processes of settings-matrix.py. Returns None if policy has no security settings.
+# Exclusion items are only searched for product markers, not parsed (no rule reads them item by item).
+def read_row(path, product=None):
+	try:
+		json_object, counts, marked = parse_policy_outline(read_policy(path), MATRIX_SECTIONS, EXCLUSION_ITEMS, PRODUCT_MARKERS if product is None else ())
+		guid, name, product, values = policy_row(json_object, product, marked=marked)
+	except (KeyError, TypeError):
+		return None
+	return guid or source_identity(path)[0], name, product, values
+
+#####################################################################################
+# COLUMNS
+#####################################################################################
+
+# Dictionary encoded column: every distinct value is stored once in 'levels', rows hold its code. Code 0 is
+# always the missing setting. Codes are kept in bytearray while there are at most 256 distinct values (always
+# the case for policy switches), so predicates run over whole column with single bytes.translate().
+class Column(object):
+	def __init__(self, name):
+		self.name = name
+		self.levels = [False]
+		self.codes_of = {False: 0}
+		self.codes = bytearray()
+
+	def __len__(self):
+		return len(self.codes)
+
+	def append(self, value):
+		code = self.codes_of.get(value)
+		if code is None:
+			code = len(self.levels)
+			self.levels.append(value)
+			self.codes_of[value] = code
+			if code == 256:
+				self.codes = array("I", self.codes)
+		self.codes.append(code)
+
+	def value(self, row):
+		return self.levels[self.codes[row]]
+
+	# 0/1 byte per row from 0/1 byte per code
+	def _translate(self, table):
+		if isinstance(self.codes, bytearray):
+			return self.codes.translate(table.ljust(256, b"\0"))
+		return bytes(table[code] for code in self.codes)
+
+	# 0/1 byte per row, 1 where predicate(value) holds. Predicate is called once per distinct value.
+	def mask(self, predicate):
+		return self._translate(bytes(1 if predicate(decode_value(level)) else 0 for level in self.levels))
+
+	# Number of rows per stored value, optionally only rows selected by mask
+	def counts(self, mask=None):
+		counts = []
+		for code, level in enumerate(self.levels):
+			selected = self._translate(bytes(1 if c == code else 0 for c in range(len(self.levels))))
+			if mask is not None:
+				selected = mask_and(selected, mask)
+			count = selected.count(1)
+			if count:
+				counts.append((level, count))
+		return counts
+
+	# Storage type of column: 'subtree' (presence only), 'int' (all values are integers) or 'str'
+	@property
+	def kind(self):
+		values = [level for level in self.levels[1:] if level is not None]
+		if values and all(level is True for level in values):
+			return "subtree"
+		if values and all(isinstance(level, str) and level.lstrip("-").isdigit() for level in values):
+			return "int"
+		return "str"
+
+#####################################################################################
+# SETTINGS MATRIX
+#####################################################################################
+
+# Every setting touched by rules as one column, one row per policy. Rules and statistics are evaluated
+# column-wide, instead of walking the policy dictionary of every policy.
+class SettingsMatrix(object):
+	def __init__(self, rules=POLICY_RULES):
+		self.rules = rules
+		self.paths = list(rules.resolver().paths)
+		self.guids = []
+		self.names = []
+		self.products = Column("product")
+		self.columns = [Column(path) for path in self.paths]
+		self.column = dict((path, column) for path, column in zip(self.paths, self.columns))
+
+	def __len__(self):
+		return len(self.guids)
+
+	# Add row returned by read_row()
+	def add_row(self, guid, name, product, values):
+		self.guids.append(guid)
+		self.names.append(name)
+		self.products.append(product)
+		for column, value in zip(self.columns, values):
+			column.append(value)
+
+	# Add parsed policy (see parse_policy_config). Raises KeyError if policy has no security settings.
+	def add_policy(self, json_object, product=None):
+		self.add_row(*policy_row(json_object, product, self.rules))
+
+	# Rows of given products (None - all rows)
+	def product_mask(self, products=None):
+		if products is None:
+			return b"\1" * len(self)
+		return self.products.mask(lambda v: v in products)
+
+	# Rows rule is evaluated for (product matches and required subtrees are present) and rows which fail it
+	def rule_masks(self, rule):
+		applies = self.product_mask(rule.products)
+		for path in rule.requires:
+			applies = mask_and(applies, self.column[path].mask(lambda v: v is not MISSING))
+		fails = applies
+		for path, op, expected in rule.when:
+			predicate = OPERATORS[op]
+			fails = mask_and(fails, self.column[path].mask(lambda v, predicate=predicate, expected=expected: predicate(v, expected)))
+		return applies, fails
+
+	# Failure rate of every rule by product: list of (rule, product, failing policies, evaluated policies)
+	def rule_stats(self, products=("windows", "mac", "linux")):
+		product_masks = dict((product, self.product_mask((product,))) for product in products)
+		stats = []
+		for rule in self.rules.rules:
+			applies, fails = self.rule_masks(rule)
+			for product in products:
+				if not rule.applies_to(product):
+					continue
+				stats.append((rule, product, mask_and(fails, product_masks[product]).count(1), mask_and(applies, product_masks[product]).count(1)))
+		return stats
+
+	# Distribution of setting values among policies of product: list of (value, policies, policies of product)
+	def value_stats(self, path, product=None):
+		mask = self.product_mask(None if product is None else (product,))
+		total = mask.count(1)
+		return [(decode_value(level), count, total) for level, count in self.column[path].counts(mask)]
+
+	# Policies failing given rule: list of (guid, name, product, observed value)
+	def failing(self, rule):
+		applies, fails = self.rule_masks(rule)
+		column = self.column[rule.when[0][0]]
+		rows = []
+		start = fails.find(1)
+		while start != -1:
+			rows.append((self.guids[start], self.names[start], self.products.value(start), decode_value(column.value(start))))
+			start = fails.find(1, start + 1)
+		return rows
+
+	# One row per policy, one column per setting path. Missing settings and empty elements are empty cells,
+	# present subtrees are '1'.
+	def write_csv(self, path):
+		with open(path, "w", newline="") as f:
+			writer = csv.writer(f, lineterminator="\n")
+			writer.writerow(["policy_guid", "policy_name", "product"] + self.paths)
+			for row in range(len(self)):
+				values = []
+				for column in self.columns:
+					value = column.value(row)
+					values.append("1" if value is True else "" if value is False or value is None else value)
+				writer.writerow([self.guids[row], self.names[row], self.products.value(row)] + values)
+
+	# Typed Parquet columns - int64 for numeric settings, bool for subtrees, string otherwise, missing settings are nulls
+	def write_parquet(self, path):
+		try:
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise ImportError("Parquet export needs 'pyarrow' module (pip3 install pyarrow)")
+		types = {"subtree": pyarrow.bool_(), "int": pyarrow.int64(), "str": pyarrow.string()}
+		converters = {
+			"subtree": lambda level: True,
+			"int": lambda level: int(level),
+			"str": lambda level: level,
+		}
+		data = {
+			"policy_guid": pyarrow.array(self.guids, pyarrow.string()),
+			"policy_name": pyarrow.array(self.names, pyarrow.string()),
+			"product": pyarrow.array([self.products.value(row) for row in range(len(self))], pyarrow.string()),
+		}
+		for column in self.columns:
+			kind = column.kind
+			levels = [None if level is False or level is None else converters[kind](level) for level in column.levels]
+			data[column.name] = pyarrow.array([levels[code] for code in column.codes], types[kind])
+		pyarrow.parquet.write_table(pyarrow.table(data), path)
+
+	# Export format by file extension, CSV unless '.parquet'
+	def export(self, path):
+		if path.endswith(".parquet"):
+			self.write_parquet(path)
+		else:
+			self.write_csv(path)
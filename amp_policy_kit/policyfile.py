@@ -0,0 +1,99 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import glob
+import gzip
+import hashlib
+import tempfile
+
+try:
+	# Optional, only needed for zstd compressed policy files
+	import zstandard
+except ImportError:
+	zstandard = None
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Compression of policy files written by download script -> file name suffix
+COMPRESSION_SUFFIXES = {None: ".xml", "gzip": ".xml.gz", "zstd": ".xml.zst"}
+
+# Size of chunks policy files are read / written in
+CHUNK_SIZE = 64 * 1024
+
+# Compression of policy file from its name, None for plain XML
+def compression_of(path):
+	for compression, suffix in COMPRESSION_SUFFIXES.items():
+		if compression is not None and path.endswith(suffix):
+			return compression
+	return None
+
+# File name without '.xml', '.xml.gz' or '.xml.zst'
+def policy_stem(path):
+	name = os.path.basename(path)
+	suffix = COMPRESSION_SUFFIXES[compression_of(name)]
+	return name[:-len(suffix)] if name.endswith(suffix) else os.path.splitext(name)[0]
+
+# Policy files in folder, plain and compressed
+def list_policy_files(folder):
+	files = []
+	for suffix in COMPRESSION_SUFFIXES.values():
+		files.extend(glob.glob(os.path.join(folder, "*" + suffix)))
+	return sorted(files)
+
+# Raise ImportError if compression needs a module which is not installed
+def check_compression(compression):
+	if compression == "zstd" and zstandard is None:
+		raise ImportError("zstd compression needs 'zstandard' module (pip3 install zstandard)")
+
+# Raw XML of policy file, decompressed if needed
+def read_policy_file(path):
+	compression = compression_of(path)
+	if compression == "gzip":
+		with gzip.open(path, "rb") as f:
+			return f.read()
+	if compression == "zstd":
+		check_compression(compression)
+		with open(path, "rb") as f:
+			return zstandard.ZstdDecompressor().stream_reader(f).read()
+	with open(path, "rb") as f:
+		return f.read()
+
+#####################################################################################
+# STREAMING WRITE
+#####################################################################################
+
+# Write iterable of byte chunks (e.g. response.iter_content()) to temporary file in the target folder,
+# compressing on the fly, and rename it over 'path' once complete. Interrupted download never leaves
+# partial file behind. Returns (sha256 hex digest, size) of uncompressed content.
+def stream_to_file(chunks, path, compression=None):
+	check_compression(compression)
+	folder = os.path.dirname(os.path.abspath(path))
+	fd, tmp_path = tempfile.mkstemp(dir=folder, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+	digest = hashlib.sha256()
+	size = 0
+	try:
+		with os.fdopen(fd, "wb") as f:
+			if compression == "gzip":
+				# mtime is fixed, so the same policy always gives the same file
+				writer = gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0)
+			elif compression == "zstd":
+				writer = zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+			else:
+				writer = f
+			for chunk in chunks:
+				if chunk:
+					digest.update(chunk)
+					size += len(chunk)
+					writer.write(chunk)
+			if writer is not f:
+				writer.close()
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	return digest.hexdigest(), size
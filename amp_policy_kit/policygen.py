@@ -0,0 +1,275 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import random
+import uuid
+from urllib.parse import quote
+from xml.etree.ElementTree import Element, SubElement, tostring
+from amp_policy_kit.rules import POLICY_RULES
+from amp_policy_kit.manifest import PolicyManifest, atomic_write, content_hash
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Namespace used by AMP policy XML (policy is wrapped in XML signature)
+POLICY_NAMESPACE = "http://www.w3.org/2000/09/xmldsig#"
+
+# Characters left unquoted in exclusion items; '|' is the item delimiter so it always gets quoted
+SAFE_CHARS = ":\\/*.^$[]()-_+?{}"
+
+WINDOWS_PATHS = [
+	"CSIDL_WINDOWS\\System32\\spool\\",
+	"CSIDL_PROGRAM_FILES\\Sophos\\AutoUpdate\\Cache\\",
+	"CSIDL_COMMON_APPDATA\\Microsoft\\Windows Defender\\",
+	"C:\\Quarantine\\",
+	"C:\\System Volume Information\\tracking.log",
+	"C:\\Program Files\\Microsoft SQL Server\\MSSQL\\Data\\",
+]
+WINDOWS_WILDCARDS = [
+	"^[A-Za-z]:\\\\.*\\.sas.*",
+	"C:\\\\Users\\\\.*\\\\AppData\\\\Local\\\\Microsoft\\\\OneDrive\\\\",
+	"C:\\Windows\\Temp\\*.tmp",
+]
+MAC_PATHS = [
+	"/Library/Application Support/Cisco/",
+	"/System/Library/Spotlight/",
+	"/private/var/db/Spotlight-V100/",
+	"/Users/*/Library/Caches/",
+]
+LINUX_PATHS = [
+	"/var/log/",
+	"/proc/",
+	"/var/lib/docker/",
+	"/opt/app/*/cache/",
+]
+CERT_ISSUERS = ["VeriSign Class 3 Code Signing", "Microsoft Windows Production PCA 2011", "Symantec*Code Signing"]
+WINDOWS_PROCESSES = [
+	"2|0||C:\\Program Files\\Altiris\\Altiris Agent\\AeXNSAgent.exe|1|",
+	"2|0||C:\\Program Files\\McAfee\\Endpoint Security\\Threat Prevention\\mfetp.exe|1|",
+	"2|0||C:\\Program Files\\*\\backup.exe|1|",
+]
+UNIX_PROCESSES = [
+	"2|0||/usr/sbin/mysqld|1|",
+	"2|0||/opt/*/bin/agent|1|",
+]
+
+# Agent settings which are common for all products. Values are 'secure' defaults and can be overridden.
+COMMON_AGENT = {
+	"cloud": {"cache": {"ttl": {"unknown": "3600", "clean": "604800", "malicious": "3600", "unseen": "3600", "block": "3600"}}},
+	"driver": {
+		"blockexecqaction": "1",
+		"protmode": {"qaction": "1", "file": "1", "process": "1", "activeexec": "1"},
+	},
+	"nfm": {"enable": "1", "settings": {"qaction": "1"}},
+	"cmdlinecapture": {"enable": "1"},
+}
+WINDOWS_AGENT = {
+	"control": {"passwordex": "c2VjcmV0"},
+	"apde": {"enable": "1", "mode": "1"},
+	"driver": {"selfprotect": {"spp": "1", "spp_qaction": "1", "mkp": "1", "sde": "1"}},
+	"endpointisolation": {"enable": "1", "allowproxy": "0"},
+	"scansettings": {
+		"ethos": {"enable": "1", "file": "1"},
+		"ssd": "1",
+		"spero": {"enable": "1"},
+		"tetra": {"enable": "1", "options": {"ondemand": {"scanarchives": "1", "scanpacked": "1", "deepscan": "1"}}},
+	},
+	"heuristic": {"enable": "1", "qaction": "2"},
+	"exprev": {"enable": "1", "v4": {"options": "0x0000033F"}},
+	"amsi": {"enable": "1", "mode": "1"},
+}
+UNIX_AGENT = {
+	"scansettings": {"clamav": {"enable": "1"}},
+}
+UI_NOTIFICATION = {"cloud": "0", "hide_file_toast": "1", "hide_nfm_toast": "1", "verbose": "0"}
+WINDOWS_UI_NOTIFICATION = {"hide_ioc_toast": "1", "hide_detection_toast": "1", "hide_heuristic_toast": "1", "hide_exprev_toast": "1"}
+
+# Deep merge of nested setting dictionaries, 'override' wins. Nested dictionaries are copied, so settings
+# written into merged result never leak into the defaults above (and into policies generated later).
+def _merge(base, override):
+	merged = dict((key, _merge(value, {}) if isinstance(value, dict) else value) for key, value in base.items())
+	for key, value in override.items():
+		if isinstance(value, dict) and isinstance(merged.get(key), dict):
+			merged[key] = _merge(merged[key], value)
+		elif isinstance(value, dict):
+			merged[key] = _merge(value, {})
+		else:
+			merged[key] = value
+	return merged
+
+# Set value in nested dictionary using 'agent/apde/enable' style path
+def _set_path(settings, path, value):
+	keys = path.split("/")
+	node = settings
+	for key in keys[:-1]:
+		node = node.setdefault(key, {})
+	node[keys[-1]] = value
+
+def _tag(name):
+	return "{" + POLICY_NAMESPACE + "}" + name
+
+# Add nested dictionary to XML element tree
+def _add_children(parent, settings):
+	for key, value in settings.items():
+		if isinstance(value, dict):
+			_add_children(SubElement(parent, _tag(key)), value)
+		elif isinstance(value, list):
+			for v in value:
+				SubElement(parent, _tag(key)).text = v
+		elif value is not None:
+			SubElement(parent, _tag(key)).text = str(value)
+
+# Build list of pipe delimited exclusion items, path is always 5th field
+def _exclusion_items(product, count, rnd):
+	if product == "windows":
+		paths = WINDOWS_PATHS + WINDOWS_WILDCARDS
+	elif product == "mac":
+		paths = MAC_PATHS
+	else:
+		paths = LINUX_PATHS
+	items = []
+	for i in range(count):
+		if i < len(paths):
+			path = paths[i]
+		else:
+			base = rnd.choice(paths)
+			path = "{}{}_{}".format(base, "app" if "*" not in base else "x", i)
+		kind = "3" if "*" in path or "\\\\" in path else "1"
+		items.append("{}|0|0|0|{}|".format(kind, quote(path, safe=SAFE_CHARS)))
+	return items
+
+#####################################################################################
+# GENERATOR
+#####################################################################################
+
+# Build settings tree for policy of given product (windows / mac / linux)
+def policy_settings(product="windows", exclusions=10, settings=None, name=None, seed=None):
+	rnd = random.Random(seed)
+	policy_uuid = str(uuid.UUID(int=rnd.getrandbits(128)))
+	business_uuid = str(uuid.UUID(int=rnd.getrandbits(128)))
+
+	agent = dict(COMMON_AGENT)
+	if product == "windows":
+		agent = _merge(agent, WINDOWS_AGENT)
+	else:
+		agent = _merge(agent, UNIX_AGENT)
+
+	config = {
+		"janus": {
+			"policy": {
+				"name": name or "{} policy {}".format(product.capitalize(), policy_uuid[:8]),
+				"uuid": policy_uuid,
+				"serial_number": str(rnd.randint(1, 500)),
+				"updated": str(1600000000000 + rnd.randint(0, 10 ** 10)),
+			},
+			"business": {"uuid": business_uuid},
+		},
+		"exclusions": {
+			"info": {"item": _exclusion_items(product, max(exclusions, 2), rnd)},
+			"certissuer": {"name": CERT_ISSUERS if product == "windows" else CERT_ISSUERS[:2]},
+			"process": {"item": WINDOWS_PROCESSES if product == "windows" else UNIX_PROCESSES},
+		},
+		"agent": agent,
+		"orbital": {"enablemsi": "1"},
+	}
+	if product == "windows":
+		config["ui"] = {"exclusions": {"display": "0"}, "notification": _merge(UI_NOTIFICATION, WINDOWS_UI_NOTIFICATION)}
+	elif product == "mac":
+		config["ui"] = {"exclusions": {"display": "0"}, "notification": dict(UI_NOTIFICATION)}
+
+	for path, value in (settings or {}).items():
+		_set_path(config, path, value)
+	return config
+
+# Build complete signed policy XML document (bytes) as returned by /v1/policies/{guid}.xml
+def build_policy(product="windows", exclusions=10, settings=None, name=None, seed=None):
+	return policy_document(policy_settings(product, exclusions, settings, name, seed))
+
+# Signed policy XML document (bytes) for settings tree built by policy_settings()
+def policy_document(config):
+	root = Element(_tag("Signature"))
+	signed_info = SubElement(root, _tag("SignedInfo"))
+	SubElement(signed_info, _tag("CanonicalizationMethod"), Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315")
+	SubElement(signed_info, _tag("SignatureMethod"), Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1")
+	reference = SubElement(signed_info, _tag("Reference"), URI="#policy")
+	SubElement(reference, _tag("DigestMethod"), Algorithm="http://www.w3.org/2000/09/xmldsig#sha1")
+	SubElement(reference, _tag("DigestValue")).text = "dGVzdA=="
+	SubElement(root, _tag("SignatureValue")).text = "QUJD" * 64
+	key_info = SubElement(root, _tag("KeyInfo"))
+	SubElement(SubElement(key_info, _tag("X509Data")), _tag("X509Certificate")).text = "TUlJ" * 256
+	policy_object = SubElement(root, _tag("Object"), Id="policy")
+	_add_children(SubElement(policy_object, _tag("config")), config)
+
+	return tostring(root)
+
+#####################################################################################
+# SETTINGS PERMUTATIONS
+#####################################################################################
+
+# Setting overrides which make given rule match, derived from rule conditions.
+# None for rules which can not be triggered by setting a value (missing / present checks).
+def rule_overrides(rule):
+	overrides = {}
+	for path, op, expected in rule.when:
+		if op == "==":
+			overrides[path] = expected
+		elif op == ">":
+			overrides[path] = str(expected * 24)
+		else:
+			return None
+	return overrides
+
+# Random settings permutation - every rule applicable to product is triggered with probability 'weak_ratio'
+def random_settings(product, rnd, weak_ratio=0.2):
+	settings = {}
+	for rule in POLICY_RULES.rules:
+		if rule.applies_to(product) and rnd.random() < weak_ratio:
+			overrides = rule_overrides(rule)
+			if overrides:
+				settings.update(overrides)
+	return settings
+
+#####################################################################################
+# FLEET
+#####################################################################################
+
+# Products of generated fleet, in proportion typical for a console
+FLEET_MIX = (("windows", 6), ("mac", 2), ("linux", 2))
+
+# Specifications of fleet of 'count' policies - (product, exclusion count, settings, seed) tuples, policy_settings()
+# builds the policy from them. Exclusion counts are drawn log-uniformly from 'exclusions' range (min, max),
+# settings are random permutations.
+def fleet_specs(count, exclusions=(10, 1000), weak_ratio=0.2, products=None, seed=1):
+	rnd = random.Random(seed)
+	mix = [(p, w) for p, w in FLEET_MIX if products is None or p in products]
+	if not mix:
+		mix = [(p, 1) for p in products]
+	names = [p for p, w in mix]
+	weights = [w for p, w in mix]
+	low, high = exclusions
+	for i in range(count):
+		product = rnd.choices(names, weights)[0]
+		exclusion_count = int(round(low * (float(high) / low) ** rnd.random())) if high > low else low
+		policy_seed = rnd.getrandbits(64)
+		settings = random_settings(product, rnd, weak_ratio)
+		yield product, exclusion_count, settings, policy_seed
+
+# Write fleet of 'count' policies into folder the same way download script does ('<guid>_<product>.xml' and
+# manifest.json), so every offline tool can be run on it. Returns list of written file names.
+def generate_fleet(folder, count, exclusions=(10, 1000), weak_ratio=0.2, products=None, seed=1):
+	os.makedirs(folder, exist_ok=True)
+	manifest = PolicyManifest(folder)
+	written = []
+	for product, exclusion_count, settings, policy_seed in fleet_specs(count, exclusions, weak_ratio, products, seed):
+		config = policy_settings(product, exclusion_count, settings, seed=policy_seed)
+		guid = config["janus"]["policy"]["uuid"]
+		xml_data = policy_document(config)
+		filename = "{}_{}.xml".format(guid, product)
+		atomic_write(os.path.join(folder, filename), xml_data)
+		manifest.update(guid, config["janus"]["policy"]["serial_number"], filename, content_hash(xml_data), product)
+		written.append(filename)
+	manifest.save()
+	return written
@@ -0,0 +1,108 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from amp_policy_kit.rules import compile_path
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Strings in exclusions which tell us what product policy belongs to (policy XML does not say it)
+PRODUCT_MARKERS = ("Spotlight", "Library", "CSIDL_WINDOWS")
+
+# Shapes of indexed elements
+DICT = "dict"
+LIST = "list"
+SCALAR = "scalar"
+EMPTY = "empty"
+
+#####################################################################################
+# POLICY INDEX
+#####################################################################################
+
+# One-time index of parsed policy config: every key path with its shape (dict / list / scalar / empty) and number
+# of list items, plus marker strings found in top level subtrees. Built in a single walk, so parsers can ask
+# "is it there", "is it a list" or "does exclusion list mention Spotlight" without stringifying subtrees.
+class PolicyIndex(object):
+	def __init__(self, config, markers=()):
+		self.shapes = {}
+		self.counts = {}
+		self.markers = {}
+		self.queries = {}
+		if isinstance(config, dict):
+			self._walk(config, markers)
+
+	def _walk(self, config, markers):
+		shapes = self.shapes
+		counts = self.counts
+		for top_key, top_value in config.items():
+			# Strings are collected and searched for markers once per subtree, in C rather than per value
+			texts = []
+			stack = [((top_key,), top_value)]
+			while stack:
+				path, value = stack.pop()
+				if isinstance(value, list):
+					shapes[path] = LIST
+					counts[path] = len(value)
+					for item in value:
+						if isinstance(item, dict):
+							stack.append((path, item))
+						elif isinstance(item, str):
+							texts.append(item)
+					continue
+				if path not in shapes:
+					if isinstance(value, dict):
+						shapes[path] = DICT
+					elif value is None:
+						shapes[path] = EMPTY
+					else:
+						shapes[path] = SCALAR
+					counts[path] = 1
+				if isinstance(value, dict):
+					for key, child in value.items():
+						stack.append((path + (key,), child))
+				elif isinstance(value, str):
+					texts.append(value)
+			if markers:
+				text = "\n".join(texts)
+				self.markers[top_key] = set(m for m in markers if m in text)
+
+	# 'exclusions/info/item' -> ('ns0:exclusions', 'ns0:info', 'ns0:item'), cached as parsers ask the same things
+	def _key(self, path):
+		key = self.queries.get(path)
+		if key is None:
+			key = compile_path(path)
+			self.queries[path] = key
+		return key
+
+	# Element is present and not empty
+	def has(self, path):
+		shape = self.shapes.get(self._key(path))
+		return shape is not None and shape != EMPTY
+
+	def shape(self, path):
+		return self.shapes.get(self._key(path))
+
+	def is_list(self, path):
+		return self.shapes.get(self._key(path)) == LIST
+
+	# Number of elements with given path (0 if missing)
+	def count(self, path):
+		return self.counts.get(self._key(path), 0)
+
+	# Marker string was seen anywhere inside given top level subtree, e.g. mentions('exclusions', 'Spotlight')
+	def mentions(self, subtree, marker):
+		return marker in self.markers.get(compile_path(subtree)[0], ())
+
+	# Markers found in parts of top level subtree which were not indexed (items streamed out of XML)
+	def add_mentions(self, subtree, markers):
+		self.markers.setdefault(compile_path(subtree)[0], set()).update(markers)
+
+	# Values of element as list, regardless of it being single element or repeated one
+	def items(self, path, value):
+		if self.is_list(path):
+			return value
+		if value is None:
+			return []
+		return [value]
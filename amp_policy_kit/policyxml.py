@@ -0,0 +1,305 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+from xml.etree.ElementTree import fromstring, XMLParser
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Namespace which ElementTree never declares with 'ns' prefix
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+# Subtrees of 'config' element audits, snapshot diff and exclusion analysis read
+AUDITED_SECTIONS = ("janus", "exclusions", "agent", "orbital", "ui")
+
+# Local names of elements from document root down to 'config'
+CONFIG_PATH = ("Signature", "Object", "config")
+
+# Keeps track of 'ns0', 'ns1' ... prefixes in the same order ElementTree tostring() assigns them
+class _PrefixMap(object):
+	def __init__(self):
+		self.namespaces = {}
+		self.qnames = {}
+
+	# Turn '{uri}tag' into 'ns0:tag', caching as the same tags repeat thousands of times
+	def qualify(self, name):
+		qname = self.qnames.get(name)
+		if qname is None:
+			if name[:1] == "{":
+				uri, local = name[1:].rsplit("}", 1)
+				if uri == XML_NAMESPACE:
+					prefix = "xml"
+				else:
+					prefix = self.namespaces.get(uri)
+					if prefix is None:
+						prefix = "ns{}".format(len(self.namespaces))
+						self.namespaces[uri] = prefix
+				qname = "{}:{}".format(prefix, local)
+			else:
+				qname = name
+			self.qnames[name] = qname
+		return qname
+
+# Build dictionary for single element the same way xmltodict does (attributes as '@name', text as '#text')
+def _element_to_dict(elem, prefixes):
+	node = {}
+	for key, value in elem.attrib.items():
+		node["@" + prefixes.qualify(key)] = value
+
+	text = elem.text or ""
+	for child in elem:
+		key = prefixes.qualify(child.tag)
+		value = _element_to_dict(child, prefixes)
+		# Repeated elements are turned into list
+		if key in node:
+			existing = node[key]
+			if isinstance(existing, list):
+				existing.append(value)
+			else:
+				node[key] = [existing, value]
+		else:
+			node[key] = value
+		if child.tail:
+			text += child.tail
+
+	text = text.strip()
+	if not node:
+		return text or None
+	if text:
+		node["#text"] = text
+	return node
+
+#####################################################################################
+# PARSERS
+#####################################################################################
+
+# Convert raw policy XML (bytes or str) in a single pass into the namespace-prefixed dictionary used by parse_* functions.
+# Output matches what fromstring -> tostring -> BeautifulSoup.prettify -> xmltodict -> json round trip used to produce.
+def parse_policy_xml(xml_data):
+	root = fromstring(xml_data)
+	prefixes = _PrefixMap()
+	root_key = prefixes.qualify(root.tag)
+	root_value = _element_to_dict(root, prefixes)
+
+	# tostring() declares all namespaces on the root element, so xmltodict reported them as root attributes
+	if prefixes.namespaces:
+		declared = {}
+		for uri, prefix in sorted(prefixes.namespaces.items(), key=lambda x: x[1]):
+			declared["@xmlns:" + prefix] = uri
+		if isinstance(root_value, dict):
+			declared.update(root_value)
+		elif root_value is not None:
+			declared["#text"] = root_value
+		root_value = declared
+
+	return {root_key: root_value}
+
+# Size of chunks raw XML is fed to streaming parsers in
+FEED_SIZE = 64 * 1024
+
+# Raw policy XML (bytes or str) or binary file object in chunks for streaming parsers
+def _chunks(xml_data):
+	if isinstance(xml_data, str):
+		xml_data = xml_data.encode("utf-8")
+	if isinstance(xml_data, bytes):
+		view = memoryview(xml_data)
+		return (view[offset:offset + FEED_SIZE] for offset in range(0, len(view), FEED_SIZE))
+	return iter(lambda: xml_data.read(FEED_SIZE), b"")
+
+# Parser target (see XMLParser) which builds dictionaries for given sections of 'Signature/Object/config' straight
+# from parser callbacks. No element objects are created at all, everything outside of sections is skipped.
+class _SectionBuilder(object):
+	def __init__(self, sections, streamed=(), markers=()):
+		self.sections = sections
+		# Elements at streamed paths (tuples of local names below config) are only counted and searched for markers
+		self.streamed = streamed
+		self.markers = markers
+		self.counts = dict((path, 0) for path in streamed)
+		self.marked = set()
+		self.locals = []
+		self.prefixes = _PrefixMap()
+		self.qnames = self.prefixes.qnames
+		self.depth = 0
+		# Qualified names of open 'Signature', 'Object' and 'config' elements, and the deepest such path seen
+		self.trail = []
+		self.found = []
+		self.config = {}
+		# Open elements inside a section: [qualified name, dictionary, text parts]
+		self.frames = []
+
+	def start(self, tag, attrib):
+		# Tags and attributes are qualified in document order, so 'nsN' prefixes match parse_policy_xml()
+		qname = self.qnames.get(tag) or self.prefixes.qualify(tag)
+		node = {}
+		if attrib:
+			for key, value in attrib.items():
+				node["@" + self.prefixes.qualify(key)] = value
+		depth = self.depth
+		self.depth += 1
+		if self.frames:
+			self.frames.append([qname, node, []])
+			if self.streamed:
+				self.locals.append(tag.rsplit("}", 1)[-1])
+		elif depth == len(self.trail):
+			local = tag.rsplit("}", 1)[-1]
+			if depth == len(CONFIG_PATH):
+				if local in self.sections:
+					self.frames.append([qname, node, []])
+					if self.streamed:
+						self.locals.append(local)
+			elif local == CONFIG_PATH[depth]:
+				self.trail.append(qname)
+				if len(self.trail) > len(self.found):
+					self.found = list(self.trail)
+
+	def data(self, text):
+		if self.frames:
+			self.frames[-1][2].append(text)
+
+	def end(self, tag):
+		self.depth -= 1
+		frames = self.frames
+		if not frames:
+			if self.depth < len(self.trail):
+				self.trail.pop()
+			return
+		qname, node, texts = frames.pop()
+		# Same value _element_to_dict() builds - element text and tails of its children, in document order
+		text = "".join(texts).strip() if texts else ""
+		if self.streamed:
+			path = tuple(self.locals)
+			self.locals.pop()
+			if path in self.counts:
+				# Empty element is not an item, the same way it does not count as one in a dictionary
+				if text:
+					self.counts[path] += 1
+					for marker in self.markers:
+						if marker in text:
+							self.marked.add(marker)
+				return
+		if not node:
+			value = text or None
+		else:
+			value = node
+			if text:
+				node["#text"] = text
+		_add_child(frames[-1][1] if frames else self.config, qname, value)
+
+	def close(self):
+		result = self.config if len(self.found) == len(CONFIG_PATH) else {}
+		for qname in reversed(self.found):
+			result = {qname: result}
+		return result
+
+# Repeated elements are turned into list
+def _add_child(node, key, value):
+	if key in node:
+		existing = node[key]
+		if isinstance(existing, list):
+			existing.append(value)
+		else:
+			node[key] = [existing, value]
+	else:
+		node[key] = value
+
+# Streaming alternative of parse_policy_xml() for audits: builds dictionaries only for given 'sections' of
+# 'Signature/Object/config' straight from parser callbacks while XML is fed in chunks. XML signature, certificates
+# and unused config are skipped as they are parsed, no element tree is ever built, so only the audited part
+# of the policy is held in memory. Returns {'ns0:Signature': {'ns0:Object': {'ns0:config': {...}}}} with the same
+# keys and values parse_policy_xml() gives for those sections, so parse_* functions work on either.
+def parse_policy_config(xml_data, sections=AUDITED_SECTIONS):
+	parser = XMLParser(target=_SectionBuilder(frozenset(sections)))
+	for chunk in _chunks(xml_data):
+		parser.feed(chunk)
+	return parser.close()
+
+# parse_policy_config() for policies with huge item lists: elements at 'streamed' paths below config (e.g.
+# 'exclusions/info/item') are not put into dictionaries, only counted and searched for 'markers' strings.
+# Returns (parsed sections, {path: number of non-empty items}, set of markers found in items). Items are read
+# afterwards with stream_config_items(), so memory does not depend on their number.
+def parse_policy_outline(xml_data, sections=AUDITED_SECTIONS, streamed=(), markers=()):
+	paths = dict((tuple(path.split("/")), path) for path in streamed)
+	builder = _SectionBuilder(frozenset(sections), frozenset(paths), tuple(markers))
+	parser = XMLParser(target=builder)
+	for chunk in _chunks(xml_data):
+		parser.feed(chunk)
+	json_object = parser.close()
+	return json_object, dict((paths[key], count) for key, count in builder.counts.items()), builder.marked
+
+# Parser target collecting text of elements at given paths (tuples of local names from document root)
+class _ItemCollector(object):
+	def __init__(self, targets):
+		# path tuple -> name it is reported under
+		self.targets = targets
+		self.depth = max(len(target) for target in targets)
+		self.names = []
+		self.texts = None
+		self.items = []
+
+	def start(self, tag, attrib):
+		self.names.append(tag.rsplit("}", 1)[-1])
+		if len(self.names) <= self.depth and tuple(self.names) in self.targets:
+			self.texts = []
+
+	def data(self, text):
+		if self.texts is not None:
+			self.texts.append(text)
+
+	def end(self, tag):
+		if self.texts is not None and len(self.names) <= self.depth and tuple(self.names) in self.targets:
+			self.items.append((self.targets[tuple(self.names)], "".join(self.texts).strip()))
+			self.texts = None
+		self.names.pop()
+
+	def close(self):
+		return None
+
+# (path, text) of every element at given paths below config, yielded chunk by chunk as the document is parsed
+def _iter_items(xml_data, paths):
+	collector = _ItemCollector(dict((CONFIG_PATH + tuple(path.split("/")), path) for path in paths))
+	parser = XMLParser(target=collector)
+	for chunk in _chunks(xml_data):
+		parser.feed(chunk)
+		for item in collector.items:
+			yield item
+		collector.items = []
+	parser.close()
+	for item in collector.items:
+		yield item
+
+# Text of every element at 'path' below config (e.g. 'exclusions/info/item'), yielded chunk by chunk as the
+# document is parsed. Memory use does not depend on number of items.
+def iter_config_items(xml_data, path):
+	for item_path, item in _iter_items(xml_data, (path,)):
+		yield item
+
+# Items counted by parse_policy_outline() in single pass: 'counts' is list of (path, number of items), (path, text)
+# of non-empty items is yielded path after path in that order. Item lists are normally in the same order in the
+# document, items of path which comes earlier than asked for are held until it is its turn. Parsing stops once
+# all counted items were seen.
+def stream_config_items(xml_data, counts):
+	counts = [(path, count) for path, count in counts if count]
+	if not counts:
+		return
+	held = dict((path, []) for path, count in counts)
+	turn = 0
+	remaining = counts[0][1]
+	for path, item in _iter_items(xml_data, [path for path, count in counts]):
+		if not item:
+			continue
+		if path != counts[turn][0]:
+			held[path].append(item)
+			continue
+		yield path, item
+		remaining -= 1
+		while remaining == 0:
+			turn += 1
+			if turn == len(counts):
+				return
+			path = counts[turn][0]
+			remaining = counts[turn][1]
+			for item in held.pop(path):
+				yield path, item
+				remaining -= 1
@@ -0,0 +1,181 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import time
+import random
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Status codes which are worth retrying, anything else (e.g. 404) is handed back to caller straight away
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Read integer header value, returns None if header is missing or malformed
+def header_int(headers, name):
+	try:
+		return int(headers[name])
+	except (KeyError, TypeError, ValueError):
+		return None
+
+# 'Retry-After' is either number of seconds or HTTP date, returns seconds to wait or None
+def retry_after_seconds(headers):
+	if not headers or 'Retry-After' not in headers:
+		return None
+	value = headers['Retry-After']
+	try:
+		return max(float(value), 0.0)
+	except (TypeError, ValueError):
+		pass
+	try:
+		when = parsedate_to_datetime(value)
+	except (TypeError, ValueError, IndexError):
+		return None
+	if when.tzinfo is None:
+		when = when.replace(tzinfo=datetime.timezone.utc)
+	return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+#####################################################################################
+# RATE LIMITER
+#####################################################################################
+
+# Rate limiter shared by all worker threads talking to the same API.
+# Requests are paced by 'X-RateLimit-Remaining' / 'X-RateLimit-Reset' headers: every request holds a slot
+# while it is in flight and once remaining requests (minus those in flight) drop to 'reserve', workers wait
+# exactly until the window resets. Server (or proxy in front of it) which sends no budget headers is not paced,
+# requests go out as fast as workers send them. 429 honours 'Retry-After' and pauses all workers, 5xx and connection
+# errors are retried with bounded exponential backoff and jitter. Time spent waiting is kept in metrics.
+class RateLimiter(object):
+	def __init__(self, reserve=45, max_retries=5, backoff_base=1.0, backoff_cap=60.0, sleep=time.sleep, clock=time.monotonic):
+		self.reserve = reserve
+		self.max_retries = max_retries
+		self.backoff_base = backoff_base
+		self.backoff_cap = backoff_cap
+		self.sleep = sleep
+		self.clock = clock
+		self.condition = threading.Condition()
+		# Unknown until first response arrives, only single probe request is allowed meanwhile
+		self.remaining = None
+		self.reset_at = 0.0
+		# Last response came without budget headers - there is nothing to pace by, probe is not waited for
+		self.unmetered = False
+		# Set by 429, nothing is sent until then
+		self.paused_until = 0.0
+		self.in_flight = 0
+		# Metrics
+		self.requests = 0
+		self.retries = 0
+		self.throttled_seconds = 0.0
+		self.backoff_seconds = 0.0
+		self.status_counts = {}
+
+	# Block until there is budget left for one more request
+	def acquire(self):
+		with self.condition:
+			started = self.clock()
+			while True:
+				now = self.clock()
+				if now < self.paused_until:
+					self.condition.wait(self.paused_until - now)
+					continue
+				if self.remaining is not None and now >= self.reset_at:
+					# Window is over, we do not know new remaining value until next response
+					self.remaining = None
+				if self.remaining is None:
+					if self.in_flight == 0 or self.unmetered:
+						break
+					self.condition.wait()
+				elif self.remaining - self.in_flight > self.reserve:
+					break
+				else:
+					self.condition.wait(max(self.reset_at - now, 0.1))
+			self.in_flight += 1
+			self.requests += 1
+			self.throttled_seconds += self.clock() - started
+
+	# Give slot back and update budget from response headers
+	def release(self, headers=None, status_code=None):
+		with self.condition:
+			self.in_flight -= 1
+			if status_code is not None:
+				self.status_counts[status_code] = self.status_counts.get(status_code, 0) + 1
+			# Connection errors (no status code) tell nothing about the budget
+			if status_code is not None:
+				now = self.clock()
+				remaining = header_int(headers, 'X-RateLimit-Remaining')
+				reset = header_int(headers, 'X-RateLimit-Reset')
+				if status_code == 429:
+					# We are over the limit - nobody sends anything until server says so
+					wait = retry_after_seconds(headers)
+					if wait is None:
+						wait = reset
+					if wait is not None:
+						# Responses of requests still in flight do not lift the pause, afterwards single probe re-learns the budget
+						self.paused_until = max(self.paused_until, now + wait)
+						self.remaining = None
+				elif remaining is not None and reset is not None:
+					reset_at = now + reset
+					# Responses can arrive out of order, within the same window only trust the lowest value
+					if self.remaining is not None and now < self.reset_at and reset_at <= self.reset_at + 1:
+						remaining = min(remaining, self.remaining)
+					self.remaining = remaining
+					self.reset_at = reset_at
+					self.unmetered = False
+				else:
+					# No budget to pace by (console or proxy does not send it), waiting for it would serialise all
+					# workers for the whole run. Response with budget headers switches pacing back on.
+					self.unmetered = True
+			self.condition.notify_all()
+
+	# Exponential backoff with full jitter, never longer than backoff_cap
+	def backoff(self, attempt):
+		return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+	# Send GET request through session, pace it against the budget and retry 429 / 5xx / connection errors.
+	# Returns last response (caller still has to check status code), raises last error if connection never succeeded.
+	def get(self, session, url, **kwargs):
+		attempt = 0
+		while True:
+			self.acquire()
+			response = None
+			try:
+				response = session.get(url, **kwargs)
+			except (OSError, IOError):
+				# requests exceptions are derived from IOError
+				if attempt >= self.max_retries:
+					raise
+				wait = self.backoff(attempt)
+			else:
+				if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+					return response
+				if response.status_code == 429 and (retry_after_seconds(response.headers) is not None or header_int(response.headers, 'X-RateLimit-Reset') is not None):
+					# Budget was already paused in release(), acquire() does the waiting
+					wait = 0.0
+				elif response.status_code == 429:
+					wait = self.backoff(attempt)
+				else:
+					wait = retry_after_seconds(response.headers)
+					if wait is None:
+						wait = self.backoff(attempt)
+			finally:
+				if response is not None:
+					self.release(response.headers, response.status_code)
+				else:
+					self.release()
+			# Streamed response holds its connection until it is closed
+			if response is not None:
+				response.close()
+			attempt += 1
+			with self.condition:
+				self.retries += 1
+				self.backoff_seconds += wait
+			if wait > 0:
+				self.sleep(wait)
+
+	# One line summary of what limiter did during the run
+	def summary(self):
+		return "API requests: {}, retries: {}, time throttled by rate limit: {:.1f}s, time in retry backoff: {:.1f}s".format(self.requests, self.retries, self.throttled_seconds, self.backoff_seconds)
@@ -0,0 +1,235 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import re
+import math
+import time
+import random
+try:
+	import re._parser as sre_parse
+	from re._constants import MAXREPEAT
+except ImportError:
+	import sre_parse
+	from sre_constants import MAXREPEAT
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+# Folders synthetic workload is built from
+WORKLOAD_FOLDERS = {
+	"windows": ["C:\\Windows\\System32", "C:\\Windows\\WinSxS\\amd64_microsoft-windows", "C:\\Users\\bob\\AppData\\Local\\Microsoft\\OneDrive",
+		"C:\\Program Files\\Common Files\\microsoft shared\\ClickToRun", "C:\\ProgramData\\Microsoft\\Windows Defender\\Scans", "D:\\data\\projects"],
+	"mac": ["/Users/bob/Library/Caches/com.apple.Safari", "/System/Library/Frameworks", "/Applications/App.app/Contents/MacOS", "/private/var/folders/xy"],
+	"linux": ["/var/log/journal", "/var/lib/docker/overlay2", "/usr/lib/x86_64-linux-gnu", "/home/bob/.cache/pip", "/opt/app/v1/cache"],
+}
+WORKLOAD_NAMES = ["setup.exe", "kernel32.dll", "report.sas7bdat", "~$budget.xlsx", "cache.tmp", "index.db-journal", "libssl.so.1.1", "README"]
+
+# Lengths adversarial input is grown through. Small steps at first, as exponential blow up has to be caught early.
+GROWTH_LENGTHS = (4, 8, 12, 16, 20, 24, 28, 32, 48, 64, 128, 256, 512, 1024, 2048)
+
+# Typical file paths of given product, deterministic for given seed
+def synthetic_paths(product, count=2000, seed=1):
+	rnd = random.Random(seed)
+	sep = "\\" if product == "windows" else "/"
+	folders = WORKLOAD_FOLDERS.get(product, WORKLOAD_FOLDERS["linux"])
+	paths = []
+	for i in range(count):
+		middle = "".join("{}sub{}.d".format(sep, rnd.randint(0, 99)) for _ in range(rnd.randint(0, 4)))
+		paths.append("{}{}{}{}".format(rnd.choice(folders), middle, sep, rnd.choice(WORKLOAD_NAMES)))
+	return paths
+
+# Set of characters expression element can start with, None means 'anything'
+def _first_chars(items):
+	for op, av in items:
+		if op == sre_parse.LITERAL:
+			return set([av])
+		if op == sre_parse.ANY:
+			return None
+		if op == sre_parse.IN:
+			chars = set()
+			for iop, iav in av:
+				if iop == sre_parse.LITERAL:
+					chars.add(iav)
+				elif iop == sre_parse.RANGE:
+					chars.update(range(iav[0], iav[1] + 1))
+				else:
+					# Negated set or category - wide enough to be 'anything'
+					return None
+			return chars
+		if op == sre_parse.SUBPATTERN:
+			return _first_chars(av[3])
+		if op in _REPEATS:
+			first = _first_chars(av[2])
+			if av[0] > 0 or first is None:
+				return first
+			# Optional element - whatever follows can come first as well
+			continue
+		if op == sre_parse.AT:
+			continue
+		return None
+	return set()
+
+# Element matches (nearly) any character: '.', negated set or category
+def _is_wide(items):
+	if len(items) != 1:
+		return False
+	op, av = items[0]
+	if op == sre_parse.ANY:
+		return True
+	if op == sre_parse.IN:
+		return any(iop in (sre_parse.NEGATE, sre_parse.CATEGORY) for iop, iav in av)
+	return False
+
+def _is_unbounded(op, av):
+	return op in _REPEATS and av[1] == MAXREPEAT
+
+# Walk parsed expression and collect structural problems
+def _walk(items, in_repeat, found):
+	wide_run = 0
+	for i, (op, av) in enumerate(items):
+		if _is_unbounded(op, av):
+			if in_repeat:
+				found.add("nested quantifier (catastrophic backtracking)")
+			# Optional .* at the very end always matches, it never makes engine backtrack
+			if _is_wide(av[2]) and not (i == len(items) - 1 and av[0] == 0):
+				wide_run += 1
+				if wide_run == 2:
+					found.add("several .* in sequence (polynomial backtracking)")
+			else:
+				wide_run = 0
+			_walk(av[2], True, found)
+			continue
+		# Anything between two .* (e.g. literal '\.sas') anchors the match, they are not in sequence
+		wide_run = 0
+		if op in _REPEATS:
+			_walk(av[2], in_repeat, found)
+		elif op == sre_parse.SUBPATTERN:
+			_walk(av[3], in_repeat, found)
+		elif op == sre_parse.BRANCH:
+			branches = av[1]
+			if in_repeat:
+				# Alternatives which can start with the same character make engine try both for every repetition
+				seen = set()
+				for branch in branches:
+					first = _first_chars(branch)
+					if first is None or seen & first:
+						found.add("overlapping alternation inside quantifier (catastrophic backtracking)")
+						break
+					seen |= first
+			for branch in branches:
+				_walk(branch, in_repeat, found)
+		elif op == sre_parse.GROUPREF:
+			found.add("back reference (no linear time guarantee)")
+
+# Problems which can be seen from structure of the expression
+def static_flags(pattern):
+	parsed = list(sre_parse.parse(pattern))
+	found = set()
+	_walk(parsed, False, found)
+	body = parsed
+	if body and body[0] == (sre_parse.AT, sre_parse.AT_BEGINNING):
+		body = body[1:]
+	if body and _is_unbounded(*body[0]) and _is_wide(body[0][1][2]):
+		found.add("leading .* (scans and backtracks over whole path)")
+	if body and len(body) > 1 and _is_unbounded(*body[-1]) and _is_wide(body[-1][1][2]) and body[-1][1][0] == 0:
+		found.add("trailing .* (redundant, exclusions match path prefix)")
+	return sorted(found)
+
+# Inputs which make backtracking engine work hardest: repeated characters the expression knows about,
+# ending with character it does not, so match fails as late as possible
+def _adversarial_builders(pattern, sep):
+	literals = [c for c in dict.fromkeys(re.sub(r"\\(.)", r"\1", pattern)) if c.isprintable() and c not in "^$()[]{}|*+?"]
+	unit = "".join(literals[:8]) or "a"
+	builders = [lambda n, c=c: c * n + "\x00" for c in literals[:8]]
+	builders.append(lambda n: (unit * (n // len(unit) + 1))[:n] + "\x00")
+	builders.append(lambda n: "C:" + (sep + "a.") * (n // 3) + "\x00")
+	return builders
+
+def _time_once(regex, text):
+	start = time.perf_counter()
+	regex.match(text)
+	return time.perf_counter() - start
+
+#####################################################################################
+# COST MEASUREMENT
+#####################################################################################
+
+# Evaluation cost of one exclusion pattern
+class PatternCost(object):
+	def __init__(self, pattern, regex, product):
+		self.pattern = pattern
+		self.regex = regex
+		self.product = product
+		self.flags = []
+		self.ns_per_path = None
+		self.growth = None
+		self.catastrophic = False
+
+	# Catastrophic ones first, then by measured cost
+	def rank_key(self):
+		return (not self.catastrophic, -(self.ns_per_path or 0))
+
+# Average time of matching pattern against workload paths, best of 'rounds', in nanoseconds per path
+def measure(regex, paths, rounds=3):
+	match = regex.match
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		for path in paths:
+			match(path)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best * 1e9 / max(1, len(paths))
+
+# Grow adversarial input and watch how matching time grows with it. Returns (exponent estimate, catastrophic).
+# Growth is stopped as soon as single match takes longer than 'budget' seconds, so even exponential
+# patterns cost a fraction of second. Blowing the budget on a short input means exponential backtracking.
+def growth(regex, pattern, sep, budget=0.05):
+	worst = 1.0
+	for build in _adversarial_builders(pattern, sep):
+		points = []
+		for n in GROWTH_LENGTHS:
+			elapsed = _time_once(regex, build(n))
+			if elapsed < budget / 10:
+				elapsed = min(elapsed, _time_once(regex, build(n)))
+			points.append((n, elapsed))
+			if elapsed > budget:
+				if n <= 64:
+					return None, True
+				break
+		# Exponent from the longest inputs, where timer noise does not matter
+		measurable = [(n, t) for n, t in points if t > 2e-5 and n >= 64]
+		if len(measurable) >= 2:
+			(n1, t1), (n2, t2) = measurable[-2], measurable[-1]
+			worst = max(worst, math.log(t2 / t1) / math.log(float(n2) / n1))
+	return worst, False
+
+# Static and measured cost of every (pattern, product) pair. 'patterns' is iterable of (pattern, compiled regex, product),
+# workload of 'workload_size' synthetic paths is built per product. Returns list of PatternCost, most expensive first.
+def analyze_patterns(patterns, workload_size=2000, rounds=3):
+	workloads = {}
+	results = []
+	for pattern, regex, product in patterns:
+		cost = PatternCost(pattern, regex, product)
+		try:
+			cost.flags = static_flags(pattern)
+		except (re.error, RecursionError, OverflowError):
+			cost.flags = []
+		sep = "\\" if product == "windows" else "/"
+		cost.growth, cost.catastrophic = growth(regex, pattern, sep)
+		if cost.catastrophic:
+			cost.flags = sorted(set(cost.flags) | set(["exponential time on adversarial input"]))
+		else:
+			if product not in workloads:
+				workloads[product] = synthetic_paths(product, workload_size)
+			cost.ns_per_path = measure(regex, workloads[product], rounds)
+			if cost.growth is not None and cost.growth >= 1.8:
+				cost.flags = sorted(set(cost.flags) | set(["super-linear time on long paths (~n^{:.1f})".format(cost.growth)]))
+		results.append(cost)
+	results.sort(key=lambda c: c.rank_key())
+	return results
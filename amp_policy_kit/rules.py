@@ -0,0 +1,294 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import hashlib
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Marker for setting which is not present in policy (None is a valid value - empty XML element)
+MISSING = object()
+
+# Namespace prefix used by parsed policy dictionary
+PREFIX = "ns0:"
+
+# Predicates used by rule conditions. Values are compared as strings, the same way parsers always did.
+def _equals(value, expected):
+	return value is not MISSING and str(value) == expected
+
+def _greater(value, limit):
+	try:
+		return int(value) > limit
+	except (TypeError, ValueError):
+		return False
+
+OPERATORS = {
+	"==": _equals,
+	">": _greater,
+	"missing": lambda value, expected: value is MISSING,
+	"present": lambda value, expected: value is not MISSING,
+}
+
+# Turn 'agent/apde/enable' into tuple of dictionary keys
+def compile_path(path):
+	return tuple(PREFIX + key for key in path.split("/"))
+
+#####################################################################################
+# RULE ENGINE
+#####################################################################################
+
+# Single policy check defined as data.
+# 'when' is list of (path, operator, value) conditions which all have to match, paths are relative to 'ns0:config'.
+# 'requires' lists paths (subtrees) which have to be present before rule is evaluated at all.
+# 'products' limits rule to given product types, None means all products.
+# Message can refer to observed value of the first condition as {value}.
+class Rule(object):
+	def __init__(self, rule_id, message, when, severity="medium", products=None, requires=()):
+		self.rule_id = rule_id
+		self.message = message
+		self.when = when
+		self.severity = severity
+		self.products = products
+		self.requires = requires
+
+	def applies_to(self, product):
+		return self.products is None or product in self.products
+
+# Rules compiled for one product type: every distinct path is resolved exactly once per policy by walking
+# a trie of path keys, a missing subtree skips all paths below it. Rules then only look up resolved values.
+class _CompiledProduct(object):
+	def __init__(self, rules):
+		self.trie = {}
+		# Path of every resolved value, by path id
+		self.paths = []
+		path_ids = {}
+
+		def path_id(path):
+			keys = compile_path(path)
+			if keys not in path_ids:
+				path_ids[keys] = len(path_ids)
+				self.paths.append(path)
+				node = self.trie
+				for i, key in enumerate(keys):
+					entry = node.get(key)
+					if entry is None:
+						entry = [None, {}]
+						node[key] = entry
+					if i == len(keys) - 1:
+						entry[0] = path_ids[keys]
+					node = entry[1]
+			return path_ids[keys]
+
+		self.rules = []
+		for rule in rules:
+			conditions = tuple((path_id(path), OPERATORS[op], expected) for path, op, expected in rule.when)
+			requires = tuple(path_id(path) for path in rule.requires)
+			self.rules.append((rule, requires, conditions))
+		self.size = len(path_ids)
+
+	# Resolve all paths used by rules in single walk over the policy config
+	def resolve(self, config):
+		values = [MISSING] * self.size
+		stack = [(self.trie, config)]
+		while stack:
+			node, data = stack.pop()
+			if not isinstance(data, dict):
+				continue
+			for key, (pid, children) in node.items():
+				value = data.get(key, MISSING)
+				if value is MISSING:
+					continue
+				if pid is not None:
+					values[pid] = value
+				if children:
+					stack.append((children, value))
+		return values
+
+	def evaluate(self, config):
+		values = self.resolve(config)
+		matches = []
+		for rule, requires, conditions in self.rules:
+			if any(values[pid] is MISSING for pid in requires):
+				continue
+			for pid, predicate, expected in conditions:
+				if not predicate(values[pid], expected):
+					break
+			else:
+				matches.append((rule, values[conditions[0][0]]))
+		return matches
+
+# Set of rules shared by online and offline audit. Compiled lazily once per product type.
+class RuleSet(object):
+	def __init__(self, rules):
+		self.rules = list(rules)
+		self.compiled = {}
+		self._version = None
+		self._resolver = None
+
+	# Fingerprint of rule definitions - changes whenever a rule is added, removed or edited (used by audit cache)
+	@property
+	def version(self):
+		if self._version is None:
+			definitions = [(r.rule_id, r.message, r.when, r.severity, r.products, r.requires) for r in self.rules]
+			self._version = hashlib.sha256(repr(definitions).encode("utf-8")).hexdigest()[:16]
+		return self._version
+
+	# Returns list of (rule, observed value) for all rules matching given policy config, in rule definition order
+	def evaluate(self, config, product):
+		compiled = self.compiled.get(product)
+		if compiled is None:
+			compiled = _CompiledProduct([r for r in self.rules if r.applies_to(product)])
+			self.compiled[product] = compiled
+		return compiled.evaluate(config)
+
+	# Paths used by rules of all products with resolver of their values (settings matrix)
+	def resolver(self):
+		if self._resolver is None:
+			self._resolver = _CompiledProduct(self.rules)
+		return self._resolver
+
+# Human readable text of a match, e.g. TTL rules show observed value
+def format_message(rule, value):
+	if rule.when[0][1] == ">":
+		value = int(value)
+	return rule.message.format(value=value)
+
+#####################################################################################
+# POLICY RULES
+#####################################################################################
+
+WINDOWS = ("windows",)
+MAC = ("mac",)
+UNIX = ("mac", "linux")
+DESKTOP = ("windows", "mac", "linux")
+UI_PRODUCTS = ("windows", "mac")
+SCAN = ("agent/scansettings",)
+
+POLICY_RULES = RuleSet([
+	Rule("connector-password", "AMP installation is not protected by password. Change this in 'Administrative Features > Enable Connector Protection'",
+		[("agent/control/passwordex", "missing", None)], "high", WINDOWS, requires=("agent/control",)),
+
+	# Cloud lookup cache TTL
+	Rule("cache-ttl-unknown", "Potentially long TTL on unknown hash lookup : {value}. Change this in 'Advance Settings > Cache'",
+		[("agent/cloud/cache/ttl/unknown", ">", 3600)], "low", DESKTOP),
+	Rule("cache-ttl-clean", "Potentially long TTL on clean hash lookup : {value}. Change this in 'Advance Settings > Cache'",
+		[("agent/cloud/cache/ttl/clean", ">", 3600)], "low", DESKTOP),
+	Rule("cache-ttl-malicious", "Potentially long TTL on malicious hash lookup : {value}. Change this in 'Advance Settings > Cache'",
+		[("agent/cloud/cache/ttl/malicious", ">", 3600)], "low", DESKTOP),
+	Rule("cache-ttl-unseen", "Potentially long TTL on unseen hash lookup : {value}. Change this in 'Advance Settings > Cache'",
+		[("agent/cloud/cache/ttl/unseen", ">", 3600)], "low", DESKTOP),
+	Rule("cache-ttl-block", "Potentially long TTL on block hash lookup : {value}. Change this in 'Advance Settings > Cache'",
+		[("agent/cloud/cache/ttl/block", ">", 3600)], "low", DESKTOP),
+
+	# APDE = behavioral analytics
+	Rule("apde-disabled", "Behavioral Protection is disabled. Change this in 'Modes and Engines > Behavioral Protection'",
+		[("agent/apde/enable", "==", "0")], "high", WINDOWS),
+	Rule("apde-audit", "Behavioral Protection is set to AUDIT. Change this in 'Modes and Engines > Behavioral Protection'",
+		[("agent/apde/enable", "==", "1"), ("agent/apde/mode", "==", "0")], "medium", WINDOWS),
+
+	# Driver settings
+	Rule("file-protection-audit", "FILE protection is set to AUDIT. Change this in 'Modes and Engines > File'",
+		[("agent/driver/blockexecqaction", "==", "0"), ("agent/driver/protmode/qaction", "==", "0")], "medium", WINDOWS),
+	Rule("monitor-file-copy-disabled", "Monitor File Copies and Moves Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/file", "==", "0")], "medium", WINDOWS),
+	Rule("monitor-process-disabled", "Monitor Process Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/process", "==", "0")], "medium", WINDOWS),
+	Rule("spp-audit", "System Process Protection is set to AUDIT. Change this in 'Modes and Engines > Malicious Activity Protection > System Process Protection'",
+		[("agent/driver/selfprotect/spp_qaction", "==", "0")], "medium", WINDOWS),
+	Rule("spp-disabled", "System Process Protection is set to DISABLED. Change this in 'Modes and Engines > Malicious Activity Protection > System Process Protection'",
+		[("agent/driver/selfprotect/spp", "==", "0"), ("agent/driver/selfprotect/mkp", "==", "0"), ("agent/driver/selfprotect/sde", "==", "0"), ("agent/driver/selfprotect/spp_qaction", "==", "1")], "high", WINDOWS),
+	Rule("on-execute-passive", "On Execute Mode is set to PASSIVE. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/activeexec", "==", "0")], "medium", WINDOWS),
+
+	# Endpoint isolation
+	Rule("isolation-disabled", "Endpoint Isolation feature is disabled. Change this in 'Advance Settings > Endpoint Isolation'",
+		[("agent/endpointisolation/enable", "==", "0")], "low", WINDOWS),
+	Rule("isolation-proxy-enabled", "Endpoint Isolation feature is ENABLED and access to proxy is enabled. Change this in 'Advance Settings > Endpoint Isolation'",
+		[("agent/endpointisolation/enable", "==", "1"), ("agent/endpointisolation/allowproxy", "==", "1")], "low", WINDOWS),
+	Rule("isolation-proxy-disabled", "Endpoint Isolation feature is ENABLED and access to proxy is disabled. Change this in 'Advance Settings > Endpoint Isolation'",
+		[("agent/endpointisolation/enable", "==", "1"), ("agent/endpointisolation/allowproxy", "==", "0")], "low", WINDOWS),
+
+	# Orbital
+	Rule("orbital-disabled", "ORBITAL is disabled. Change this in 'Advance Settings > Orbital'",
+		[("orbital/enablemsi", "==", "0")], "low", WINDOWS),
+
+	# Scanner settings
+	Rule("ethos-disabled", "ETHOS engine is disabled. Change this in 'Advance Settings > Engines'",
+		[("agent/scansettings/ethos/enable", "==", "0")], "medium", WINDOWS),
+	Rule("ethos-copy-move-disabled", "ETHOS engine is ENABLED but ON COPY/MOVE scanning is disabled. Change this in 'Advance Settings > Engines'",
+		[("agent/scansettings/ethos/enable", "==", "1"), ("agent/scansettings/ethos/file", "==", "0")], "low", WINDOWS),
+	Rule("network-drives-disabled", "Monitoring of Network Drives is diabled. Change this in 'Advance Settings > Engines'",
+		[("agent/scansettings/ssd", "==", "0")], "low", WINDOWS),
+	Rule("spero-disabled", "SPERO engine is disabled. Change this in 'Advance Settings > Engines'",
+		[("agent/scansettings/spero/enable", "==", "0")], "medium", WINDOWS),
+	Rule("tetra-disabled", "TETRA engine is disabled. Change this in 'Advance Settings > TETRA'",
+		[("agent/scansettings/tetra/enable", "==", "0")], "high", WINDOWS),
+	Rule("tetra-archives-disabled", "TETRA engine is ENABLED but ARCHIVE scan is disabled. Change this in 'Advance Settings > TETRA'",
+		[("agent/scansettings/tetra/options/ondemand/scanarchives", "==", "0"), ("agent/scansettings/tetra/enable", "==", "1")], "medium", WINDOWS),
+	Rule("tetra-packed-disabled", "TETRA engine is ENABLED but PACKED FILE scan is disabled. Change this in 'Advance Settings > TETRA'",
+		[("agent/scansettings/tetra/options/ondemand/scanpacked", "==", "0"), ("agent/scansettings/tetra/enable", "==", "1")], "medium", WINDOWS),
+	Rule("tetra-deepscan-disabled", "TETRA engine is ENABLED but DEEP scan is disabled. Change this in 'Advance Settings > TETRA'",
+		[("agent/scansettings/tetra/options/ondemand/deepscan", "==", "0"), ("agent/scansettings/tetra/enable", "==", "1")], "medium", WINDOWS),
+
+	# Malicious Activity Protection - enabled & qaction 0 = audit, qaction 1 = quarantine, qaction 2 = block
+	Rule("map-disabled", "Malicious Activity Protection is DISABLED. Change this in 'Modes and Engines > Malicious Activity Protection'",
+		[("agent/heuristic/enable", "==", "0")], "high", WINDOWS, requires=SCAN),
+	Rule("map-audit", "Malicious Activity Protection is ENABLED but set to AUDIT mode. Change this in 'Modes and Engines > Malicious Activity Protection'",
+		[("agent/heuristic/enable", "==", "1"), ("agent/heuristic/qaction", "==", "0")], "medium", WINDOWS, requires=SCAN),
+	Rule("map-quarantine", "Malicious Activity Protection is ENABLED but set to QUARANTINE mode. Change this in 'Modes and Engines > Malicious Activity Protection'",
+		[("agent/heuristic/enable", "==", "1"), ("agent/heuristic/qaction", "==", "1")], "low", WINDOWS, requires=SCAN),
+
+	# Exploit prevention
+	Rule("exprev-disabled", "Exploit Prevention is disabled. Change this in 'Modes and Engines > Exploit Protection'",
+		[("agent/exprev/enable", "==", "0")], "high", WINDOWS, requires=SCAN),
+	Rule("exprev-audit", "Exploit Prevention is set to AUDIT. Change this in 'Modes and Engines > Exploit Protection'",
+		[("agent/exprev/enable", "==", "1"), ("agent/exprev/v4/options", "==", "0x0000033B")], "medium", WINDOWS, requires=SCAN),
+
+	# AMSI engine
+	Rule("script-protection-disabled", "Script Protection engine is disabled. Change this in 'Modes and Engines > Script Protection'",
+		[("agent/amsi/enable", "==", "0")], "medium", WINDOWS, requires=SCAN),
+	Rule("script-protection-audit", "Script Protection is ENABLED and engine is set to AUDIT. Change this in 'Modes and Engines > Script Protection'",
+		[("agent/amsi/enable", "==", "1"), ("agent/amsi/mode", "==", "0")], "medium", WINDOWS, requires=SCAN),
+
+	# Mac / Linux driver settings
+	Rule("file-blocking-audit", "FILE blocking is set to AUDIT mode. Change this in 'Modes and Engines > Conviction Modes > Files'",
+		[("agent/driver/protmode/qaction", "==", "0")], "medium", UNIX),
+	Rule("monitor-process-disabled", "Monitor Process Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/process", "==", "0")], "medium", UNIX),
+	Rule("monitor-file-copy-disabled", "Monitor File Copies and Moves Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/file", "==", "0")], "medium", UNIX),
+	Rule("on-execute-passive", "On Execute Mode is set to PASSIVE. Change this in 'Advance Settings > File and Process Scan'",
+		[("agent/driver/protmode/activeexec", "==", "0")], "medium", UNIX),
+	Rule("clamav-disabled", "CLAMAV engine is disabled. Change this in 'Advance Settings > ClamAV'",
+		[("agent/scansettings/clamav/enable", "==", "0")], "medium", UNIX),
+
+	# Settings common for all products
+	Rule("nfm-disabled", "Network/Device Flow Monitoring is disabled. Change this in 'Advance Settings > Network'",
+		[("agent/nfm/enable", "==", "0")], "medium"),
+	Rule("nfm-audit", "Network/Device Flow Monitoring is ENABLED but set AUDIT. Change this in 'Advance Settings > Network'",
+		[("agent/nfm/enable", "==", "1"), ("agent/nfm/settings/qaction", "==", "0")], "low"),
+	Rule("cmdline-capture-disabled", "Command line capture is disabled. Change this in 'Advance Settings > Administrative Feature > Command Line Capture'",
+		[("agent/cmdlinecapture/enable", "==", "0")], "low"),
+
+	# Client user interface
+	Rule("ui-exclusions-shown", "EXCLUSIONS are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/exclusions/display", "==", "1")], "medium", UI_PRODUCTS),
+	Rule("ui-cloud-notification", "CLOUD notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/cloud", "==", "1")], "low", UI_PRODUCTS),
+	Rule("ui-file-notification", "FILE notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_file_toast", "==", "0")], "low", UI_PRODUCTS),
+	Rule("ui-nfm-notification", "NETWORK FLOW notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_nfm_toast", "==", "0")], "low", UI_PRODUCTS),
+	Rule("ui-verbose-logs", "VERBOSE logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/verbose", "==", "1")], "low", UI_PRODUCTS),
+	Rule("ui-ioc-notification", "IOC logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_ioc_toast", "==", "0")], "low", WINDOWS),
+	Rule("ui-detection-notification", "DETECTION logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_detection_toast", "==", "0")], "low", WINDOWS),
+	Rule("ui-heuristic-notification", "HEURISTIC logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_heuristic_toast", "==", "0")], "low", WINDOWS),
+	Rule("ui-exprev-notification", "EXPLOIT PREVENTION logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'",
+		[("ui/notification/hide_exprev_toast", "==", "0")], "low", WINDOWS),
+])
@@ -0,0 +1,191 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+from urllib.parse import unquote
+from amp_policy_kit.manifest import PolicyManifest, MANIFEST_NAME, content_hash
+from amp_policy_kit.policyfile import list_policy_files, policy_stem
+from amp_policy_kit.store import PolicyStore, StoreRef, is_store, read_policy
+from amp_policy_kit.policyxml import parse_policy_config
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+from amp_policy_kit.rules import POLICY_RULES, format_message
+from amp_policy_kit.audit import detect_product
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Parts of policy config which audit rules look at. Anything else (signature, timestamps of signing...)
+# may change without the policy changing security-wise.
+SECURITY_SUBTREES = ("janus", "exclusions", "agent", "orbital", "ui")
+
+# Bookkeeping fields of policy header in 'janus' subtree, every re-save of the policy bumps them
+HEADER_BOOKKEEPING = ("ns0:serial_number", "ns0:updated")
+
+# Policy header without bookkeeping fields, so re-save which changes nothing else is not a security change
+def comparable_header(header):
+	if not isinstance(header, dict) or not isinstance(header.get('ns0:policy'), dict):
+		return header
+	policy = dict((key, value) for key, value in header['ns0:policy'].items() if key not in HEADER_BOOKKEEPING)
+	return dict(header, **{'ns0:policy': policy})
+
+# Exclusion lists compared between snapshots
+EXCLUSION_PATHS = (
+	("path", "exclusions/info/item"),
+	("certificate", "exclusions/certissuer/name"),
+	("process", "exclusions/process/item"),
+)
+
+# Policy file of a snapshot
+class SnapshotEntry(object):
+	def __init__(self, guid, path, digest=None, product=None):
+		self.guid = guid
+		self.path = path
+		self.digest = digest
+		self.product = product
+
+	def read(self):
+		return read_policy(self.path)
+
+	# Content hash from manifest if download script left one, otherwise computed from file
+	def content_digest(self):
+		if self.digest is None:
+			self.digest = content_hash(self.read())
+		return self.digest
+
+# Policies of snapshot folder (or policy store) by GUID. Manifest of download script is used when present (GUID, product and
+# hash of every file without reading it), otherwise GUID and product come from '<guid>_<product>.xml' file names (optionally compressed).
+def load_snapshot(folder):
+	entries = {}
+	if is_store(folder):
+		with PolicyStore(folder, readonly=True) as store:
+			for entry in store.entries():
+				entries[entry.guid] = SnapshotEntry(entry.guid, StoreRef(folder, entry.guid, entry.product), entry.sha256, entry.product)
+		return entries
+	if os.path.exists(os.path.join(folder, MANIFEST_NAME)):
+		manifest = PolicyManifest(folder)
+		for guid, entry in manifest.policies.items():
+			path = os.path.join(folder, entry["filename"])
+			if os.path.exists(path):
+				entries[guid] = SnapshotEntry(guid, path, entry.get("sha256"), entry.get("product"))
+		return entries
+	for path in list_policy_files(folder):
+		stem = policy_stem(path)
+		guid, _, product = stem.rpartition("_")
+		if not guid:
+			guid, product = stem, None
+		entries[guid] = SnapshotEntry(guid, path, None, product)
+	return entries
+
+#####################################################################################
+# POLICY STATE
+#####################################################################################
+
+# Security relevant state of one policy: subtrees used by rules, rule findings and exclusion lists
+class PolicyState(object):
+	def __init__(self, xml_data, product=None):
+		json_object = parse_policy_config(xml_data, SECURITY_SUBTREES)
+		config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		if not isinstance(config, dict):
+			config = {}
+		self.subtrees = dict((name, config.get('ns0:' + name)) for name in SECURITY_SUBTREES)
+		index = PolicyIndex(config, PRODUCT_MARKERS)
+		self.product = product or detect_product(index)
+		header = self.subtrees['janus'] if isinstance(self.subtrees['janus'], dict) else {}
+		policy = header.get('ns0:policy') if isinstance(header.get('ns0:policy'), dict) else {}
+		self.name = policy.get('ns0:name')
+		self.guid = policy.get('ns0:uuid')
+		self.serial_number = policy.get('ns0:serial_number')
+		self.subtrees['janus'] = comparable_header(self.subtrees['janus'])
+		# rule id -> (severity, message)
+		self.findings = {}
+		if config.get('ns0:agent') is not None:
+			for rule, value in POLICY_RULES.evaluate(config, self.product):
+				self.findings[rule.rule_id] = (rule.severity, format_message(rule, value))
+		# kind -> set of exclusions
+		self.exclusions = {}
+		for kind, path in EXCLUSION_PATHS:
+			values = self._lookup(config, path)
+			items = index.items(path, values) if index.has(path) else []
+			if kind == "path":
+				items = [e.split("|")[4] if e.count("|") >= 4 else e for e in items]
+			self.exclusions[kind] = set(unquote(e) for e in items)
+
+	def _lookup(self, config, path):
+		value = config
+		for key in path.split("/"):
+			if not isinstance(value, dict):
+				return None
+			value = value.get('ns0:' + key)
+		return value
+
+# State of a policy which does not exist in snapshot
+class _MissingPolicy(object):
+	name = None
+	guid = None
+	product = None
+	serial_number = None
+	subtrees = dict((name, None) for name in SECURITY_SUBTREES)
+	findings = {}
+	exclusions = dict((kind, set()) for kind, path in EXCLUSION_PATHS)
+
+MISSING_POLICY = _MissingPolicy()
+
+#####################################################################################
+# DIFF
+#####################################################################################
+
+# Security relevant differences between two states of the same policy
+class PolicyDiff(object):
+	def __init__(self, guid, status, old, new):
+		self.guid = guid
+		self.status = status
+		self.old = old
+		self.new = new
+		self.name = new.name or old.name
+		self.product = new.product or old.product
+		self.changed_subtrees = [name for name in SECURITY_SUBTREES if old.subtrees[name] != new.subtrees[name]]
+		self.findings_added = [new.findings[r] for r in new.findings if r not in old.findings]
+		self.findings_removed = [old.findings[r] for r in old.findings if r not in new.findings]
+		self.findings_changed = [(old.findings[r], new.findings[r]) for r in new.findings if r in old.findings and old.findings[r] != new.findings[r]]
+		self.exclusions_added = []
+		self.exclusions_removed = []
+		for kind, path in EXCLUSION_PATHS:
+			self.exclusions_added.extend((kind, e) for e in sorted(new.exclusions[kind] - old.exclusions[kind]))
+			self.exclusions_removed.extend((kind, e) for e in sorted(old.exclusions[kind] - new.exclusions[kind]))
+
+	# Policy file changed, but nothing audit looks at did
+	def is_empty(self):
+		return not self.changed_subtrees
+
+# Pair policies of two snapshots by GUID and yield PolicyDiff for every policy which was added, removed or changed
+# security-wise, in GUID order. Byte-identical policies are skipped by comparing content hashes, so only changed
+# policies are parsed. 'stats' (dict) is filled with counts of identical / changed / added / removed policies.
+def diff_snapshots(old_folder, new_folder, stats=None):
+	old_entries = load_snapshot(old_folder)
+	new_entries = load_snapshot(new_folder)
+	if stats is None:
+		stats = {}
+	for key in ("old", "new", "identical", "unchanged", "changed", "added", "removed"):
+		stats[key] = 0
+	stats["old"] = len(old_entries)
+	stats["new"] = len(new_entries)
+	for guid in sorted(set(old_entries) | set(new_entries)):
+		old_entry = old_entries.get(guid)
+		new_entry = new_entries.get(guid)
+		if old_entry is None:
+			stats["added"] += 1
+			yield PolicyDiff(guid, "added", MISSING_POLICY, PolicyState(new_entry.read(), new_entry.product))
+		elif new_entry is None:
+			stats["removed"] += 1
+			yield PolicyDiff(guid, "removed", PolicyState(old_entry.read(), old_entry.product), MISSING_POLICY)
+		elif old_entry.content_digest() == new_entry.content_digest():
+			stats["identical"] += 1
+		else:
+			diff = PolicyDiff(guid, "changed", PolicyState(old_entry.read(), old_entry.product), PolicyState(new_entry.read(), new_entry.product))
+			if diff.is_empty():
+				stats["unchanged"] += 1
+			else:
+				stats["changed"] += 1
+				yield diff
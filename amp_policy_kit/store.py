@@ -0,0 +1,221 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import re
+import glob
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from collections import namedtuple
+from amp_policy_kit.policyfile import policy_stem, read_policy_file, list_policy_files
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Bump when schema changes
+STORE_FORMAT = 1
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# 'updated' timestamp (milliseconds) of policy header, found without parsing the whole document
+UPDATED_PATTERN = re.compile(rb"<(?:[\w.-]+:)?updated>\s*(\d+)\s*</")
+
+# Uncommitted policies after which store commits on its own, so hard kill does not lose a whole run
+COMMIT_EVERY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS policies (
+	guid TEXT PRIMARY KEY,
+	product TEXT,
+	name TEXT,
+	serial_number TEXT,
+	updated INTEGER,
+	sha256 TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	groups TEXT NOT NULL DEFAULT '[]',
+	stored_at REAL NOT NULL,
+	compression TEXT,
+	xml BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS policies_product ON policies (product);
+CREATE INDEX IF NOT EXISTS policies_updated ON policies (updated);
+"""
+
+# Metadata of stored policy (everything but the XML)
+StoreEntry = namedtuple("StoreEntry", "guid product name serial_number updated sha256 size groups")
+
+# Policy in a store, used wherever path of policy file can be used (pickles to worker processes, prints as 'store#guid')
+class StoreRef(namedtuple("StoreRef", "store guid product")):
+	__slots__ = ()
+
+	def __str__(self):
+		return "{}#{}".format(self.store, self.guid)
+
+# File is policy store (SQLite database) rather than policy XML
+def is_store(path):
+	if not os.path.isfile(path):
+		return False
+	with open(path, "rb") as f:
+		return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+def policy_updated(xml_data):
+	found = UPDATED_PATTERN.search(xml_data)
+	return int(found.group(1)) if found else None
+
+#####################################################################################
+# POLICY STORE
+#####################################################################################
+
+# Snapshot of policy fleet in single SQLite file: raw policy XML (zlib compressed) with GUID, product, name,
+# serial number, 'updated' timestamp, content hash and groups indexed next to it. Policies are read by GUID or
+# product without touching the rest. Keeps the same bookkeeping interface as PolicyManifest, so download script
+# can write either.
+class PolicyStore(object):
+	def __init__(self, path, readonly=False):
+		self.path = path
+		if readonly:
+			self.db = sqlite3.connect("file:{}?mode=ro".format(os.path.abspath(path)), uri=True)
+		else:
+			self.db = sqlite3.connect(path)
+			self.db.executescript(SCHEMA)
+			self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('format', ?)", (str(STORE_FORMAT),))
+			self.db.commit()
+		row = self.db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+		if row is None or int(row[0]) != STORE_FORMAT:
+			raise ValueError("{} is not a policy store of format {}".format(path, STORE_FORMAT))
+		self.uncommitted = 0
+
+	# Policy is current if it is stored with the same serial number
+	def is_current(self, guid, serial_number):
+		row = self.db.execute("SELECT serial_number FROM policies WHERE guid = ?", (guid,)).fetchone()
+		return row is not None and str(row[0]) == str(serial_number)
+
+	# Store raw policy XML, groups of previously stored version are kept. Returns sha256 hex digest of XML.
+	def put(self, guid, xml_data, product=None, name=None, serial_number=None):
+		if isinstance(xml_data, str):
+			xml_data = xml_data.encode("utf-8")
+		digest = hashlib.sha256(xml_data).hexdigest()
+		self.db.execute("""INSERT INTO policies (guid, product, name, serial_number, updated, sha256, size, stored_at, compression, xml)
+			VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'zlib', ?)
+			ON CONFLICT (guid) DO UPDATE SET product = excluded.product, name = excluded.name, serial_number = excluded.serial_number,
+			updated = excluded.updated, sha256 = excluded.sha256, size = excluded.size, stored_at = excluded.stored_at,
+			compression = excluded.compression, xml = excluded.xml""",
+			(guid, product, name, None if serial_number is None else str(serial_number), policy_updated(xml_data), digest,
+			len(xml_data), time.time(), zlib.compress(xml_data, 6)))
+		self.uncommitted += 1
+		if self.uncommitted >= COMMIT_EVERY:
+			self.save()
+		return digest
+
+	# Raw XML of policy, None if it is not stored
+	def get(self, guid):
+		row = self.db.execute("SELECT compression, xml FROM policies WHERE guid = ?", (guid,)).fetchone()
+		if row is None:
+			return None
+		return zlib.decompress(row[1]) if row[0] == "zlib" else bytes(row[1])
+
+	# Metadata of stored policies in GUID order, optionally only given product / GUIDs
+	def entries(self, product=None, guids=None):
+		query = "SELECT guid, product, name, serial_number, updated, sha256, size, groups FROM policies"
+		conditions = []
+		params = []
+		if product is not None:
+			conditions.append("product = ?")
+			params.append(product)
+		if guids is not None:
+			guids = list(guids)
+			conditions.append("guid IN ({})".format(", ".join("?" * len(guids))))
+			params.extend(guids)
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY guid"
+		return [StoreEntry(*(row[:7] + (json.loads(row[7]),))) for row in self.db.execute(query, params)]
+
+	def refs(self, product=None, guids=None):
+		return [StoreRef(self.path, e.guid, e.product) for e in self.entries(product, guids)]
+
+	# Groups policy is used in (name / description / guid), so offline tools do not need to ask API
+	def set_groups(self, guid, groups):
+		self.db.execute("UPDATE policies SET groups = ? WHERE guid = ?", (json.dumps(groups, sort_keys=True), guid))
+
+	# Delete policies which are not listed anymore, returns list of removed GUIDs
+	def remove_stale(self, listed_guids):
+		removed = [row[0] for row in self.db.execute("SELECT guid FROM policies ORDER BY guid") if row[0] not in listed_guids]
+		self.db.executemany("DELETE FROM policies WHERE guid = ?", [(guid,) for guid in removed])
+		return removed
+
+	def save(self):
+		self.db.commit()
+		self.uncommitted = 0
+
+	def close(self):
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+#####################################################################################
+# POLICY SOURCES
+#####################################################################################
+
+# Stores opened by this process, worker processes read many policies from the same store
+_open_stores = {}
+
+def open_store(path):
+	store = _open_stores.get(path)
+	if store is None:
+		store = PolicyStore(path, readonly=True)
+		_open_stores[path] = store
+	return store
+
+# Raw XML of policy source - path of (optionally compressed) policy file or StoreRef
+def read_policy(source):
+	if isinstance(source, StoreRef):
+		xml_data = open_store(source.store).get(source.guid)
+		if xml_data is None:
+			raise KeyError("policy {} is not in store {}".format(source.guid, source.store))
+		return xml_data
+	return read_policy_file(source)
+
+# (GUID, product) of policy source, product is None if it is not known without reading the policy
+def source_identity(source):
+	if isinstance(source, StoreRef):
+		return source.guid, source.product
+	guid, _, product = policy_stem(source).rpartition("_")
+	if not guid:
+		return policy_stem(source), None
+	return guid, product
+
+# Keep only sources of given GUIDs / product
+def select_sources(sources, guids=None, product=None):
+	selected = []
+	for source in sources:
+		guid, source_product = source_identity(source)
+		if guids and guid not in guids:
+			continue
+		if product and source_product != product:
+			continue
+		selected.append(source)
+	return selected
+
+# Expand input into sorted list of policy sources - single file, folder created by download script, glob pattern
+# or policies of policy store (which are read straight from the store)
+def expand_input(path):
+	if os.path.isdir(path):
+		return list_policy_files(path)
+	if is_store(path):
+		with PolicyStore(path, readonly=True) as store:
+			return store.refs()
+	if os.path.isfile(path):
+		return [path]
+	return sorted(p for p in glob.glob(path) if os.path.isfile(p))
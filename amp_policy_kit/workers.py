@@ -0,0 +1,53 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Number of cores available to this process (honours CPU affinity where supported)
+def available_cpus():
+	if hasattr(os, "sched_getaffinity"):
+		return len(os.sched_getaffinity(0))
+	return os.cpu_count() or 1
+
+# Run func over items in pool of worker threads and yield (item, result) pairs in input order.
+# At most 'window' items are submitted ahead of the consumer, so results do not pile up in memory
+# and items can come from a generator which is still being produced.
+def ordered_map(func, items, workers, window=None):
+	if window is None:
+		window = workers * 2
+	pending = deque()
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		try:
+			for item in items:
+				pending.append((item, executor.submit(func, item)))
+				if len(pending) >= window:
+					item, future = pending.popleft()
+					yield item, future.result()
+			while pending:
+				item, future = pending.popleft()
+				yield item, future.result()
+		finally:
+			# Consumer stopped early (error / Ctrl-C), do not start anything which was not picked up yet
+			for item, future in pending:
+				future.cancel()
+
+# Hands out one object per worker thread, e.g. requests.Session which should not be shared between threads
+class PerThread(object):
+	def __init__(self, factory):
+		self.factory = factory
+		self.local = threading.local()
+
+	def get(self):
+		value = getattr(self.local, "value", None)
+		if value is None:
+			value = self.factory()
+			self.local.value = value
+		return value
@@ -0,0 +1,151 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from amp_policy_kit.policygen import policy_settings, policy_document, random_settings
+from amp_policy_kit.policyxml import parse_policy_config
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+from amp_policy_kit.findings import TextEmitter
+from amp_policy_kit.audit import PolicyAudit, parse_header, parse_exclusions, parse_agentsettings
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Audit script is not a module (dash in file name), load it from path
+def load_audit_script():
+	spec = importlib.util.spec_from_file_location("offline_policy_audit", os.path.join(ROOT, "offline-policy-audit.py"))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+# Fleet of policy XML documents of one product with given exclusion count and random settings
+def build_fleet(product, exclusions, size, seed):
+	rnd = random.Random(seed)
+	return [policy_document(policy_settings(product, exclusions, random_settings(product, rnd), seed=rnd.getrandbits(64))) for _ in range(size)]
+
+# Inputs of every audit stage, prepared up front so each stage is timed on its own
+class PreparedPolicy(object):
+	def __init__(self, xml_data, product):
+		self.xml_data = xml_data
+		self.product = product
+		self.json_object = parse_policy_config(xml_data)
+		self.config = self.json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		self.index = PolicyIndex(self.config, PRODUCT_MARKERS)
+		self.audit = PolicyAudit(self.json_object, product)
+
+# Stages of offline audit - (name, function of prepared policy)
+def audit_stages(script, out):
+	return [
+		("parse", lambda p: parse_policy_config(p.xml_data)),
+		("index", lambda p: PolicyIndex(p.config, PRODUCT_MARKERS)),
+		("header", lambda p: parse_header(p.config['ns0:janus'], p.product, out)),
+		("exclusions", lambda p: parse_exclusions(p.config['ns0:exclusions'], p.audit.indexed_items, out)),
+		("agentsettings", lambda p: parse_agentsettings(p.config['ns0:agent'], p.json_object, p.product, out)),
+		("audit", lambda p: script.audit_policy_xml(p.xml_data, out)),
+	]
+
+# Best wall time of running stage over whole fleet
+def time_stage(func, policies, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		for policy in policies:
+			func(policy)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+# Peak memory allocated by stage while processing single policy (results are dropped between policies)
+def peak_memory(func, policies):
+	tracemalloc.start()
+	try:
+		peak = 0
+		for policy in policies:
+			tracemalloc.reset_peak()
+			base = tracemalloc.get_traced_memory()[0]
+			func(policy)
+			peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+	finally:
+		tracemalloc.stop()
+	return peak
+
+def load_baseline(path):
+	if not os.path.exists(path):
+		return None
+	with open(path, "r") as f:
+		return json.load(f)
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Time every stage of offline policy audit on generated policies, compare with stored baseline")
+	ap.add_argument("-p", "--products", dest="products", nargs="+", default=["windows", "mac", "linux"], choices=["windows", "mac", "linux"], help="policy products to generate")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs="+", default=[10, 1000, 10000], help="exclusion counts to benchmark (up to 100000)")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, default=20, help="fleet size per scenario, reduced for very large policies (default: 20)")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=3, help="rounds per measurement")
+	ap.add_argument("-b", "--baseline", dest="baseline", default=DEFAULT_BASELINE, help="baseline file (default: benchmarks/baseline.json)", metavar="FILE")
+	ap.add_argument("--save", dest="save", action="store_true", help="store results as new baseline")
+	ap.add_argument("--threshold", dest="threshold", type=float, default=20.0, help="slow down in percent reported as regression (default: 20)")
+	args = ap.parse_args()
+
+	script = load_audit_script()
+	out = TextEmitter(open(os.devnull, "w"))
+	stages = audit_stages(script, out)
+	baseline = None if args.save else load_baseline(args.baseline)
+	results = {}
+	regressions = 0
+
+	print("{:<22} {:<14} {:>12} {:>12} {:>12} {:>10}".format("scenario", "stage", "policies/s", "ms/policy", "peak KB", "baseline"))
+	for product in args.products:
+		for count in args.exclusions:
+			# Keep scenarios with huge policies to a reasonable duration
+			size = max(2, min(args.policies, args.policies * 1000 // max(count, 1)))
+			policies = [PreparedPolicy(x, product) for x in build_fleet(product, count, size, count)]
+			scenario = "{}/{}".format(product, count)
+			for name, func in stages:
+				elapsed = time_stage(func, policies, args.rounds)
+				peak = peak_memory(func, policies)
+				key = "{}/{}".format(scenario, name)
+				results[key] = {"policies_per_s": size / elapsed, "peak_kb": peak / 1024.0}
+				compare = ""
+				if baseline is not None and key in baseline.get("results", {}):
+					before = baseline["results"][key]["policies_per_s"]
+					change = (results[key]["policies_per_s"] - before) * 100.0 / before
+					compare = "{:+.0f}%".format(change)
+					if change < -args.threshold:
+						compare += " [!]"
+						regressions += 1
+				print("{:<22} {:<14} {:>12.1f} {:>12.3f} {:>12.1f} {:>10}".format(scenario, name, size / elapsed, elapsed * 1000 / size, peak / 1024.0, compare))
+	out.close()
+
+	if args.save:
+		data = {"python": platform.python_version(), "machine": platform.machine(), "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+		with open(args.baseline, "w") as f:
+			json.dump(data, f, indent=1, sort_keys=True)
+		print("[+] Baseline stored in {}".format(args.baseline))
+	elif baseline is None:
+		print("[+] No baseline in {}, run with --save to store one".format(args.baseline))
+	elif regressions:
+		print("[!] WARNING, {} measurements are more than {:.0f}% slower than baseline".format(regressions, args.threshold))
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
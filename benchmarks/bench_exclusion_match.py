@@ -0,0 +1,91 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import policy_settings
+from amp_policy_kit.exclusions import ExclusionMatcher, PREFIX
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+FOLDERS = {
+	"windows": ["C:\\Windows\\System32", "C:\\Users\\bob\\AppData\\Local\\Microsoft\\OneDrive", "C:\\Program Files\\Sophos\\AutoUpdate\\Cache",
+		"C:\\Quarantine", "D:\\data", "C:\\Windows\\Temp", "C:\\ProgramData\\Microsoft\\Windows Defender", "C:\\Program Files\\App"],
+	"mac": ["/Users/bob/Library/Caches", "/System/Library/Spotlight", "/Applications/App.app/Contents", "/private/var/db/Spotlight-V100", "/tmp"],
+	"linux": ["/var/log", "/proc/1", "/var/lib/docker/overlay", "/opt/app/v1/cache", "/home/bob", "/usr/bin"],
+}
+
+# Synthetic corpus of file paths for given product
+def corpus(product, count, seed):
+	rnd = random.Random(seed)
+	sep = "\\" if product == "windows" else "/"
+	folders = FOLDERS[product]
+	return ["{}{}{}f{}.{}".format(rnd.choice(folders), sep, "app_{}".format(rnd.randint(0, 60)) + sep if rnd.random() < 0.3 else "", i, rnd.choice(["exe", "dll", "sas7bdat", "tmp", "txt"])) for i in range(count)]
+
+# Match every path against every exclusion one by one, the way a plain loop would.
+# Returns number of (path, exclusion) matches - corpus analysis needs all exclusions matching a path.
+def naive_scan(matcher, paths):
+	checks = []
+	for e in matcher.exclusions:
+		if e.style == PREFIX:
+			prefix = e.sep.join(e.components())
+			if matcher.product != "windows":
+				prefix = e.sep + prefix
+			checks.append((prefix, None))
+		elif e.regex is not None:
+			checks.append((None, e.regex))
+	matches = 0
+	for path in paths:
+		folded = path.lower() if matcher.ignore_case else path
+		for prefix, regex in checks:
+			if prefix is not None:
+				if folded == prefix or folded.startswith(prefix + matcher.sep):
+					matches += 1
+			elif regex.match(path):
+				matches += 1
+	return matches
+
+def matcher_scan(matcher, paths):
+	matches = 0
+	for path in paths:
+		matches += len(matcher.match(path))
+	return matches
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Compare exclusion by exclusion matching with compiled exclusion matcher")
+	ap.add_argument("-p", "--product", dest="product", default="windows", choices=["windows", "mac", "linux"], help="policy product to generate")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs="+", default=[10, 100, 1000], help="exclusion counts to benchmark")
+	ap.add_argument("-n", "--paths", dest="paths", type=int, default=100000, help="number of paths in synthetic corpus")
+	args = ap.parse_args()
+
+	paths = corpus(args.product, args.paths, 1)
+	print("{:>10} {:>10} {:>12} {:>12} {:>8}".format("exclusions", "matches", "loop s", "matcher s", "speedup"))
+	for count in args.exclusions:
+		settings = policy_settings(args.product, exclusions=count, seed=count)
+		items = settings["exclusions"]["info"]["item"]
+		matcher = ExclusionMatcher(items, args.product)
+		start = time.perf_counter()
+		naive = naive_scan(matcher, paths)
+		naive_time = time.perf_counter() - start
+		start = time.perf_counter()
+		compiled = matcher_scan(matcher, paths)
+		compiled_time = time.perf_counter() - start
+		if naive != compiled:
+			print("[!] WARNING, matchers do not agree for {} exclusions ({} / {})".format(count, naive, compiled))
+			sys.exit(1)
+		print("{:>10} {:>10} {:>12.2f} {:>12.2f} {:>7.1f}x".format(count, compiled, naive_time, compiled_time, naive_time / compiled_time))
+
+if __name__ == "__main__":
+	main()
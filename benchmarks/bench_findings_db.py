@@ -0,0 +1,112 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.findings import Finding, WILDCARD_RULES
+from amp_policy_kit.findingsdb import FindingsDB
+from amp_policy_kit.rules import POLICY_RULES
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+PRODUCTS = ("windows", "mac", "linux")
+
+# Fleet whose weak settings drift a little from run to run: guid -> (product, set of rule ids)
+def initial_fleet(rnd, policies, weak_ratio):
+	fleet = {}
+	for i in range(policies):
+		product = PRODUCTS[i % len(PRODUCTS)]
+		rules = set(r.rule_id for r in POLICY_RULES.rules if r.applies_to(product) and rnd.random() < weak_ratio)
+		fleet["{:08x}-0000-4000-8000-{:012x}".format(rnd.getrandbits(32), i)] = (product, rules)
+	return fleet
+
+def drift(rnd, fleet, rate):
+	for guid, (product, rules) in fleet.items():
+		for rule in POLICY_RULES.rules:
+			if rule.applies_to(product) and rnd.random() < rate:
+				rules.symmetric_difference_update([rule.rule_id])
+
+# Record one run of the whole fleet, returns number of findings
+def record_run(db, rnd, fleet, started, wildcards):
+	run = db.begin_run("bench", "synthetic", started)
+	for guid, (product, rules) in fleet.items():
+		name = "{} policy {}".format(product.capitalize(), guid[:8])
+		run.add_policy(guid, product, name)
+		for rule_id in sorted(rules):
+			run.add(Finding(guid, name, product, rule_id, "medium", "Synthetic finding {}".format(rule_id), "0"))
+		for i in range(wildcards):
+			run.add(Finding(guid, name, product, WILDCARD_RULES["path"], "medium", "Wildcard path exclusion: C:\\Data{}\\*".format(i), "C:\\Data{}\\*".format(i)))
+	run.finish()
+	return run.count
+
+# Run query 'rounds' times, returns best time in milliseconds and result of last call
+def best_ms(func, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		result = func()
+		elapsed = (time.perf_counter() - start) * 1000
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, result
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Fill findings database with daily runs of synthetic fleet and time writes and queries")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, default=2000, help="policies per run (default: 2000)")
+	ap.add_argument("-r", "--runs", dest="runs", type=int, default=120, help="number of daily runs (default: 120)")
+	ap.add_argument("-w", "--weak", dest="weak", type=float, default=0.15, help="share of rules failing per policy (default: 0.15)")
+	ap.add_argument("--wildcards", dest="wildcards", type=int, default=5, help="wildcard exclusion findings per policy (default: 5)")
+	ap.add_argument("--drift", dest="drift", type=float, default=0.01, help="chance of rule flipping between runs (default: 0.01)")
+	ap.add_argument("--rounds", dest="rounds", type=int, default=5, help="repetitions of every query, best is reported (default: 5)")
+	ap.add_argument("-s", "--seed", dest="seed", type=int, default=1, help="random seed (default: 1)")
+	ap.add_argument("-o", "--output", dest="output", default=None, help="keep database in this file (default: temporary file)", metavar="FILE")
+	args = ap.parse_args()
+
+	path = args.output or os.path.join(tempfile.mkdtemp(prefix="amp-findings-"), "findings.db")
+	rnd = random.Random(args.seed)
+	fleet = initial_fleet(rnd, args.policies, args.weak)
+	now = time.time()
+	total = 0
+	with FindingsDB(path) as db:
+		start = time.perf_counter()
+		for day in range(args.runs):
+			if day:
+				drift(rnd, fleet, args.drift)
+			total += record_run(db, rnd, fleet, now - (args.runs - day) * 24 * 3600, args.wildcards)
+		elapsed = time.perf_counter() - start
+	print("[+] Recorded {} runs, {} findings in {:.1f}s ({:.0f} findings/s), database {:.1f} MB".format(args.runs, total, elapsed, total / elapsed, os.path.getsize(path) / 1024.0 / 1024.0))
+
+	with FindingsDB(path, readonly=True) as db:
+		run_id = db.latest_run()
+		queries = [
+			("latest run", lambda: db.latest_run()),
+			("top 10 rules of latest run", lambda: db.top(run_id, "rule_id", 10)),
+			("top 10 windows policies of latest run", lambda: db.top(run_id, "policy_guid", 10, product="windows")),
+			("trend of tetra-deepscan-disabled (windows)", lambda: db.trend("windows", "tetra-deepscan-disabled")),
+			("trend of product windows", lambda: db.trend("windows")),
+			("trend of one policy", lambda: db.trend(policy_guid=next(iter(fleet)))),
+			("tetra-deepscan-disabled for 90 days (windows)", lambda: db.persistent("tetra-deepscan-disabled", run_id, now - 90 * 24 * 3600, "windows")),
+		]
+		print("{:<48} {:>10} {:>8}".format("query", "best ms", "rows"))
+		for name, query in queries:
+			ms, result = best_ms(query, args.rounds)
+			print("{:<48} {:>10.2f} {:>8}".format(name, ms, len(result) if isinstance(result, list) else 1))
+	if not args.output:
+		os.remove(path)
+		os.rmdir(os.path.dirname(path))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,133 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import re
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+from mock_amp_api import MockAmpApi, MockAmpServer, MockSettings, write_config
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Server behaviour of each scenario, on top of latency / page size given on command line
+PROFILES = {
+	"clean": {},
+	"ratelimit": {"rate_limit": 100, "window": 5},
+	"throttle": {"throttle_rate": 0.02, "retry_after": 1},
+	"errors": {"error_rate": 0.02},
+	"outage": {"outage": (2, 0.5)},
+	"noheaders": {"rate_headers": False},
+}
+
+SCRIPTS = {
+	"online": "online-policy-audit.py",
+	"impact": "online-policy-audit.py",
+	"download": "download-policy-xml.py",
+}
+
+# Summary line printed by rate limiter at the end of every run
+LIMITER_SUMMARY = re.compile(r"API requests: (\d+), retries: (\d+), time throttled by rate limit: ([\d.]+)s, time in retry backoff: ([\d.]+)s")
+
+# Command line of script talking to mock server
+def script_command(script, config, workdir, workers, download_options):
+	command = [sys.executable, os.path.join(ROOT, SCRIPTS[script]), "-c", config]
+	if script in ("online", "impact"):
+		command += ["--workers", str(workers)]
+		if script == "impact":
+			command += ["--impact"]
+	else:
+		output = os.path.join(workdir, "policies")
+		os.makedirs(output, exist_ok=True)
+		command += ["-o", output, "--full"] + shlex.split(download_options)
+	return command
+
+# Run one script against mock server, returns dictionary of measurements
+def run_scenario(api, server, profile, script, workdir, workers, download_options=""):
+	for name, value in PROFILES[profile].items():
+		setattr(api.settings, name, value)
+	api.reset()
+	config = os.path.join(workdir, "config.txt")
+	write_config(config, server.url)
+	env = dict(os.environ, NO_PROXY="127.0.0.1,localhost", PYTHONPATH=ROOT)
+	start = time.perf_counter()
+	process = subprocess.run(script_command(script, config, workdir, workers, download_options), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=ROOT, env=env)
+	wall = time.perf_counter() - start
+	output = process.stdout.decode("utf-8", "replace")
+	result = {"profile": profile, "script": script, "exit_code": process.returncode, "wall_s": wall, "server_requests": api.requests,
+		"status": dict((str(k), v) for k, v in sorted(api.status_counts.items())), "retries": None, "throttled_s": None, "backoff_s": None}
+	found = LIMITER_SUMMARY.search(output)
+	if found:
+		result["retries"] = int(found.group(2))
+		result["throttled_s"] = float(found.group(3))
+		result["backoff_s"] = float(found.group(4))
+	else:
+		result["output_tail"] = output[-2000:]
+	return result
+
+def format_seconds(value):
+	return "-" if value is None else "{:.1f}".format(value)
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Run online tools against local mock AMP API and record wall time, requests and time spent waiting")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, default=500, help="number of policies served (default: 500)")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs=2, default=[10, 100], help="range of path exclusion counts per policy (default: 10 100)", metavar=("MIN", "MAX"))
+	ap.add_argument("-p", "--profiles", dest="profiles", nargs="+", default=sorted(PROFILES), choices=sorted(PROFILES), help="server behaviour scenarios (default: all)")
+	ap.add_argument("-s", "--scripts", dest="scripts", nargs="+", default=sorted(SCRIPTS), choices=sorted(SCRIPTS), help="tools to run (default: all)")
+	ap.add_argument("-w", "--workers", dest="workers", type=int, default=8, help="workers of online audit (default: 8)")
+	ap.add_argument("--latency", dest="latency", type=float, default=20.0, help="milliseconds added to every response (default: 20)")
+	ap.add_argument("--page-size", dest="page_size", type=int, default=500, help="maximum items per listing page (default: 500)")
+	ap.add_argument("--computers", dest="computers", type=int, default=None, help="computers listed by impact scenario (default: ten per policy)")
+	ap.add_argument("-d", "--download-options", dest="download_options", default="", help="extra options of download script, e.g. '--pretty' or '--compress gzip'", metavar="OPTIONS")
+	ap.add_argument("-r", "--results", dest="results", default=None, help="append results to this file as JSON lines", metavar="FILE")
+	args = ap.parse_args()
+
+	print("[+] Generating {} policies".format(args.policies))
+	settings = MockSettings(page_size=args.page_size, latency=args.latency / 1000.0, jitter=args.latency / 2000.0)
+	api = MockAmpApi(args.policies, tuple(args.exclusions), settings=settings, computers=args.computers)
+	workdir = tempfile.mkdtemp(prefix="amp-mock-")
+	results = []
+	print("{:<10} {:<9} {:>8} {:>9} {:>6} {:>6} {:>8} {:>11} {:>10}".format("profile", "script", "wall s", "requests", "429", "503", "retries", "throttled s", "backoff s"))
+	try:
+		for profile in args.profiles:
+			for script in args.scripts:
+				# Every scenario starts from default behaviour, profiles only switch their own knobs on
+				api.settings = MockSettings(page_size=args.page_size, latency=settings.latency, jitter=settings.jitter)
+				with MockAmpServer(api) as server:
+					result = run_scenario(api, server, profile, script, workdir, args.workers, args.download_options)
+				results.append(result)
+				print("{:<10} {:<9} {:>8.1f} {:>9} {:>6} {:>6} {:>8} {:>11} {:>10}".format(profile, script, result["wall_s"], result["server_requests"],
+					result["status"].get("429", 0), result["status"].get("503", 0), "-" if result["retries"] is None else result["retries"],
+					format_seconds(result["throttled_s"]), format_seconds(result["backoff_s"])))
+				if result["exit_code"] != 0 or result["retries"] is None:
+					print("\t[!] WARNING, {} did not finish cleanly (exit code {}):".format(SCRIPTS[script], result["exit_code"]))
+					print(result.get("output_tail", ""))
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	if args.results:
+		with open(args.results, "a") as f:
+			for result in results:
+				result["policies"] = args.policies
+				result["download_options"] = args.download_options
+				f.write(json.dumps(result, sort_keys=True) + "\n")
+		print("[+] Results appended to {}".format(args.results))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,83 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import build_policy
+from amp_policy_kit.policyxml import parse_policy_xml
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Presence / shape checks the way parsers used to do them - stringify subtree for every check
+def legacy_checks(config):
+	exclusions = config['ns0:exclusions']
+	agent = config['ns0:agent']
+	found = []
+	# Product detection (worst case - windows and linux policies run all three)
+	found.append("Spotlight" in str(exclusions) or "Library" in str(exclusions))
+	found.append("CSIDL_WINDOWS" in str(exclusions))
+	# parse_exclusions
+	found.append("certissuer" in str(exclusions))
+	found.append("process" in str(exclusions))
+	found.append("', '" in str(exclusions['ns0:process']['ns0:item']))
+	# parse_agentsettings
+	for key in ("ns0:cloud", "ns0:apde", "ns0:driver", "ns0:heuristic", "ns0:exprev", "ns0:amsi", "ns0:nfm", "ns0:cmdlinecapture"):
+		found.append(key in str(agent))
+	return found
+
+# Same questions answered by one-time index
+def index_checks(config):
+	index = PolicyIndex(config, PRODUCT_MARKERS)
+	found = []
+	found.append(index.mentions("exclusions", "Spotlight") or index.mentions("exclusions", "Library"))
+	found.append(index.mentions("exclusions", "CSIDL_WINDOWS"))
+	found.append(index.has("exclusions/certissuer"))
+	found.append(index.has("exclusions/process"))
+	found.append(index.is_list("exclusions/process/item"))
+	for key in ("cloud", "apde", "driver", "heuristic", "exprev", "amsi", "nfm", "cmdlinecapture"):
+		found.append(index.has("agent/" + key))
+	return found
+
+# Run function 'rounds' times and return best time per call in seconds
+def best_time(func, config, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		func(config)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Compare str() based presence checks with one-time policy index")
+	ap.add_argument("-p", "--product", dest="product", default="windows", choices=["windows", "mac", "linux"], help="policy product to generate")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="exclusion counts to benchmark")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=5, help="rounds per measurement")
+	args = ap.parse_args()
+
+	print("{:>10} {:>12} {:>12} {:>8}".format("exclusions", "str() ms", "index ms", "speedup"))
+	for count in args.exclusions:
+		json_object = parse_policy_xml(build_policy(args.product, exclusions=count, seed=count))
+		config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		if legacy_checks(config) != index_checks(config):
+			print("[!] WARNING, checks do not agree for {} exclusions".format(count))
+			sys.exit(1)
+		legacy = best_time(legacy_checks, config, args.rounds)
+		indexed = best_time(index_checks, config, args.rounds)
+		print("{:>10} {:>12.2f} {:>12.2f} {:>7.1f}x".format(count, legacy * 1000, indexed * 1000, legacy / indexed))
+
+if __name__ == "__main__":
+	main()
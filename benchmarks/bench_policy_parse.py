@@ -0,0 +1,73 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import json
+import time
+import argparse
+from xml.etree.ElementTree import fromstring, ElementTree, tostring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import build_policy
+from amp_policy_kit.policyxml import parse_policy_xml
+
+try:
+	import xmltodict
+	from bs4 import BeautifulSoup
+except ImportError:
+	xmltodict = None
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Old conversion pipeline which was used by both audit scripts
+def legacy_parse(xml_data):
+	root = ElementTree(fromstring(xml_data)).getroot()
+	b4_xml_obj = BeautifulSoup(tostring(root), "xml")
+	pdic = xmltodict.parse(b4_xml_obj.prettify(), dict_constructor=dict)
+	return json.loads(json.dumps(pdic))
+
+# Run function 'rounds' times and return best time per call in seconds
+def best_time(func, xml_data, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		func(xml_data)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Compare legacy XML conversion pipeline with single-pass parser")
+	ap.add_argument("-p", "--product", dest="product", default="windows", choices=["windows", "mac", "linux"], help="policy product to generate")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs="+", default=[10, 1000, 10000], help="exclusion counts to benchmark")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=5, help="rounds per measurement")
+	args = ap.parse_args()
+
+	if xmltodict is None:
+		print("[!] 'xmltodict' and 'beautifulsoup4' are needed to run legacy pipeline for comparison")
+
+	print("{:>10} {:>10} {:>12} {:>12} {:>8}".format("exclusions", "size KB", "legacy ms", "single ms", "speedup"))
+	for count in args.exclusions:
+		xml_data = build_policy(args.product, exclusions=count, seed=count)
+		single = best_time(parse_policy_xml, xml_data, args.rounds)
+		if xmltodict is not None:
+			# Both pipelines have to produce identical structure, otherwise the comparison is meaningless
+			if legacy_parse(xml_data) != parse_policy_xml(xml_data):
+				print("[!] WARNING, parsed structures differ for {} exclusions".format(count))
+				sys.exit(1)
+			legacy = best_time(legacy_parse, xml_data, args.rounds)
+			print("{:>10} {:>10.1f} {:>12.2f} {:>12.2f} {:>7.1f}x".format(count, len(xml_data) / 1024.0, legacy * 1000, single * 1000, legacy / single))
+		else:
+			print("{:>10} {:>10.1f} {:>12} {:>12.2f} {:>8}".format(count, len(xml_data) / 1024.0, "-", single * 1000, "-"))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,73 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import build_policy
+from amp_policy_kit.policyxml import parse_policy_xml, parse_policy_config, parse_policy_outline, stream_config_items, iter_config_items, AUDITED_SECTIONS
+from amp_policy_kit.audit import EXCLUSION_ITEMS
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Audited sections of whole document dictionary, to check both parsers agree
+def audited_part(json_object):
+	config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+	return dict((k, v) for k, v in config.items() if k.split(":", 1)[-1] in AUDITED_SECTIONS)
+
+def count_items(xml_data):
+	return sum(1 for _ in iter_config_items(xml_data, "exclusions/info/item"))
+
+# Audited sections without exclusion items, then exclusion items streamed in second pass (audit of big policies)
+def outline_items(xml_data):
+	json_object, counts, marked = parse_policy_outline(xml_data, AUDITED_SECTIONS, EXCLUSION_ITEMS)
+	return sum(1 for _ in stream_config_items(xml_data, [(path, counts.get(path, 0)) for path in EXCLUSION_ITEMS]))
+
+# Best time per call in seconds and peak memory allocated by single call in bytes
+def measure(func, xml_data, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		func(xml_data)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	tracemalloc.start()
+	try:
+		func(xml_data)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return best, peak
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Compare whole document parser with streaming parser of audited sections")
+	ap.add_argument("-p", "--product", dest="product", default="windows", choices=["windows", "mac", "linux"], help="policy product to generate")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs="+", default=[1000, 10000, 100000], help="exclusion counts to benchmark")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=3, help="rounds per measurement")
+	args = ap.parse_args()
+
+	parsers = [("document", parse_policy_xml), ("sections", parse_policy_config), ("item stream", count_items), ("outline", outline_items)]
+	print("{:>10} {:>9}  {:<12} {:>10} {:>10}".format("exclusions", "size KB", "parser", "ms", "peak MB"))
+	for count in args.exclusions:
+		xml_data = build_policy(args.product, exclusions=count, seed=count)
+		if audited_part(parse_policy_xml(xml_data)) != parse_policy_config(xml_data)['ns0:Signature']['ns0:Object']['ns0:config']:
+			print("[!] WARNING, parsed sections differ for {} exclusions".format(count))
+			sys.exit(1)
+		for name, func in parsers:
+			elapsed, peak = measure(func, xml_data, args.rounds)
+			print("{:>10} {:>9.1f}  {:<12} {:>10.2f} {:>10.2f}".format(count, len(xml_data) / 1024.0, name, elapsed * 1000, peak / 1024.0 / 1024.0))
+
+if __name__ == "__main__":
+	main()
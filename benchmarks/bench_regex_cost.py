@@ -0,0 +1,63 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import re
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.regexcost import static_flags, analyze_patterns
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+SEQUENCE = "several .* in sequence (polynomial backtracking)"
+NESTED = "nested quantifier (catastrophic backtracking)"
+LEADING = "leading .* (scans and backtracks over whole path)"
+TRAILING = "trailing .* (redundant, exclusions match path prefix)"
+
+# Exclusion patterns seen in real policies with structural flags they have to get
+CASES = [
+	("windows", r"^[A-Za-z]:\\.*\.sas.*", [TRAILING]),
+	("windows", r"C:\\Users\\.*\\AppData\\Local\\Temp\\.*\.tmp", []),
+	# Literals between the two .* - not in sequence
+	("windows", r"C:\\.*\.sas.*x", []),
+	("windows", r".*\.sas.*x", [LEADING]),
+	("windows", r"C:\\.*.*\\x", [SEQUENCE]),
+	("windows", r"C:\\.*\.sas.*.*x", [SEQUENCE]),
+	("linux", r"/opt/(a+)+/cache", [NESTED]),
+	("mac", r"/Users/[^/]+/Library/Caches/", []),
+]
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Check structural flags of known exclusion patterns and time cost analysis of them")
+	ap.add_argument("-w", "--workload", dest="workload", type=int, default=2000, help="synthetic paths patterns are timed against (default: 2000)")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=3, help="rounds per measurement")
+	args = ap.parse_args()
+
+	wrong = 0
+	for product, pattern, expected in CASES:
+		flags = static_flags(pattern)
+		if flags != sorted(expected):
+			print("[!] WARNING, {} flagged {}, expected {}".format(pattern, flags, sorted(expected)))
+			wrong += 1
+	print("[+] Static flags: {} of {} patterns as expected".format(len(CASES) - wrong, len(CASES)))
+
+	start = time.perf_counter()
+	costs = analyze_patterns([(pattern, re.compile(pattern), product) for product, pattern, expected in CASES], args.workload, args.rounds)
+	print("[+] Cost analysis of {} patterns: {:.1f} ms".format(len(costs), (time.perf_counter() - start) * 1000))
+	for cost in costs:
+		print("\t{:>10.0f} ns/path  {:<8} {}".format(cost.ns_per_path or 0, cost.product, cost.pattern))
+	if wrong:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
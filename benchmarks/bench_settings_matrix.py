@@ -0,0 +1,97 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import fleet_specs, policy_settings, policy_document
+from amp_policy_kit.policyxml import parse_policy_config
+from amp_policy_kit.rules import POLICY_RULES, compile_path, MISSING
+from amp_policy_kit.matrix import SettingsMatrix
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+PRODUCTS = ("windows", "mac", "linux")
+
+# Parsed configs of 'distinct' generated policies, repeated up to 'size' policies (parsing is not what is measured here)
+def build_fleet(size, distinct, weak_ratio, seed):
+	policies = []
+	for product, exclusions, settings, policy_seed in fleet_specs(distinct, (10, 10), weak_ratio, seed=seed):
+		policies.append((product, parse_policy_config(policy_document(policy_settings(product, exclusions, settings, seed=policy_seed)))))
+	return [policies[i % len(policies)] for i in range(size)]
+
+# Rule failures and share of one setting value by walking policy dictionaries one at a time
+def per_policy_stats(fleet, path, value, product):
+	failing = {}
+	for policy_product, json_object in fleet:
+		config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		for rule, observed in POLICY_RULES.evaluate(config, policy_product):
+			failing[(rule.rule_id, policy_product)] = failing.get((rule.rule_id, policy_product), 0) + 1
+	keys = compile_path(path)
+	matching = 0
+	total = 0
+	for policy_product, json_object in fleet:
+		if policy_product != product:
+			continue
+		total += 1
+		node = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		for key in keys:
+			node = node.get(key, MISSING) if isinstance(node, dict) else MISSING
+		if node is not MISSING and str(node) == value:
+			matching += 1
+	return failing, (matching, total)
+
+# The same from settings matrix
+def matrix_stats(matrix, path, value, product):
+	failing = {}
+	for rule, rule_product, count, evaluated in matrix.rule_stats(PRODUCTS):
+		if count:
+			failing[(rule.rule_id, rule_product)] = count
+	share = [(count, total) for v, count, total in matrix.value_stats(path, product) if v == value]
+	return failing, share[0] if share else (0, matrix.product_mask((product,)).count(1))
+
+def timed(func, *args):
+	start = time.perf_counter()
+	result = func(*args)
+	return (time.perf_counter() - start) * 1000, result
+
+def fill(fleet):
+	matrix = SettingsMatrix()
+	for product, json_object in fleet:
+		matrix.add_policy(json_object, product)
+	return matrix
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Compare fleet statistics from per-policy rule evaluation with columnar settings matrix")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, nargs="+", default=[1000, 10000, 50000], help="fleet sizes to benchmark")
+	ap.add_argument("-d", "--distinct", dest="distinct", type=int, default=500, help="distinct generated policies fleet is made of (default: 500)")
+	ap.add_argument("-w", "--weak", dest="weak", type=float, default=0.2, help="share of rules failing per policy (default: 0.2)")
+	ap.add_argument("-s", "--setting", dest="setting", default="agent/apde/mode", help="setting of share question (default: agent/apde/mode)")
+	ap.add_argument("-v", "--value", dest="value", default="0", help="value of share question (default: 0)")
+	args = ap.parse_args()
+
+	print("[+] Question: rule failures by product and share of windows policies with {} = {}".format(args.setting, args.value))
+	print("{:>8} {:>14} {:>12} {:>12} {:>9}".format("policies", "per-policy ms", "build ms", "matrix ms", "speedup"))
+	for size in args.policies:
+		fleet = build_fleet(size, args.distinct, args.weak, size)
+		per_policy_ms, expected = timed(per_policy_stats, fleet, args.setting, args.value, "windows")
+		build_ms, matrix = timed(fill, fleet)
+		matrix_ms, result = timed(matrix_stats, matrix, args.setting, args.value, "windows")
+		if result != expected:
+			print("\t[!] WARNING, settings matrix and per-policy evaluation disagree for {} policies".format(size))
+			sys.exit(1)
+		print("{:>8} {:>14.1f} {:>12.1f} {:>12.1f} {:>8.0f}x".format(size, per_policy_ms, build_ms, matrix_ms, per_policy_ms / matrix_ms))
+		print("\t[+] {} of {} windows policies have {} = {}".format(result[1][0], result[1][1], args.setting, args.value))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,94 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+from amp_policy_kit.policygen import build_policy
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Modules offline audit must not load - network and XML pretty printing stack
+HEAVY_MODULES = ("requests", "urllib3", "bs4", "xmltodict", "dateutil", "concurrent.futures.process")
+
+# Wall time of command in milliseconds, best and median of 'rounds' runs
+def time_command(command, rounds):
+	times = []
+	for _ in range(rounds):
+		start = time.perf_counter()
+		subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT, check=True)
+		times.append((time.perf_counter() - start) * 1000)
+	times.sort()
+	return times[0], times[len(times) // 2]
+
+# Top level modules imported by command, from '-X importtime' output
+def imported_modules(command):
+	process = subprocess.run([command[0], "-X", "importtime"] + command[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=ROOT, check=True)
+	modules = set()
+	for line in process.stderr.decode("utf-8", "replace").splitlines():
+		if line.startswith("import time:") and line.count("|") == 2:
+			modules.add(line.rsplit("|", 1)[1].strip())
+	return modules
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Measure startup time of offline audit through unified CLI and check it against budget")
+	ap.add_argument("-r", "--rounds", dest="rounds", type=int, default=20, help="runs per command, median is compared with budget (default: 20)")
+	ap.add_argument("-b", "--budget", dest="budget", type=float, default=100.0, help="allowed milliseconds of single policy offline audit on top of bare interpreter start (default: 100)")
+	args = ap.parse_args()
+
+	workdir = tempfile.mkdtemp(prefix="amp-startup-")
+	failed = False
+	try:
+		policy = os.path.join(workdir, "policy.xml")
+		with open(policy, "wb") as f:
+			f.write(build_policy("windows", exclusions=10, seed=1))
+		cli = os.path.join(ROOT, "amp-policy-kit.py")
+		commands = [
+			("bare interpreter", [sys.executable, "-c", "pass"]),
+			("amp-policy-kit.py -h", [sys.executable, cli, "-h"]),
+			("audit-offline (1 policy)", [sys.executable, cli, "audit-offline", "-i", policy]),
+			("offline-policy-audit.py", [sys.executable, os.path.join(ROOT, "offline-policy-audit.py"), "-i", policy]),
+			("audit-online -h", [sys.executable, cli, "audit-online", "-h"]),
+			("download -h", [sys.executable, cli, "download", "-h"]),
+		]
+		print("{:<28} {:>9} {:>11} {:>13}".format("command", "best ms", "median ms", "overhead ms"))
+		medians = {}
+		for name, command in commands:
+			best, median = time_command(command, args.rounds)
+			medians[name] = median
+			print("{:<28} {:>9.1f} {:>11.1f} {:>13.1f}".format(name, best, median, median - medians["bare interpreter"]))
+
+		overhead = medians["audit-offline (1 policy)"] - medians["bare interpreter"]
+		if overhead > args.budget:
+			print("\t[!] WARNING, offline audit takes {:.1f} ms on top of interpreter start, budget is {:.1f} ms".format(overhead, args.budget))
+			failed = True
+		else:
+			print("[+] Offline audit startup within budget: {:.1f} of {:.1f} ms".format(overhead, args.budget))
+		loaded = sorted(m for m in imported_modules(commands[2][1]) if m in HEAVY_MODULES)
+		if loaded:
+			print("\t[!] WARNING, offline audit imports: {}".format(", ".join(loaded)))
+			failed = True
+		else:
+			print("[+] Offline audit does not import: {}".format(", ".join(HEAVY_MODULES)))
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,32 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import generate_fleet
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Generate fleet of synthetic AMP policy XML files, laid out like output of download-policy-xml.py")
+	ap.add_argument("-o", "--output", dest="output", required=True, help="path to output folder", metavar="FOLDER")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, default=100, help="number of policies (default: 100)")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs=2, default=[10, 1000], help="range of path exclusion counts per policy (default: 10 1000)", metavar=("MIN", "MAX"))
+	ap.add_argument("-p", "--products", dest="products", nargs="+", default=None, choices=["windows", "mac", "linux"], help="products to generate (default: mix of all)")
+	ap.add_argument("-w", "--weak", dest="weak", type=float, default=0.2, help="probability of each audit rule being triggered by generated settings (default: 0.2)")
+	ap.add_argument("-s", "--seed", dest="seed", type=int, default=1, help="random seed, the same seed gives the same fleet")
+	args = ap.parse_args()
+
+	start = time.perf_counter()
+	written = generate_fleet(args.output, args.policies, tuple(args.exclusions), args.weak, args.products, args.seed)
+	print("[+] Generated {} policies in {} ({:.1f}s)".format(len(written), args.output, time.perf_counter() - start))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,343 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import os
+import json
+import time
+import math
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from amp_policy_kit.policygen import fleet_specs, policy_settings, policy_document
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Page size of listings when client does not ask for one
+DEFAULT_PAGE_SIZE = 500
+
+# Behaviour of mock server - rate limit window, latency and injected errors
+class MockSettings(object):
+	def __init__(self, page_size=DEFAULT_PAGE_SIZE, rate_limit=None, window=3600, latency=0.0, jitter=0.0,
+			throttle_rate=0.0, error_rate=0.0, retry_after=1, outage=None, groups_with_policies=False, rate_headers=True, seed=1):
+		# Requests allowed per 'window' seconds, None means no limit (headers are still sent)
+		self.page_size = page_size
+		self.rate_limit = rate_limit
+		self.window = window
+		# Seconds added to every response, plus random 0..jitter
+		self.latency = latency
+		self.jitter = jitter
+		# Share of requests answered with 429 (with 'Retry-After: retry_after') or 503
+		self.throttle_rate = throttle_rate
+		self.error_rate = error_rate
+		self.retry_after = retry_after
+		# (every, length) in seconds - every 'every' seconds all requests fail with 503 for 'length' seconds
+		self.outage = outage
+		# Group listing carries policies of each group (otherwise client asks /v1/groups/{guid})
+		self.groups_with_policies = groups_with_policies
+		# Send X-RateLimit-* headers (some consoles and proxies do not)
+		self.rate_headers = rate_headers
+		self.seed = seed
+
+# Read integer query parameter, falls back to default if it is missing or malformed
+def query_int(query, name, default):
+	try:
+		return int(query[name][0])
+	except (KeyError, IndexError, ValueError):
+		return default
+
+# Computers of generated fleet, made up on request so 100k+ computers cost no memory. Groups get very different
+# numbers of computers (a few large groups, many small ones), computer runs one of the policies of its group.
+class MockComputers(object):
+	def __init__(self, count, groups, base_url):
+		self.count = count
+		self.groups = groups
+		self.base_url = base_url
+
+	def __len__(self):
+		return self.count
+
+	def group_of(self, i):
+		# Same group for the same computer on every request, skewed towards first groups
+		share = ((i * 2654435761) % 4294967296) / 4294967296.0
+		return self.groups[int(len(self.groups) * share ** 3)]
+
+	def computer(self, i):
+		group = self.group_of(i)
+		guid = "{:08x}-0000-4000-8000-{:012x}".format(i, i)
+		computer = {"connector_guid": guid, "hostname": "host-{:06d}.example.com".format(i), "active": True, "group_guid": group["guid"],
+			"links": {"computer": "{}/v1/computers/{}".format(self.base_url, guid), "group": "{}/v1/groups/{}".format(self.base_url, group["guid"])}}
+		if group["policies"]:
+			policy = group["policies"][i % len(group["policies"])]
+			computer["operating_system"] = {"windows": "Windows 10", "mac": "macOS 13", "linux": "CentOS 8"}.get(policy["product"], "")
+			computer["policy"] = {"guid": policy["guid"], "name": policy["name"]}
+		return computer
+
+	def __getitem__(self, items):
+		return [self.computer(i) for i in range(*items.indices(self.count))]
+
+#####################################################################################
+# MOCK API
+#####################################################################################
+
+# Generated fleet of policies and groups served the way AMP API serves them. Policy XML is built
+# on request from fleet specification, so large fleets do not have to be kept in memory.
+class MockAmpApi(object):
+	def __init__(self, count=100, exclusions=(10, 100), weak_ratio=0.2, products=None, groups=None, seed=1, settings=None, computers=None):
+		self.settings = settings or MockSettings(seed=seed)
+		self.specs = {}
+		self.policies = []
+		for spec in fleet_specs(count, exclusions, weak_ratio, products, seed):
+			product, exclusion_count, policy_config, policy_seed = spec
+			header = policy_settings(product, 2, policy_config, seed=policy_seed)["janus"]["policy"]
+			self.specs[header["uuid"]] = spec
+			self.policies.append({"name": header["name"], "description": "", "guid": header["uuid"], "product": product,
+				"default": False, "serial_number": int(header["serial_number"])})
+		# Every group uses one policy of each product, the way console does
+		group_count = groups if groups is not None else max(1, count // 3)
+		self.groups = [{"name": "Group {}".format(i), "description": "Generated group {}".format(i), "guid": "group-{:06d}".format(i), "policies": []} for i in range(group_count)]
+		self.policy_groups = {}
+		for i, policy in enumerate(self.policies):
+			group = self.groups[i % group_count]
+			group["policies"].append({"name": policy["name"], "guid": policy["guid"], "product": policy["product"]})
+			self.policy_groups.setdefault(policy["guid"], []).append(group)
+		self.by_guid = dict((p["guid"], p) for p in self.policies)
+		self.groups_by_guid = dict((g["guid"], g) for g in self.groups)
+		# Ten connectors per policy unless told otherwise
+		self.computer_count = computers if computers is not None else count * 10
+		self.lock = threading.Lock()
+		self.rnd = random.Random(self.settings.seed)
+		self.reset()
+
+	# Clear counters and start new rate limit window
+	def reset(self):
+		with self.lock:
+			self.started = time.monotonic()
+			self.window_start = self.started
+			self.window_count = 0
+			self.requests = 0
+			self.status_counts = {}
+			self.endpoint_counts = {}
+
+	# Policy XML as served by /v1/policies/{guid}.xml
+	def policy_xml(self, guid):
+		product, exclusion_count, policy_config, policy_seed = self.specs[guid]
+		return policy_document(policy_settings(product, exclusion_count, policy_config, seed=policy_seed))
+
+	# Decide fate of request before it reaches endpoint - returns (status, extra headers) of rejection or None,
+	# and rate limit headers sent with every response
+	def admit(self):
+		s = self.settings
+		with self.lock:
+			now = time.monotonic()
+			self.requests += 1
+			if now - self.window_start >= s.window:
+				self.window_start += s.window * math.floor((now - self.window_start) / s.window)
+				self.window_count = 0
+			self.window_count += 1
+			limit = s.rate_limit if s.rate_limit is not None else 1000000
+			remaining = max(limit - self.window_count, 0)
+			reset = max(int(math.ceil(self.window_start + s.window - now)), 1)
+			headers = {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(reset)}
+			if not s.rate_headers:
+				headers = {}
+			elapsed = now - self.started
+			if s.rate_limit is not None and self.window_count > s.rate_limit:
+				headers["Retry-After"] = str(reset)
+				return (429, headers), headers
+			if s.outage is not None and elapsed >= s.outage[0] and elapsed % s.outage[0] < s.outage[1]:
+				return (503, {}), headers
+			roll = self.rnd.random()
+			if roll < s.throttle_rate:
+				headers = dict(headers, **{"Retry-After": str(s.retry_after)})
+				return (429, headers), headers
+			if roll < s.throttle_rate + s.error_rate:
+				return (503, {}), headers
+			return None, headers
+
+	def count(self, endpoint, status):
+		with self.lock:
+			self.endpoint_counts[endpoint] = self.endpoint_counts.get(endpoint, 0) + 1
+			self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+	# Page of listing with AMP style metadata, 'next' link only if there is more
+	def page(self, base_url, path, items, query):
+		limit = max(1, min(query_int(query, "limit", self.settings.page_size), self.settings.page_size))
+		offset = max(0, query_int(query, "offset", 0))
+		data = items[offset:offset + limit]
+		links = {"self": "{}{}?offset={}&limit={}".format(base_url, path, offset, limit)}
+		if offset + limit < len(items):
+			links["next"] = "{}{}?offset={}&limit={}".format(base_url, path, offset + limit, limit)
+		return {"version": "v1.2.0", "metadata": {"links": links, "results": {"total": len(items), "current_item_count": len(data), "index": offset, "items_per_page": limit}}, "data": data}
+
+	def policy_summary(self, base_url, policy):
+		return dict(policy, links={"policy": "{}/v1/policies/{}".format(base_url, policy["guid"])})
+
+	def group_summary(self, base_url, group, with_policies):
+		summary = {"name": group["name"], "description": group["description"], "guid": group["guid"], "links": {"group": "{}/v1/groups/{}".format(base_url, group["guid"])}}
+		if with_policies:
+			summary["policies"] = group["policies"]
+		return summary
+
+	# Answer one GET request. Returns (endpoint name, status, body) - body is XML bytes or JSON document.
+	def handle(self, base_url, url):
+		parts = urlsplit(url)
+		path = parts.path.rstrip("/")
+		query = parse_qs(parts.query)
+		if path == "/v1/policies":
+			items = [self.policy_summary(base_url, p) for p in self.policies]
+			return "policies", 200, self.page(base_url, path, items, query)
+		if path.startswith("/v1/policies/"):
+			guid = path[len("/v1/policies/"):]
+			if guid.endswith(".xml"):
+				if guid[:-4] not in self.specs:
+					return "policy xml", 404, {"errors": ["policy not found"]}
+				return "policy xml", 200, self.policy_xml(guid[:-4])
+			if guid not in self.by_guid:
+				return "policy", 404, {"errors": ["policy not found"]}
+			groups = [self.group_summary(base_url, g, False) for g in self.policy_groups.get(guid, [])]
+			return "policy", 200, {"version": "v1.2.0", "data": dict(self.policy_summary(base_url, self.by_guid[guid]), used_in_groups=groups)}
+		if path == "/v1/groups":
+			items = [self.group_summary(base_url, g, self.settings.groups_with_policies) for g in self.groups]
+			return "groups", 200, self.page(base_url, path, items, query)
+		if path.startswith("/v1/groups/"):
+			guid = path[len("/v1/groups/"):]
+			if guid not in self.groups_by_guid:
+				return "group", 404, {"errors": ["group not found"]}
+			return "group", 200, {"version": "v1.2.0", "data": self.group_summary(base_url, self.groups_by_guid[guid], True)}
+		if path == "/v1/computers":
+			return "computers", 200, self.page(base_url, path, MockComputers(self.computer_count, self.groups, base_url), query)
+		return "unknown", 404, {"errors": ["unknown endpoint"]}
+
+	# One line summary of what server did
+	def summary(self):
+		with self.lock:
+			statuses = ", ".join("{}: {}".format(k, v) for k, v in sorted(self.status_counts.items()))
+			endpoints = ", ".join("{}: {}".format(k, v) for k, v in sorted(self.endpoint_counts.items()))
+		return "Mock API requests: {} (status {}) (endpoints {})".format(self.requests, statuses, endpoints)
+
+#####################################################################################
+# HTTP SERVER
+#####################################################################################
+
+class MockAmpHandler(BaseHTTPRequestHandler):
+	# Keep-alive, so requests sessions behave as they do against real console
+	protocol_version = "HTTP/1.1"
+	# Headers and body are written separately, Nagle would hold the body back until client acknowledges headers
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		api = self.server.api
+		settings = api.settings
+		if settings.latency or settings.jitter:
+			time.sleep(settings.latency + random.uniform(0, settings.jitter))
+		rejection, headers = api.admit()
+		if not self.headers.get("Authorization"):
+			endpoint, status, body = "unauthorized", 401, {"errors": ["missing credentials"]}
+		elif rejection is not None:
+			status, headers = rejection[0], dict(headers, **rejection[1])
+			endpoint, body = "rejected", {"errors": ["too many requests" if status == 429 else "service unavailable"]}
+		else:
+			endpoint, status, body = api.handle("http://{}".format(self.headers.get("Host")), self.path)
+		api.count(endpoint, status)
+		if isinstance(body, bytes):
+			content_type = "application/xml"
+		else:
+			content_type = "application/json"
+			body = json.dumps(body).encode("utf-8")
+		self.send_response(status)
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	# Access log would slow down the server and flood the console
+	def log_message(self, format, *args):
+		pass
+
+# Mock API served by background thread, usable as context manager
+class MockAmpServer(object):
+	def __init__(self, api, host="127.0.0.1", port=0):
+		self.api = api
+		self.httpd = ThreadingHTTPServer((host, port), MockAmpHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.api = api
+		self.thread = None
+
+	# Base URL to be used as 'domainIP' in config file
+	@property
+	def url(self):
+		host, port = self.httpd.server_address[:2]
+		return "http://{}:{}".format(host, port)
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+# Config file pointing scripts to mock server
+def write_config(path, url):
+	with open(path, "w") as f:
+		f.write("[settings]\nclient_id = mock\napi_key = mock\ndomainIP = {}\n".format(url))
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	ap = argparse.ArgumentParser(description="Local stand-in for AMP API serving generated policies, for load testing online tools")
+	ap.add_argument("--port", dest="port", type=int, default=8080, help="port to listen on (default: 8080)")
+	ap.add_argument("-n", "--policies", dest="policies", type=int, default=100, help="number of policies (default: 100)")
+	ap.add_argument("-e", "--exclusions", dest="exclusions", type=int, nargs=2, default=[10, 100], help="range of path exclusion counts per policy (default: 10 100)", metavar=("MIN", "MAX"))
+	ap.add_argument("-g", "--groups", dest="groups", type=int, default=None, help="number of groups (default: a third of policies)")
+	ap.add_argument("--computers", dest="computers", type=int, default=None, help="number of computers (default: ten per policy)")
+	ap.add_argument("--page-size", dest="page_size", type=int, default=DEFAULT_PAGE_SIZE, help="maximum items per listing page (default: {})".format(DEFAULT_PAGE_SIZE))
+	ap.add_argument("--rate-limit", dest="rate_limit", type=int, nargs=2, default=None, help="allow REQUESTS per SECONDS, 429 afterwards (default: no limit)", metavar=("REQUESTS", "SECONDS"))
+	ap.add_argument("--latency", dest="latency", type=float, nargs=2, default=[0, 0], help="milliseconds added to every response, plus random jitter up to JITTER", metavar=("MS", "JITTER"))
+	ap.add_argument("--throttle-rate", dest="throttle_rate", type=float, default=0.0, help="share of requests answered with 429 (default: 0)")
+	ap.add_argument("--retry-after", dest="retry_after", type=int, default=1, help="'Retry-After' seconds of injected 429 responses (default: 1)")
+	ap.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="share of requests answered with 503 (default: 0)")
+	ap.add_argument("--outage", dest="outage", type=float, nargs=2, default=None, help="fail all requests with 503 for LENGTH seconds every EVERY seconds", metavar=("EVERY", "LENGTH"))
+	ap.add_argument("--groups-with-policies", dest="groups_with_policies", action="store_true", help="include policies in group listing")
+	ap.add_argument("--no-rate-headers", dest="rate_headers", action="store_false", help="do not send X-RateLimit-* headers")
+	ap.add_argument("-s", "--seed", dest="seed", type=int, default=1, help="random seed of generated fleet and injected errors")
+	args = ap.parse_args()
+
+	settings = MockSettings(page_size=args.page_size, latency=args.latency[0] / 1000.0, jitter=args.latency[1] / 1000.0,
+		throttle_rate=args.throttle_rate, error_rate=args.error_rate, retry_after=args.retry_after,
+		outage=tuple(args.outage) if args.outage else None, groups_with_policies=args.groups_with_policies, rate_headers=args.rate_headers, seed=args.seed)
+	if args.rate_limit:
+		settings.rate_limit, settings.window = args.rate_limit
+	print("[+] Generating {} policies".format(args.policies))
+	api = MockAmpApi(args.policies, tuple(args.exclusions), groups=args.groups, seed=args.seed, settings=settings, computers=args.computers)
+	server = MockAmpServer(api, port=args.port)
+	print("[+] Mock AMP API listening on {}, use 'domainIP = {}' in config file".format(server.url, server.url))
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.httpd.server_close()
+		print("[+] {}".format(api.summary()))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,73 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import argparse
+import os
+from amp_policy_kit.snapdiff import diff_snapshots
+from amp_policy_kit.store import is_store
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Ensure that snapshot (folder or policy store) is actually valid, to be used by ArgumentParser 'type' option
+def validate_snapshot(f):
+	if not os.path.isdir(f) and not is_store(f):
+		# Raise exception if specified path is neither folder nor policy store
+		raise argparse.ArgumentTypeError("Folder or policy store {0} does not exist".format(f))
+	return f
+
+#####################################################################################
+# PARSERS
+#####################################################################################
+
+# Print security relevant changes of one policy
+def print_policy_diff(diff):
+	print("#" * 75)
+	if diff.status == "added":
+		print("[+] Policy added: {} ({}, {})".format(diff.name, diff.product, diff.guid))
+	elif diff.status == "removed":
+		print("[-] Policy removed: {} ({}, {})".format(diff.name, diff.product, diff.guid))
+	else:
+		print("[*] Policy changed: {} ({}, {})".format(diff.name, diff.product, diff.guid))
+		print("[+] Policy Version: {} -> {}".format(diff.old.serial_number, diff.new.serial_number))
+		print("[+] Changed sections: {}".format(", ".join(diff.changed_subtrees)))
+	for severity, message in diff.findings_added:
+		print("\t[!]NEW ({}), {}".format(severity, message))
+	for (old_severity, old_message), (severity, message) in diff.findings_changed:
+		print("\t[!]CHANGED ({}), {} (was: {})".format(severity, message, old_message))
+	# Resolved findings of removed policy are not news
+	if diff.status != "removed":
+		for severity, message in diff.findings_removed:
+			print("\t[+]RESOLVED ({}), {}".format(severity, message))
+	for kind, exclusion in diff.exclusions_added:
+		if "*" in exclusion:
+			print("\tWARNING, wildecard {} exclusion added : {} ".format(kind, exclusion))
+		else:
+			print("\t[+] {} exclusion added : {}".format(kind.capitalize(), exclusion))
+	if diff.status != "removed":
+		for kind, exclusion in diff.exclusions_removed:
+			print("\t[-] {} exclusion removed : {}".format(kind.capitalize(), exclusion))
+
+#####################################################################################
+# MAIN
+#####################################################################################
+def main():
+	# Parse arguments
+	ap = argparse.ArgumentParser(description="Show security relevant changes between two policy snapshots created by download-policy-xml.py")
+	ap.add_argument("-a", "--old", dest="old_folder", required=True, help="path to older snapshot folder or policy store", type=validate_snapshot, metavar="OLD_FOLDER")
+	ap.add_argument("-b", "--new", dest="new_folder", required=True, help="path to newer snapshot folder or policy store", type=validate_snapshot, metavar="NEW_FOLDER")
+	args = ap.parse_args()
+
+	stats = {}
+	for diff in diff_snapshots(args.old_folder, args.new_folder, stats):
+		print_policy_diff(diff)
+
+	print("#" * 75)
+	print("[+] Policies in old snapshot: {}, in new snapshot: {}".format(stats["old"], stats["new"]))
+	print("[+] Added: {}, removed: {}, changed: {}".format(stats["added"], stats["removed"], stats["changed"]))
+	print("[+] Identical: {}, changed without security relevant changes: {}".format(stats["identical"], stats["unchanged"]))
+
+if __name__ == "__main__":
+	main()
@@ -2,33 +2,30 @@
 # IMPORTS
 #####################################################################################
 import sys
-import requests
 import configparser
-import time
-import datetime
-import dateutil
-import gc
-import json
-from urllib.parse import urlparse
 import argparse
 import os
 from xml.etree.ElementTree import fromstring, ElementTree,tostring
-
-try:
-	# Used for parsing XML files to make them formatted a bit better
-    from bs4 import BeautifulSoup                  
-except ImportError:
-	print("[!] You do not appear to have 'BeautifulSoup' installed" )
-	print("[!] Please execute 'pip3 install beautifulsoup4' command. Exiting")
-	sys.exit(0)
+from amp_policy_kit.ratelimit import RateLimiter
+from amp_policy_kit.api import api_url, PagedListing
+from amp_policy_kit.workers import PerThread
+from amp_policy_kit.manifest import PolicyManifest
+from amp_policy_kit.store import PolicyStore
+from amp_policy_kit.groups import GroupIndex
+from amp_policy_kit.checkpoint import DownloadCheckpoint, RetryQueue, checkpoint_path
+from amp_policy_kit.policyfile import COMPRESSION_SUFFIXES, CHUNK_SIZE, check_compression, read_policy_file, stream_to_file
 
 #####################################################################################
 # HELPERS
 #####################################################################################
 
-# Ignore insecure cert warnings (enable only if working with onsite-amp deployments)
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+# Ignore insecure cert warnings (enable only if working with onsite-amp deployments).
+# requests is imported on first use, so '-h' or bad arguments do not pay for loading it.
+def load_requests():
+	import requests
+	from requests.packages.urllib3.exceptions import InsecureRequestWarning
+	requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+	return requests
 
 # Ensure that file path is actually valid, to be used by ArgumentParser 'type' option
 def validate_file(f):
@@ -37,6 +34,72 @@ def validate_file(f):
         raise argparse.ArgumentTypeError("Path {0} does not exist".format(f))
     return f
 
+# Create authenticated session used to talk to AMP API
+def new_session(client_id, api_key):
+	import requests
+	session = requests.Session()
+	session.auth = (client_id, api_key)
+	return session
+
+# BeautifulSoup is only needed for pretty printing, which is optional
+def load_beautifulsoup():
+	try:
+		# Used for parsing XML files to make them formatted a bit better
+		from bs4 import BeautifulSoup
+	except ImportError:
+		print("[!] You do not appear to have 'BeautifulSoup' installed" )
+		print("[!] Please execute 'pip3 install beautifulsoup4' command. Exiting")
+		sys.exit(0)
+	return BeautifulSoup
+
+# Prettified policy XML
+def prettify_policy_xml(xml_data, BeautifulSoup):
+	# Parse and prettify XML file
+	tree = ElementTree(fromstring(xml_data))
+	# Get Root of XML policy file
+	root = tree.getroot()
+	b4_xml_obj = BeautifulSoup(tostring(root), "xml")
+	return b4_xml_obj.prettify()
+
+# Rewrite downloaded policy file prettified, returns (sha256, size) of new content
+def prettify_policy_file(path, compression, BeautifulSoup):
+	policy_text = prettify_policy_xml(read_policy_file(path), BeautifulSoup)
+	return stream_to_file([policy_text.encode("utf-8")], path, compression)
+
+# Name of policy file in output folder
+def policy_filename(policy_detail, compression):
+	return "{}_{}{}".format(policy_detail['guid'],policy_detail['product'],COMPRESSION_SUFFIXES[compression])
+
+# Download one policy into store or output folder and record it in manifest. Returns None on success,
+# otherwise reason why it could not be downloaded (policy is then queued for retry).
+def download_policy(limiter, session, domainIP, policy_detail, filename, store, manifest, folder, compression):
+	policy_url=api_url(domainIP, 'v1/policies/{}.xml'.format(policy_detail['guid']))
+	# Final request - get policy XML file and stream it to disk as it arrives, without parsing it
+	try:
+		response = limiter.get(session, policy_url, verify=False, stream=True)
+	except (OSError, IOError) as e:
+		return "connection failed: {}".format(e)
+	try:
+		if response.status_code != 200:
+			return "status code: {}".format(response.status_code)
+		if store is not None:
+			# Stored in one piece, together with serial number and hash for next run
+			store.put(policy_detail['guid'], b"".join(response.iter_content(CHUNK_SIZE)), policy_detail['product'], policy_detail['name'], policy_detail['serial_number'])
+			return None
+		# Written to temporary file and renamed once complete, remember serial number and hash for next run
+		digest, size = stream_to_file(response.iter_content(CHUNK_SIZE), os.path.join(folder, filename), compression)
+	except (OSError, IOError) as e:
+		# Connection dropped while policy was streamed, temporary file is already gone
+		return "download interrupted: {}".format(e)
+	finally:
+		response.close()
+	# File of previous run with different compression would be read as another copy of the policy
+	previous = manifest.policies.get(policy_detail['guid'], {}).get('filename')
+	if previous and previous != filename and os.path.exists(os.path.join(folder, previous)):
+		os.remove(os.path.join(folder, previous))
+	manifest.update(policy_detail['guid'], policy_detail['serial_number'], filename, digest, policy_detail['product'])
+	return None
+
 #####################################################################################
 # MAIN
 #####################################################################################
@@ -44,8 +107,24 @@ def main():
 	# Parse arguments
 	ap = argparse.ArgumentParser()
 	ap.add_argument("-c", "--config", dest="config_path", required=True, help="path to config file", type=validate_file, metavar="FILE")
-	ap.add_argument("-o", "--output", dest="outout_folder", required=True, help="path to output folder", type=validate_file)
+	target = ap.add_mutually_exclusive_group(required=True)
+	target.add_argument("-o", "--output", dest="outout_folder", help="path to output folder", type=validate_file)
+	target.add_argument("-s", "--store", dest="store", help="write policies into single-file policy store (SQLite) instead of folder", metavar="STORE")
+	ap.add_argument("-f", "--full", dest="full", action="store_true", help="download all policies, even those which did not change since last run")
+	ap.add_argument("-z", "--compress", dest="compress", default="none", choices=["none", "gzip", "zstd"], help="compress policy files while they are written (default: none)")
+	ap.add_argument("-p", "--pretty", dest="pretty", action="store_true", help="pretty print policy files after download (slow, needs BeautifulSoup)")
+	ap.add_argument("-r", "--resume", dest="resume", action="store_true", help="continue interrupted run from its checkpoint, policies it completed are not downloaded again")
+	ap.add_argument("--retries", dest="retries", type=int, default=2, help="times failed policy is retried after all other policies are downloaded (default: 2)")
 	args = ap.parse_args()
+	compression = None if args.compress == "none" else args.compress
+	try:
+		check_compression(compression)
+	except ImportError:
+		print("[!] You do not appear to have 'zstandard' installed")
+		print("[!] Please execute 'pip3 install zstandard' command. Exiting")
+		sys.exit(0)
+	BeautifulSoup = load_beautifulsoup() if args.pretty else None
+	load_requests()
 
 	# Parse config to extract API keys
 	config = configparser.ConfigParser()
@@ -54,49 +133,137 @@ def main():
 	api_key = config['settings']['api_key']
 	domainIP = config['settings']['domainIP']
 
+	# Manifest of policies downloaded by previous runs (policy store keeps the same bookkeeping itself)
+	store = PolicyStore(args.store) if args.store else None
+	manifest = store if store is not None else PolicyManifest(args.outout_folder)
+	# Progress of run is checkpointed, so interrupted run can be resumed without downloading again what it completed
+	options = {"full": args.full, "compress": args.compress, "pretty": args.pretty}
+	checkpoint = DownloadCheckpoint.load(checkpoint_path(args.outout_folder, args.store), manifest)
+	if checkpoint is not None and not args.resume:
+		print("[+] Checkpoint of interrupted run is replaced by this run (use --resume to continue it)")
+		checkpoint = None
+	if checkpoint is not None and checkpoint.options != options:
+		ap.error("Interrupted run used different options ({}), resume it with the same options".format(", ".join("{}={}".format(k, v) for k, v in sorted(checkpoint.options.items()))))
+	if checkpoint is None:
+		if args.resume:
+			print("[+] No checkpoint to resume, starting new run")
+		checkpoint = DownloadCheckpoint(checkpoint_path(args.outout_folder, args.store), manifest, options)
+	else:
+		print("[+] Resuming interrupted run: {} policies completed, {} failed".format(len(checkpoint.completed), len(checkpoint.failed)))
+
+	finished = False
 	try:
 	    # http://docs.python-requests.org/en/master/user/advanced/
-	    # Using a session object gains efficiency when making multiple requests
-	    session = requests.Session()
-	    session.auth = (client_id, api_key)
+	    # Using a session object gains efficiency when making multiple requests.
+	    # Listing prefetch runs in its own thread, which gets its own session
+	    sessions = PerThread(lambda: new_session(client_id, api_key))
+	    session = sessions.get()
+	    # Rate limiter paces requests from X-RateLimit-* headers and retries 429 / 5xx responses
+	    limiter = RateLimiter()
 
 	    # Define URL for extraction of all policies
-	    policy_url='https://{}/v1/policies'.format(domainIP)
-	    response = session.get(policy_url, verify=False)
-	    # Get Headers
-	    headers=response.headers
-	    # Decode JSON response
-	    response_json = response.json()
-	    print("[+] Total number of policies: {}".format(response_json['metadata']['results']['total']))
-	    policies = response_json['data']
-	    # Enumerate all policies and download them to specified folder
-	    for policy_detail in policies:
-	    	policy_url='https://{}/v1/policies/{}'.format(domainIP,policy_detail['guid'])
-	    	# Reuse session, get XML out
-	    	response = session.get(policy_url, verify=False)
-	    	headers=response.headers
-	    	# Parse out response as JSON so we can extract at least basic metadata which can be used for further processing
-	    	response_json = response.json()
-	    	# Print out basic details about policy
-	    	print("[+] Downloading Policy. NAME: {} GUID: {} PRODUCT: {}  DEFAULT: {} SERIAL NUMBER: {} URL: {}".format(policy_detail['name'],policy_detail['guid'],policy_detail['product'],policy_detail['default'],policy_detail['serial_number'],policy_detail['links']['policy']))
-    		policy_url='https://{}/v1/policies/{}.xml'.format(domainIP,policy_detail['guid'])
-    		# Final request - get policy XML file, parse and write to file
-    		response = session.get(policy_url, verify=False)
-    		#Parse and prettify XML file before writing
-    		tree = ElementTree(fromstring(response.content))
-    		# Get Root of XML policy file
-    		root = tree.getroot()
-    		b4_xml_obj = BeautifulSoup(tostring(root), "xml")
-    		# Construct path for writing out policy as XML file
-    		filename = os.path.join(args.outout_folder,"{}_{}.xml".format(policy_detail['guid'],policy_detail['product']))
-    		f = open(filename, "w")
-    		# Write out file to disk, prettified
-    		f.write(b4_xml_obj.prettify())
-    		# Close stream
-    		f.close()
+	    policy_url=api_url(domainIP, 'v1/policies')
+	    # Listing follows next page links, next page is fetched while policies of current one are downloaded
+	    listing = PagedListing(limiter, sessions.get, policy_url, verify=False)
+	    print("[+] Total number of policies: {}".format(listing.total))
+	    # Group membership of all policies is built once from groups endpoint, instead of one request per policy
+	    group_index = GroupIndex.build(limiter, lambda: session, domainIP, verify=False)
+	    if not group_index.complete:
+	    	print("\t[!] WARNING, group listing is incomplete, groups in manifest are not refreshed: {}".format(group_index.error))
+	    # Enumerate all policies and download them to specified folder, skip those which did not change since last run
+	    # and those completed by resumed run. Failed policies are queued and retried once the listing is done.
+	    skipped = 0
+	    resumed = 0
+	    downloaded = []
+	    policies = []
+	    retry = RetryQueue(args.retries)
+	    stopped = False
+	    for policy_detail in listing:
+	    	policies.append(policy_detail)
+	    	filename = policy_filename(policy_detail, compression)
+	    	current = store.is_current(policy_detail['guid'], policy_detail['serial_number']) if store is not None else manifest.is_current(policy_detail['guid'], policy_detail['serial_number'], filename)
+	    	if current and checkpoint.is_completed(policy_detail['guid'], policy_detail['serial_number']):
+	    		resumed += 1
+	    		# Resumed run may have stopped before pretty printing
+	    		if args.pretty and not checkpoint.is_pretty(policy_detail['guid']):
+	    			downloaded.append(policy_detail)
+	    		continue
+	    	if not args.full and current:
+	    		skipped += 1
+	    		continue
+	    	# Print out basic details about policy, listing already contains all metadata we need
+	    	print("[+] Downloading Policy. NAME: {} GUID: {} PRODUCT: {}  DEFAULT: {} SERIAL NUMBER: {} GROUPS: {} URL: {}".format(policy_detail['name'],policy_detail['guid'],policy_detail['product'],policy_detail['default'],policy_detail['serial_number'],len(group_index.groups_for(policy_detail['guid'])),policy_detail['links']['policy']))
+	    	error = download_policy(limiter, session, domainIP, policy_detail, filename, store, manifest, args.outout_folder, compression)
+	    	if error is None:
+	    		checkpoint.complete(policy_detail['guid'], policy_detail['serial_number'])
+	    		downloaded.append(policy_detail)
+	    		continue
+	    	print("\t[!] WARNING, policy could not be downloaded, {}".format(error))
+	    	if not retry.put(policy_detail, error):
+	    		print("\t[!] WARNING, {} policies could not be downloaded, stopping run".format(len(retry) + 1))
+	    		stopped = True
+	    		break
+	    # Failed policies get another chance once all other policies are downloaded
+	    while len(retry) and not stopped:
+	    	policy_detail, attempt = retry.get()
+	    	print("[+] Retrying Policy. NAME: {} GUID: {} ATTEMPT: {}".format(policy_detail['name'], policy_detail['guid'], attempt))
+	    	error = download_policy(limiter, session, domainIP, policy_detail, policy_filename(policy_detail, compression), store, manifest, args.outout_folder, compression)
+	    	if error is None:
+	    		checkpoint.complete(policy_detail['guid'], policy_detail['serial_number'])
+	    		downloaded.append(policy_detail)
+	    		continue
+	    	print("\t[!] WARNING, policy could not be downloaded, {}".format(error))
+	    	retry.put(policy_detail, error)
+	    # Policies which were not downloaded are left to the next run
+	    failed = dict(retry.failed)
+	    for policy_detail in retry.queue:
+	    	failed[policy_detail['guid']] = "not retried, run was stopped"
+	    for guid, error in failed.items():
+	    	checkpoint.fail(guid, error)
+	    # Pretty printing is CPU heavy, so it runs after all downloads are done and only if asked for
+	    if args.pretty and downloaded:
+	    	print("[+] Pretty printing {} policy files".format(len(downloaded)))
+	    	for policy_detail in downloaded:
+	    		if store is not None:
+	    			policy_text = prettify_policy_xml(store.get(policy_detail['guid']), BeautifulSoup)
+	    			store.put(policy_detail['guid'], policy_text, policy_detail['product'], policy_detail['name'], policy_detail['serial_number'])
+	    		else:
+	    			entry = manifest.policies[policy_detail['guid']]
+	    			digest, size = prettify_policy_file(os.path.join(args.outout_folder, entry['filename']), compression, BeautifulSoup)
+	    			manifest.update(policy_detail['guid'], policy_detail['serial_number'], entry['filename'], digest, policy_detail['product'])
+	    		checkpoint.prettified(policy_detail['guid'])
+	    # Group membership can change without policy serial number changing, so it is refreshed for all policies
+	    # (partial group index would drop groups of policies, groups of previous run are kept then)
+	    for policy_detail in policies if group_index.complete else []:
+	    	manifest.set_groups(policy_detail['guid'], group_index.groups_for(policy_detail['guid']))
+	    print("[+] Unchanged policies skipped: {}".format(skipped))
+	    if resumed:
+	    	print("[+] Policies completed by interrupted run skipped: {}".format(resumed))
+	    if failed:
+	    	print("\t[!] WARNING, {} policies could not be downloaded:".format(len(failed)))
+	    	for guid, error in sorted(failed.items()):
+	    		print("\t\t{} {}".format(guid, error))
+	    if not listing.complete and not stopped:
+	    	print("\t[!] WARNING, policy listing is incomplete, {} of {} policies listed: {}".format(len(policies), listing.total, listing.error))
+
+	    # Remove files of policies which were deleted from console. Only safe if listing contains all policies.
+	    if listing.complete and len(policies) == listing.total:
+	    	for guid in manifest.remove_stale(set(p['guid'] for p in policies)):
+	    		print("[+] Removed deleted policy GUID: {}".format(guid))
+	    # Show how much time was lost waiting for API rate limits
+	    print("[+] {}".format(limiter.summary()))
+	    finished = listing.complete and not stopped and not failed
 	finally:
+		# Keep whatever was downloaded so far, even if run was interrupted. Checkpoint is only needed until run completes.
+		if finished:
+			manifest.save()
+			checkpoint.remove()
+		else:
+			checkpoint.save()
+			print("[+] Checkpoint saved: {} policies completed, {} failed, run again with --resume to continue".format(len(checkpoint.completed), len(checkpoint.failed)))
+		if store is not None:
+			store.close()
 		print("[+] Done")
-		gc.collect()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
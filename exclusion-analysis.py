@@ -0,0 +1,197 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import argparse
+import os
+from collections import OrderedDict
+from itertools import islice
+from amp_policy_kit.policyxml import parse_policy_outline, stream_config_items
+from amp_policy_kit.store import read_policy, source_identity, expand_input
+from amp_policy_kit.policyindex import PolicyIndex, PRODUCT_MARKERS
+from amp_policy_kit.audit import detect_product
+from amp_policy_kit.exclusions import ExclusionMatcher, PREFIX, GLOB, REGEX, scan_corpus, decode_process_exclusion
+from amp_policy_kit.regexcost import analyze_patterns
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Exclusion lists matched against paths: path exclusions and process exclusions, in this order
+MATCHED_ITEMS = ("exclusions/info/item", "exclusions/process/item")
+
+# Policy with compiled path exclusions
+class PolicyExclusions(object):
+	def __init__(self, path):
+		# Only header and exclusions are needed, exclusion items are counted first and streamed into matchers
+		xml_data = read_policy(path)
+		json_object, counts, marked = parse_policy_outline(xml_data, ("janus", "exclusions"), MATCHED_ITEMS, PRODUCT_MARKERS)
+		self.path = path
+		config = json_object['ns0:Signature']['ns0:Object']['ns0:config']
+		if not isinstance(config, dict):
+			config = {}
+		index = PolicyIndex(config, PRODUCT_MARKERS)
+		index.add_mentions('exclusions', marked)
+		header = (config.get('ns0:janus') or {}).get('ns0:policy') or {}
+		self.name = header.get('ns0:name')
+		self.guid = header.get('ns0:uuid') or source_identity(path)[0]
+		self.product = detect_product(index)
+		items = stream_config_items(xml_data, [(item_path, counts.get(item_path, 0)) for item_path in MATCHED_ITEMS])
+		self.matcher = ExclusionMatcher([item for item_path, item in islice(items, counts.get(MATCHED_ITEMS[0], 0))], self.product)
+		self.processes = ExclusionMatcher([item for item_path, item in islice(items, counts.get(MATCHED_ITEMS[1], 0))], self.product, decode_process_exclusion)
+
+# Match files kept open at once - corpus matches of policies come interleaved, least recently written file is
+# closed (and later reopened for appending), so fleet of thousands of policies does not run out of file descriptors
+MAX_OPEN_FILES = 64
+
+# Excluded paths of every policy written to '<policy file name>.txt' in given folder
+class MatchWriter(object):
+	def __init__(self, folder, max_open=MAX_OPEN_FILES):
+		self.folder = folder
+		self.max_open = max_open
+		# policy path -> open file, least recently written first
+		self.files = OrderedDict()
+		self.written = set()
+		os.makedirs(folder, exist_ok=True)
+
+	def __call__(self, policy_path, path):
+		f = self.files.get(policy_path)
+		if f is None:
+			if len(self.files) >= self.max_open:
+				self.files.popitem(last=False)[1].close()
+			name = "_".join(part for part in source_identity(policy_path) if part)
+			# File of previous run is overwritten, file closed earlier in this run is appended to
+			f = open(os.path.join(self.folder, "{}.txt".format(name)), "a" if policy_path in self.written else "w", buffering=1024 * 1024)
+			self.files[policy_path] = f
+			self.written.add(policy_path)
+		else:
+			self.files.move_to_end(policy_path)
+		f.write(path + "\n")
+
+	def close(self):
+		for f in self.files.values():
+			f.close()
+		self.files.clear()
+
+#####################################################################################
+# PARSERS
+#####################################################################################
+
+# Print exclusion structure of a policy - types, broken regular expressions and shadowed exclusions
+def parse_exclusion_structure(policy):
+	matcher = policy.matcher
+	styles = [e.style for e in matcher.exclusions]
+	print("[+] Policy Name: {}".format(policy.name))
+	print("[+] Policy Product: {}".format(policy.product))
+	print("[+] Policy GUID: {}".format(policy.guid))
+	print("[+] Path exclusions: {} (plain: {}, wildcard: {}, regex: {})".format(len(styles), styles.count(PREFIX), styles.count(GLOB), styles.count(REGEX)))
+	for e in matcher.invalid:
+		print("\t[!] WARNING, invalid regular expression : {} ({})".format(e.path, e.error))
+	shadowed = matcher.shadowing()
+	if shadowed:
+		print("[+] Redundant exclusions:")
+		for e, by, reason in shadowed:
+			print("\t[!] WARNING, redundant : {} ({} {})".format(e.path, reason, by.path))
+	else:
+		print("[+] No redundant exclusions found")
+
+# Print blast radius of exclusions of a policy on path corpus
+def parse_corpus_stats(policy, stats, total):
+	print("[+] Policy Name: {} ({})".format(policy.name, policy.guid))
+	print("[+] Paths excluded: {} of {} ({:.2f}%)".format(stats.excluded, total, 100.0 * stats.excluded / total if total else 0))
+	for e in policy.matcher.exclusions:
+		matched, unique, samples = stats.by_exclusion[e.index]
+		if matched == 0:
+			print("\t[-] {} : no paths".format(e.path))
+			continue
+		note = "" if unique else " - every path is excluded by another exclusion as well"
+		print("\t[+] {} : {} paths, {} only by this exclusion{}".format(e.path, matched, unique, note))
+		for sample in samples:
+			print("\t\t{}".format(sample))
+
+# Print wildcard / regex exclusions (path and process) of all policies ranked by evaluation cost.
+# The same pattern is measured once, no matter how many policies use it.
+def parse_pattern_cost(policies, top, workload):
+	usage = {}
+	patterns = []
+	for policy in policies:
+		for kind, matcher in (("path", policy.matcher), ("process", policy.processes)):
+			for e in matcher.patterns:
+				key = (e.pattern, policy.product)
+				if key not in usage:
+					usage[key] = [e.path, set(), set()]
+					patterns.append((e.pattern, e.regex, policy.product))
+				usage[key][1].add(policy.path)
+				usage[key][2].add(kind)
+	costs = analyze_patterns(patterns, workload_size=workload)
+	flagged = [c for c in costs if c.flags]
+	print("[+] Exclusion patterns: {} distinct, {} with performance problems".format(len(costs), len(flagged)))
+	print("[+] Most expensive patterns (synthetic workload of {} paths per product):".format(workload))
+	for cost in costs[:top]:
+		path, used_in, kinds = usage[(cost.pattern, cost.product)]
+		measured = "exponential" if cost.catastrophic else "{:.0f} ns/path".format(cost.ns_per_path)
+		line = "{} : {}, {} {} exclusion, policy files: {}".format(path, measured, cost.product, "/".join(sorted(kinds)), len(used_in))
+		if cost.flags:
+			print("\t[!] WARNING, {}".format(line))
+			for flag in cost.flags:
+				print("\t\t- {}".format(flag))
+		else:
+			print("\t[+] {}".format(line))
+
+#####################################################################################
+# MAIN
+#####################################################################################
+def main():
+	# Parse arguments
+	ap = argparse.ArgumentParser(description="Analyse path exclusions of AMP policies - redundant exclusions and paths they exclude")
+	ap.add_argument("-i", "--input", dest="config_path", required=True, help="path to AMP XML config file, folder with XML files, glob pattern (quoted) or policy store", metavar="FILE")
+	ap.add_argument("-p", "--paths", dest="corpus", default=None, help="file with one path per line to match exclusions against ('-' for standard input)", metavar="CORPUS")
+	ap.add_argument("-s", "--samples", dest="samples", type=int, default=3, help="number of sample paths shown per exclusion (default: 3)")
+	ap.add_argument("-m", "--matches", dest="matches", default=None, help="write paths excluded by each policy to '<policy file name>.txt' files in this folder", metavar="FOLDER")
+	ap.add_argument("--cost", dest="cost", action="store_true", help="rank wildcard and regex exclusions (path and process) by evaluation cost")
+	ap.add_argument("--top", dest="top", type=int, default=20, help="number of patterns shown in cost ranking (default: 20)")
+	ap.add_argument("--workload", dest="workload", type=int, default=2000, help="number of synthetic paths patterns are timed against (default: 2000)")
+	args = ap.parse_args()
+
+	policy_files = expand_input(args.config_path)
+	if len(policy_files) == 0:
+		ap.error("Path {0} does not exist or does not contain any XML files".format(args.config_path))
+
+	policies = []
+	for path in policy_files:
+		try:
+			policies.append(PolicyExclusions(path))
+		except Exception as e:
+			print("[!] ERROR, unable to read policy file {}: {}".format(path, repr(e)))
+
+	for policy in policies:
+		print("#" * 75)
+		parse_exclusion_structure(policy)
+
+	if args.cost:
+		print("#" * 75)
+		parse_pattern_cost(policies, args.top, args.workload)
+
+	if args.corpus is None:
+		return
+
+	# Corpus is streamed once for all policies, it is never loaded to memory
+	corpus = sys.stdin if args.corpus == "-" else open(args.corpus, "r", encoding="utf-8", errors="replace", buffering=1024 * 1024)
+	writer = MatchWriter(args.matches) if args.matches else None
+	try:
+		total, stats = scan_corpus(dict((p.path, p.matcher) for p in policies), corpus, args.samples, writer)
+	finally:
+		if corpus is not sys.stdin:
+			corpus.close()
+		if writer is not None:
+			writer.close()
+
+	print("#" * 75)
+	print("[+] Paths in corpus: {}".format(total))
+	for policy in policies:
+		print("#" * 75)
+		parse_corpus_stats(policy, stats[policy.path], total)
+
+if __name__ == "__main__":
+	main()
@@ -2,26 +2,20 @@
 # IMPORTS
 #####################################################################################
 
-import sys
-import requests
 import configparser
-import time
-import datetime
-import dateutil
-import gc
 import json
-from urllib.parse import urlparse, unquote
 import argparse
 import os
-from xml.etree.ElementTree import fromstring, ElementTree,tostring
-
-try:
-    import xmltodict
-    from bs4 import BeautifulSoup                  
-except ImportError:
-	print("[!] You do not appear to have either 'xmltodict' or 'BeautifulSoup' installed" )
-	print("[!] Please execute 'pip3 install xmltodict beautifulsoup4' command. Exiting")
-	sys.exit(0)
+from xml.etree.ElementTree import ParseError
+from amp_policy_kit.ratelimit import RateLimiter
+from amp_policy_kit.api import api_url, PagedListing
+from amp_policy_kit.workers import ordered_map, PerThread
+from amp_policy_kit.groups import GroupIndex
+from amp_policy_kit.computers import ComputerIndex, ImpactEmitter
+from amp_policy_kit.cache import AuditCache
+from amp_policy_kit.audit import PolicyAudit
+from amp_policy_kit.findings import FORMATS, RecordingEmitter, open_emitter, replay
+from amp_policy_kit.findingsdb import record_findings
 
 #####################################################################################
 # HELPERS
@@ -34,361 +28,88 @@ def validate_file(f):
         raise argparse.ArgumentTypeError("Path {0} does not exist".format(f))
     return f
 
-# Quick validation of key elements before they are parsed
-def validate_json_element(file_json, fields):
+# Ignore insecure cert warnings (enable only if working with onsite-amp deployments).
+# requests is imported on first use, so '-h' or bad arguments do not pay for loading it.
+def load_requests():
+	import requests
+	from requests.packages.urllib3.exceptions import InsecureRequestWarning
+	requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+	return requests
+
+# Create authenticated session used to talk to AMP API
+def new_session(client_id, api_key):
+	import requests
+	session = requests.Session()
+	session.auth = (client_id, api_key)
+	return session
+
+# Fetch policy XML - executed by worker threads. Returns (policy XML, None), or (None, reason why it could not be fetched)
+def fetch_policy(session, limiter, domainIP, policy_detail):
+	policy_url=api_url(domainIP, 'v1/policies/{}.xml'.format(policy_detail['guid']))
+	# Rate limiter paces requests and retries them, so we don't cross API limits
 	try:
-		x = file_json[fields]
-		return True
-	except KeyError:
-		return False
-	except TypeError:
-		return False
-
-# Ignore insecure cert warnings (enable only if working with onsite-amp deployments)
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-def checkAPITimeout(headers, request):
-    """Ensure we don't cross API limits, sleep if we are approaching close to limits"""
-    if str(request.status_code) == '200':
-        # Extract headers (these are also returned)
-        headers=request.headers
-        # check if we correctly got headers
-        if headers:
-            # We stop on 45 due to number of threads working
-            if 'X-RateLimit-Remaining' and 'X-RateLimit-Reset' in str(headers):
-                if(int(headers['X-RateLimit-Remaining']) < 45):
-                    if(headers['Status'] == "200 OK"):
-                        # We are close to the border, in theory 429 error code should never trigger if we capture this event
-                        # For some reason simply using time.sleep does not work very well here
-                        time.sleep((int(headers['X-RateLimit-Reset'])+5))
-                    if(headers['Status'] == "429 Too Many Requests"):
-                        # Triggered too many request, we need to sleep before it continues
-                        # For some reason simply using time.sleep does not work very well here
-                        time.sleep((int(headers['X-RateLimit-Reset'])+5))
-            elif '503 Service Unavailable' in str(headers):
-                time.sleep(60)
-            else: # we got some new error
-                time.sleep(45)
-        else:
-            # no headers, request probably failed
-            time.sleep(45)
-    elif str(request.status_code) == '404':
-        # 404 - this could mean event timeline or event does no longer exists
-        time.sleep(45)
-        pass
-    elif str(request.status_code) == '503':
-        # server sarted to block us
-        time.sleep(90)
-        pass
-    else:
-        # in any other case, sleep
-        time.sleep(90)
-        pass
+		response = limiter.get(session, policy_url, verify=False)
+	except (OSError, IOError) as e:
+		return None, "connection failed: {}".format(e)
+	if response.status_code != 200:
+		return None, "status code: {}".format(response.status_code)
+	return response.content, None
+
+# Findings with most connectors affected first
+def report_impact(out, impact, top):
+	out.status("[+] Rules by affected connectors:")
+	for rule_id, endpoints, policies in impact.rule_ranking():
+		out.status("\t{:>8} connectors {:>6} policies  {}".format(endpoints, policies, rule_id))
+	out.status("[+] Top {} findings by affected connectors:".format(top))
+	for endpoints, count, finding in impact.ranking(top):
+		more = " (and {} more)".format(count - 1) if count > 1 else ""
+		out.status("\t{:>8} connectors  [{}] {}: {}{}".format(endpoints, finding.severity, finding.policy_name, finding.message, more))
 
 #####################################################################################
-# PARSERS
+# MAIN
 #####################################################################################
-
-
-def parse_agentsettings(json_agent,json_object,product_type):
-	# Check various scanning engines and their options for Windows
-	if (product_type == 'windows'):
-		print("[+] Specific Policy Misconfiguration:")
-
-		if not validate_json_element(json_agent['ns0:control'],'ns0:passwordex'):
-			print("\t[!]WARNING, AMP installation is not protected by password. Change this in 'Administrative Features > Enable Connector Protection'")
-
-		# Check TTL on cloud lookups
-		if validate_json_element(json_agent,'ns0:cloud'):
-			cloud_settings = json_agent['ns0:cloud'] if "ns0:cloud" in str(json_agent) else None
-			cloud_ttl = cloud_settings['ns0:cache']['ns0:ttl']
-			if ( cloud_ttl != None):
-				if (int(cloud_ttl['ns0:unknown']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on unknown hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:unknown'])))
-				if (int(cloud_ttl['ns0:clean']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on clean hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:clean'])))
-				if (int(cloud_ttl['ns0:malicious']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on malicious hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:malicious'])))
-				if (int(cloud_ttl['ns0:unseen']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on unseen hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:unseen'])))
-				if (int(cloud_ttl['ns0:block']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on block hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:block'])))
-
-		# APDE = behavioral analytics
-		if validate_json_element(json_agent,'ns0:apde'):
-			apde_settings = json_agent['ns0:apde'] if "ns0:apde" in str(json_agent) else None
-			if ( apde_settings != None):
-				if (str(apde_settings['ns0:enable']) == '0'):
-					print("\t[!]WARNING, Behavioral Protection is disabled. Change this in 'Modes and Engines > Behavioral Protection'")
-				if (str(apde_settings['ns0:enable']) == '1' and str(apde_settings['ns0:mode']) == '0'):
-					print("\t[!]WARNING, Behavioral Protection is set to AUDIT. Change this in 'Modes and Engines > Behavioral Protection'")
-
-		# Check driver settings
-		if validate_json_element(json_agent,'ns0:driver'):
-			driver_settings = json_agent['ns0:driver'] if "ns0:driver" in str(json_agent) else None
-			if ( driver_settings != None):
-				if (str(driver_settings['ns0:blockexecqaction']) == '0' and str(driver_settings['ns0:protmode']['ns0:qaction']) == '0'):
-					print("\t[!]WARNING, FILE protection is set to AUDIT. Change this in 'Modes and Engines > File'")
-
-				if (str(driver_settings['ns0:protmode']['ns0:file']) == '0'):
-					print("\t[!]WARNING, Monitor File Copies and Moves Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'")
-
-				if (str(driver_settings['ns0:protmode']['ns0:process']) == '0'):
-					print("\t[!]WARNING, Monitor Process Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'")
-
-				if (str(driver_settings['ns0:selfprotect']['ns0:spp_qaction']) == '0'):
-					print("\t[!]WARNING, System Process Protection is set to AUDIT. Change this in 'Modes and Engines > Malicious Activity Protection > System Process Protection'")
-
-				if (str(driver_settings['ns0:selfprotect']['ns0:spp']) == '0' and str(driver_settings['ns0:selfprotect']['ns0:mkp']) == '0' and str(driver_settings['ns0:selfprotect']['ns0:sde']) == '0' and str(driver_settings['ns0:selfprotect']['ns0:spp_qaction']) == '1'):
-					print("\t[!]WARNING, System Process Protection is set to DISABLED. Change this in 'Modes and Engines > Malicious Activity Protection > System Process Protection'")
-
-				if (str(driver_settings['ns0:protmode']['ns0:activeexec']) == '0'):
-					print("\t[!]WARNING, On Execute Mode is set to PASSIVE. Change this in 'Advance Settings > File and Process Scan'")
-
-		# Check agent isolation
-		if validate_json_element(json_agent,'ns0:endpointisolation'):
-			agent_isolation_settings = json_agent['ns0:endpointisolation'] if "ns0:endpointisolation" in json_agent else None
-			if(agent_isolation_settings != None):
-				if (str(agent_isolation_settings['ns0:enable']) == '0'):
-					print("\t[!]WARNING, Endpoint Isolation feature is disabled. Change this in 'Advance Settings > Endpoint Isolation'")
-				if (str(agent_isolation_settings['ns0:enable']) == '1' and str(agent_isolation_settings['ns0:allowproxy']) == '1'):
-					print("\t[!]WARNING, Endpoint Isolation feature is ENABLED and access to proxy is enabled. Change this in 'Advance Settings > Endpoint Isolation'")
-				if (str(agent_isolation_settings['ns0:enable']) == '1' and str(agent_isolation_settings['ns0:allowproxy']) == '0'):
-					print("\t[!]WARNING, Endpoint Isolation feature is ENABLED and access to proxy is disabled. Change this in 'Advance Settings > Endpoint Isolation'")
-
-		# Check Orbital settings
-		if validate_json_element(json_object['ns0:Signature']['ns0:Object']['ns0:config'],'ns0:orbital'):
-			orbital_settings = json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:orbital'] if "ns0:enablemsi" in json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:orbital'] else None
-			if(orbital_settings != None):
-				if(str(orbital_settings['ns0:enablemsi']) == '0'):
-					print("\t[!]WARNING, ORBITAL is disabled. Change this in 'Advance Settings > Orbital'")
-	
-		# Check scanner settings
-		if validate_json_element(json_agent,'ns0:scansettings'):
-			scanner_settings = json_agent['ns0:scansettings'] if "ns0:scansettings" in json_agent else None
-			if (scanner_settings != None):
-				if (str(scanner_settings['ns0:ethos']['ns0:enable']) == '0'):
-					print("\t[!]WARNING, ETHOS engine is disabled. Change this in 'Advance Settings > Engines'")
-				if (str(scanner_settings['ns0:ethos']['ns0:enable']) == '1' and str(scanner_settings['ns0:ethos']['ns0:file']) == '0'):
-					print("\t[!]WARNING, ETHOS engine is ENABLED but ON COPY/MOVE scanning is disabled. Change this in 'Advance Settings > Engines'")
-				if (str(scanner_settings['ns0:ssd']) == '0'):
-					print("\t[!]WARNING, Monitoring of Network Drives is diabled. Change this in 'Advance Settings > Engines'")
-				if (str(scanner_settings['ns0:spero']['ns0:enable']) == '0'):
-					print("\t[!]WARNING, SPERO engine is disabled. Change this in 'Advance Settings > Engines'")
-				if (str(scanner_settings['ns0:tetra']['ns0:enable']) == '0'):
-					print("\t[!]WARNING, TETRA engine is disabled. Change this in 'Advance Settings > TETRA'")
-
-			# Parse Tetra options
-			tetra_options = scanner_settings['ns0:tetra']['ns0:options']['ns0:ondemand']
-			if (tetra_options != None):
-				if (str(tetra_options['ns0:scanarchives']) == '0' and str(scanner_settings['ns0:tetra']['ns0:enable']) == '1'):
-					print("\t[!]WARNING, TETRA engine is ENABLED but ARCHIVE scan is disabled. Change this in 'Advance Settings > TETRA'")
-				if (str(tetra_options['ns0:scanpacked']) == '0' and str(scanner_settings['ns0:tetra']['ns0:enable']) == '1'):
-					print("\t[!]WARNING, TETRA engine is ENABLED but PACKED FILE scan is disabled. Change this in 'Advance Settings > TETRA'")
-				if (str(tetra_options['ns0:deepscan']) == '0' and str(scanner_settings['ns0:tetra']['ns0:enable']) == '1'):
-					print("\t[!]WARNING, TETRA engine is ENABLED but DEEP scan is disabled. Change this in 'Advance Settings > TETRA'")
-
-			# Parse Malicious Activity Protection settings
-			heuristic = json_agent['ns0:heuristic'] if "ns0:heuristic" in str(json_agent) else None
-			if (heuristic != None):
-				# Values - enabled & qaction 1 = 0 audit, enabled & qaction 1 = Quarantine, enabled & qaction = 2 block
-				if (str(heuristic['ns0:enable']) == '0'):
-					print("\t[!]WARNING, Malicious Activity Protection is DISABLED. Change this in 'Modes and Engines > Malicious Activity Protection'")
-				if (str(heuristic['ns0:enable']) == '1' and str(heuristic['ns0:qaction']) == '0'):
-					print("\t[!]WARNING, Malicious Activity Protection is ENABLED but set to AUDIT mode. Change this in 'Modes and Engines > Malicious Activity Protection'")
-				if (str(heuristic['ns0:enable']) == '1' and str(heuristic['ns0:qaction']) == '1'):
-					print("\t[!]WARNING, Malicious Activity Protection is ENABLED but set to QUARANTINE mode. Change this in 'Modes and Engines > Malicious Activity Protection'")
-
-			# Parse exploit prevention settings
-			exploit_prevention = json_agent['ns0:exprev']['ns0:enable'] if "ns0:exprev" in str(json_agent) else None
-			if (exploit_prevention != None):
-				if (str(exploit_prevention) == '0'):
-					print("\t[!]WARNING, Exploit Prevention is disabled. Change this in 'Modes and Engines > Exploit Protection'")
-				if (str(exploit_prevention) == '1' and str(json_agent['ns0:exprev']['ns0:v4']['ns0:options'] == '0x0000033B')):
-					print("\t[!]WARNING, Exploit Prevention is set to AUDIT. Change this in 'Modes and Engines > Exploit Protection'")
-
-			# Parse AMSI engine settings
-			amsi_settings = json_agent['ns0:amsi'] if "ns0:amsi" in str(json_agent) else None
-			if (amsi_settings != None):
-				if (str(amsi_settings['ns0:enable']) == '0'):
-					print("\t[!]WARNING, Script Protection engine is disabled. Change this in 'Modes and Engines > Script Protection'")
-				if (str(amsi_settings['ns0:enable']) == '1' and str(amsi_settings['ns0:mode']) == '0'):
-					print("\t[!]WARNING, Script Protection is ENABLED and engine is set to AUDIT. Change this in 'Modes and Engines > Script Protection'")
-
-	# Check various scanning engines and their options for Mac or Linux
-	if (product_type == 'mac' or product_type == 'linux'):
-		print("[+] Specific Policy Misconfiguration:")
-		# Check TTL on cloud lookups
-		if validate_json_element(json_agent,'ns0:cloud'):
-			cloud_settings = json_agent['ns0:cloud'] if "ns0:cloud" in str(json_agent) else None
-			cloud_ttl = cloud_settings['ns0:cache']['ns0:ttl']
-			if ( cloud_ttl != None):
-				if (int(cloud_ttl['ns0:unknown']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on unknown hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:unknown'])))
-				if (int(cloud_ttl['ns0:clean']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on clean hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:clean'])))
-				if (int(cloud_ttl['ns0:malicious']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on malicious hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:malicious'])))
-				if (int(cloud_ttl['ns0:unseen']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on unseen hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:unseen'])))
-				if (int(cloud_ttl['ns0:block']) > 3600):
-					print("\t[!]WARNING, Potentially long TTL on block hash lookup : {}. Change this in 'Advance Settings > Cache'".format(int(cloud_ttl['ns0:block'])))
-		
-		# Check DRIVER settings
-		if validate_json_element(json_agent,'ns0:driver'):
-			driver_settings = json_agent['ns0:driver'] if "ns0:driver" in str(json_agent) else None
-			if (driver_settings != None):
-				if (str(driver_settings['ns0:protmode']['ns0:qaction']) == '0'):
-					print("\t[!]WARNING, FILE blocking is set to AUDIT mode. Change this in 'Modes and Engines > Conviction Modes > Files'")
-				if (str(driver_settings['ns0:protmode']['ns0:process']) == '0'):
-					print("\t[!]WARNING, Monitor Process Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'")
-				if (str(driver_settings['ns0:protmode']['ns0:file']) == '0'):
-					print("\t[!]WARNING, Monitor File Copies and Moves Execution is DISABLED. Change this in 'Advance Settings > File and Process Scan'")
-				if (str(driver_settings['ns0:protmode']['ns0:activeexec']) == '0'):
-					print("\t[!]WARNING, On Execute Mode is set to PASSIVE. Change this in 'Advance Settings > File and Process Scan'")
-
-
-		if validate_json_element(json_agent,'ns0:scansettings'):
-			scanner_settings = json_agent['ns0:scansettings'] if "ns0:scansettings" in json_agent else None
-			# Clam AV engine checks
-			clam_av = scanner_settings['ns0:clamav']
-			if (clam_av != None):
-				if (str(clam_av['ns0:enable']) == '0'): 
-					print("\t[!]WARNING, CLAMAV engine is disabled. Change this in 'Advance Settings > ClamAV'")
-
-	################# OTHER PARSERS - MAC + WINDOWS + LINUX
-
-	# Parse NFM settings
-	if validate_json_element(json_agent,'ns0:nfm'):
-		nfm_settings = json_agent['ns0:nfm'] if "ns0:nfm" in str(json_agent) else None
-		if ( nfm_settings != None):
-			if (str(nfm_settings['ns0:enable']) == '0'):
-				print("\t[!]WARNING, Network/Device Flow Monitoring is disabled. Change this in 'Advance Settings > Network'")
-			if (str(nfm_settings['ns0:enable']) == '1' and str(nfm_settings['ns0:settings']['ns0:qaction']) == '0'):
-				print("\t[!]WARNING, Network/Device Flow Monitoring is ENABLED but set AUDIT. Change this in 'Advance Settings > Network'")
-
-
-	# Parse CMD settings
-	if validate_json_element(json_agent,'ns0:cmdlinecapture'):
-		cmd_settings = json_agent['ns0:cmdlinecapture'] if "ns0:cmdlinecapture" in str(json_agent) else None
-		if (cmd_settings != None):
-			if (str(cmd_settings['ns0:enable']) == '0'):
-				print("\t[!]WARNING, Command line capture is disabled. Change this in 'Advance Settings > Administrative Feature > Command Line Capture'")
-
-	# UI settings
-	if validate_json_element(json_object['ns0:Signature']['ns0:Object']['ns0:config'],'ns0:ui'):
-		UI_settings = json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:ui']
-		# Different UI settings depending on product version
-		if (product_type == 'mac'):
-			if(UI_settings != None):
-				if(UI_settings['ns0:exclusions']['ns0:display'] == "1"):
-					print("\t[!]WARNING, EXCLUSIONS are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:cloud'] == "1"):
-					print("\t[!]WARNING, CLOUD notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_file_toast'] == "0"):
-					print("\t[!]WARNING, FILE notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_nfm_toast'] == "0"):
-					print("\t[!]WARNING, NETWORK FLOW notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:verbose'] == "1"):
-					print("\t[!]WARNING, VERBOSE logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-
-		elif (product_type == 'windows'):
-			if(UI_settings != None):
-				if(UI_settings['ns0:exclusions']['ns0:display'] == "1"):
-					print("\t[!]WARNING, EXCLUSIONS are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:cloud'] == "1"):
-					print("\t[!]WARNING, CLOUD notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_file_toast'] == "0"):
-					print("\t[!]WARNING, FILE notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_nfm_toast'] == "0"):
-					print("\t[!]WARNING, NETWORK FLOW notification are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:verbose'] == "1"):
-					print("\t[!]WARNING, VERBOSE logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_ioc_toast'] == "0"):
-					print("\t[!]WARNING, IOC logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_detection_toast'] == "0"):
-					print("\t[!]WARNING, DETECTION logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_heuristic_toast'] == "0"):
-					print("\t[!]WARNING, HEURISTIC logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-				if(UI_settings['ns0:notification']['ns0:hide_exprev_toast'] == "0"):
-					print("\t[!]WARNING, EXPLOIT PREVENTION logs are shown to users via GUI. Change this in 'Advance Settings > Client User Interface'")
-
-
-
-# Define parser for basic policy metadata stored in header
-def parse_header(json_header, product):
-	if(len(json_header) != 0 ):
-		if validate_json_element(json_header,'ns0:policy'):
-			if(len(json_header['ns0:policy']) > 1 ):
-				print("[+] Policy Name: {}".format(json_header['ns0:policy']['ns0:name']))
-				print("[+] Policy Product: {}".format(product))
-				print("[+] Policy GUID: {}".format(json_header['ns0:policy']['ns0:uuid']))
-				print("[+] Policy Version: {}".format(json_header['ns0:policy']['ns0:serial_number']))
-				print("[+] Business GUID: {}".format(json_header['ns0:business']['ns0:uuid']))
-				timestamp = json_header['ns0:policy']['ns0:updated']
-				current_time_utc = datetime.datetime.utcnow()
-				converted_d1 = datetime.datetime.fromtimestamp(round(int(timestamp) / 1000))
-				print("[!] WARNING, Last policy change: {} ago".format((current_time_utc - converted_d1)))
-		
-# Define parser for policy exclusions
-def parse_exclusions(json_exclusion):
-	if(len(json_exclusion) != 0 ):
-		if validate_json_element(json_exclusion['ns0:info'],'ns0:item'):
-			if(len(json_exclusion['ns0:info']['ns0:item']) > 1 and json_exclusion['ns0:info'] != None):
-				print("[+] File Exclusions in policy: ")
-				if(len(json_exclusion['ns0:info']['ns0:item']) > 1 ):
-					for e in json_exclusion['ns0:info']['ns0:item']:
-						if ("*" in e.split("|")[4]):
-							print("\tWARNING, wildecard : {} ".format(unquote(e.split("|")[4])))
-						else:
-							print("\t", unquote(e.split("|")[4]))
-				else:
-					print("\t", str(unquote(json_exclusion['ns0:info']['ns0:item']).split("|")[4]))
-		else:
-			print("[+] No path exclusions are defined")
-		if validate_json_element(json_exclusion,'ns0:certissuer'):
-			if("certissuer" in str(json_exclusion)):
-				print("[+] Certificate Exclusions in policy: ")
-				if(len(json_exclusion['ns0:certissuer']['ns0:name']) > 1 and json_exclusion['ns0:certissuer'] != None):
-					for e in json_exclusion['ns0:certissuer']['ns0:name']:
-						if ("*" in e):
-							print("\tWARNING, wildecard : {} ".format(unquote(e)))
-						else:
-							print("\t", unquote(e))
-				else:
-					print("\t",unquote(json_exclusion['ns0:certissuer']['ns0:name']))
-		else:
-			print("[+] No certificate issuer exclusions are defined")
-
-		if validate_json_element(json_exclusion,'ns0:process'):
-			if ("process" in str(json_exclusion) and json_exclusion['ns0:process'] != None):
-				print("[+] Process Exclusions in policy: ")
-				# A bit hacky way of working out if there is more than 1 element in list
-				if ("', '" in str(json_exclusion['ns0:process']['ns0:item'])):
-					for e in json_exclusion['ns0:process']['ns0:item']:
-						if ("*" in e):
-							print("\tWARNING, wildecard : {} ".format(unquote(e)))
-						else:
-							print("\t", unquote(e))
-				else:
-					single_exclusion = json_exclusion['ns0:process']['ns0:item']
-					if ("*" in single_exclusion):
-						print("\tWARNING, wildecard : {} ".format(unquote(single_exclusion)))
-					else:
-						print("\t", unquote(single_exclusion))
+# Audit policy XML fetched from API and report findings to emitter 'out'. Returns False if policy could not be audited
+def audit_policy_xml(policy_xml, policy_type, groups_used, out):
+	try:
+		# Stream policy XML into dictionary of the config sections we audit, signature and everything else is dropped while parsing.
+		# Product comes from API, it does not have to be detected
+		audit = PolicyAudit.from_xml(policy_xml, policy_type)
+		# Print groups this policy is used in 
+		if groups_used is None:
+			out.text("[!] Groups policy is used in are unknown, group listing is incomplete")
+		elif(len(groups_used) > 0):
+			out.text("[+] Policy Used in Group:")
+			for g in groups_used:
+				out.text("\t[+] Name: {} Description: {} Group GUID: {}".format(g['name'],g['description'],g['guid']))
 		else:
-			print("[+] No process exclusions are defined")
+			out.text("[!] Policy not used in any groups")
+		audit.report(out)
+
+	except KeyError as e:
+		out.status("\t[!] Not supported yet (could be Network-only or mobile) policy")
+	except ParseError as e:
+		# Truncated or broken XML in a 200 response, only this policy is lost
+		out.status("[!] ERROR, unable to audit policy: {}".format(repr(e)))
+		return False
+	return True
 
-#####################################################################################
-# MAIN
-#####################################################################################
 def main():
 	# Parse arguments
 	ap = argparse.ArgumentParser()
 	ap.add_argument("-c", "--config", dest="config_path", required=True, help="path to config file", type=validate_file, metavar="FILE")
+	ap.add_argument("-w", "--workers", dest="workers", type=int, default=8, help="number of policies fetched concurrently (default: 8)")
+	ap.add_argument("-f", "--format", dest="format", default="text", choices=sorted(FORMATS), help="output format (default: text)")
+	ap.add_argument("-o", "--output", dest="output", default=None, help="write report to file instead of standard output", metavar="FILE")
+	ap.add_argument("--cache", dest="cache", default=None, help="folder of audit cache, policies audited before are not parsed again", metavar="DIR")
+	ap.add_argument("--cache-size", dest="cache_size", type=int, default=256, help="maximum size of audit cache in MB (default: 256)")
+	ap.add_argument("--cache-age", dest="cache_age", type=int, default=30, help="maximum age of audit cache entries in days (default: 30)")
+	ap.add_argument("--findings-db", dest="findings_db", default=None, help="record findings of this run into findings database (see query-findings.py)", metavar="FILE")
+	ap.add_argument("--impact", dest="impact", action="store_true", help="count connectors using every policy (single pass over computers) and rank findings by affected connectors")
+	ap.add_argument("--impact-top", dest="impact_top", type=int, default=20, help="number of findings in impact ranking (default: 20)")
 	args = ap.parse_args()
 
+	load_requests()
+
 	# Parse config to extract API keys
 	config = configparser.ConfigParser()
 	config.read(args.config_path)
@@ -396,111 +117,94 @@ def main():
 	api_key = config['settings']['api_key']
 	domainIP = config['settings']['domainIP']
 
+	# Findings are streamed to output as policies are audited, nothing is collected in memory
+	out = open_emitter(args.format, args.output)
+	impact = None
+	if args.impact:
+		# Findings carry number of connectors using the policy, counts are known once computers are listed
+		out = impact = ImpactEmitter(out)
+	if args.findings_db:
+		# Findings are also recorded into database, run is saved only if it gets to the end
+		out = record_findings(out, args.findings_db, "online-policy-audit", domainIP)
+	cache = None
+	if args.cache:
+		# Report is partly printed by this script, its code is part of cache key too
+		cache = AuditCache(args.cache, max_bytes=args.cache_size * 1024 * 1024, max_age=args.cache_age * 24 * 3600, sources=(__file__,))
 	try:
 	    # http://docs.python-requests.org/en/master/user/advanced/
-	    # Using a session object gains efficiency when making multiple requests
-	    session = requests.Session()
-	    session.auth = (client_id, api_key)
+	    # Using a session object gains efficiency when making multiple requests.
+	    # Every thread (workers, listing prefetch) gets its own session, all of them draw from the same API budget
+	    sessions = PerThread(lambda: new_session(client_id, api_key))
+	    limiter = RateLimiter(reserve=args.workers)
 
 	    # Define URL for extraction of all policies
-	    policy_url='https://{}/v1/policies'.format(domainIP)
-	    response = session.get(policy_url, verify=False)
-	    # Get Headers
-	    headers=response.headers
-	    # Ensure we don't cross API limits, sleep if we are approaching close to limits
-	    checkAPITimeout(headers, response)
-	    # Decode JSON response
-	    response_json = response.json()
-	    
-	    print("[+] Total number of policies: {}".format(response_json['metadata']['results']['total']))
-	    # get all policies
-	    policies = response_json['data']
-	    for policy_detail in policies:
-	    	policy_url='https://{}/v1/policies/{}'.format(domainIP,policy_detail['guid'])
-	    	response = session.get(policy_url, verify=False)
-	    	# Get Headers
-	    	headers=response.headers
-	    	# Ensure we don't cross API limits, sleep if we are approaching close to limits
-	    	checkAPITimeout(headers, response)
-	    	# Decode JSON response
-	    	response_json = response.json()
-	    	groups_used = response_json['data']['used_in_groups']
-	    	# Identify and request XML files	    	
-	    	policy_url='https://{}/v1/policies/{}.xml'.format(domainIP,policy_detail['guid'])
-	    	response = session.get(policy_url, verify=False)
-	    	checkAPITimeout(headers, response)
-
-	    	# Parse definition of the policy XML
-	    	tree = ElementTree(fromstring(response.content))
-	    	# Get root of XML tree
-	    	root = tree.getroot()
-
-	    	# Parse element to into json structure so we can extract specific elements. There is easier way of doing this but it will need to do for now.
-	    	b4_xml_obj = BeautifulSoup(tostring(root), "xml")
-	    	pdic = xmltodict.parse(b4_xml_obj.prettify(),dict_constructor=dict)
-	    	pdic_json = json.dumps(pdic)
-	    	json_object = json.loads(pdic_json)
+	    policy_url=api_url(domainIP, 'v1/policies')
+	    # Rate limiter paces requests from X-RateLimit-* headers and retries 429 / 5xx responses.
+	    # Listing follows next page links, next page is fetched while policies of current one are audited.
+	    policies = PagedListing(limiter, sessions.get, policy_url, verify=False)
+	    out.status("[+] Total number of policies: {}".format(policies.total))
+	    # Group membership of all policies is built once from groups endpoint, instead of one request per policy
+	    group_index = GroupIndex.build(limiter, sessions.get, domainIP, workers=args.workers, verify=False)
+	    if not group_index.complete:
+	    	out.status("\t[!] WARNING, group listing is incomplete, groups of some policies are unknown: {}".format(group_index.error))
+	    if impact is not None:
+	    	# Computers are listed once for the whole tenant (not per group), only counts per group and policy are kept
+	    	computer_index = ComputerIndex.build(limiter, sessions.get, domainIP, verify=False)
+	    	if not computer_index.complete:
+	    		out.status("\t[!] WARNING, computer listing is incomplete, connector counts are too low: {}".format(computer_index.error))
+	    	out.status("[+] {}".format(computer_index.summary()))
+	    	impact.endpoints_for = computer_index.endpoints_for
+	    # Policy XML files are fetched by pool of worker threads sharing one rate limiter,
+	    # results are handed back (and printed) in the same order as policies are listed
+	    failed = 0
+	    fetched_policies = ordered_map(lambda p: fetch_policy(sessions.get(), limiter, domainIP, p), policies, args.workers)
+	    for policy_detail, (policy_xml, error) in fetched_policies:
+	    	groups_used = group_index.groups_for(policy_detail['guid'])
+	    	if not groups_used and not group_index.complete:
+	    		# Policy may be used in one of the groups which could not be read
+	    		groups_used = None
 	    	# Print separator
-	    	print("#" * 75)
-
-	    	try:
-	    		# Policy header is always there
-	    		policy_header = json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:janus']
-	    		if validate_json_element(json_object['ns0:Signature']['ns0:Object']['ns0:config'],'ns0:exclusions'):
-	    			exclusions = json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:exclusions']
-	    		else:
-	    			exclusions = None
-	    		if validate_json_element(json_object['ns0:Signature']['ns0:Object']['ns0:config'],'ns0:agent'):
-	    			agentconfig = json_object['ns0:Signature']['ns0:Object']['ns0:config']['ns0:agent']
-	    		else:
-	    			agentconfig = None
-	    		# Print groups this policy is used in 
-		    	if(len(response_json['data']['used_in_groups']) > 0):
-			    	print("[+] Policy Used in Group:")
-			    	for g in response_json['data']['used_in_groups']:
-			    		 print("\t[+] Name: {} Description: {} Group GUID: {}".format(g['name'],g['description'],g['guid']))
-	    		else:
-	    			print("[!] Policy not used in any groups")
-
-	    		policy_type = policy_detail['product']
-	    		# A 'simple' way of finding product type based on API type
-	    		# Before we invoke any parser, lets make sure that there are some policies present 
-	    		if (exclusions != None):
-	    			if(policy_type == "mac"):
-	    				parse_header(policy_header,policy_type)
-	    				parse_exclusions(exclusions)
-	    				if (agentconfig != None):
-	    					parse_agentsettings(agentconfig,json_object,"mac")
-    				elif (policy_type == "windows"):
-    					parse_header(policy_header,policy_type)
-    					parse_exclusions(exclusions)
-    					if (agentconfig != None):
-    						parse_agentsettings(agentconfig,json_object,"windows")
-    				elif (policy_type == "linux"):
-    					parse_header(policy_header,policy_type)
-    					parse_exclusions(exclusions)
-    					if (agentconfig != None):
-    						parse_agentsettings(agentconfig,json_object,"linux")
-    			# In case exclusions are empty
-    			elif (agentconfig != None):
-    				if(policy_type == "mac"):
-    					parse_header(policy_header,policy_type)
-    					parse_agentsettings(agentconfig,json_object,"mac")
-    				elif (policy_type == "windows"):
-    					parse_header(policy_header,policy_type)
-    					parse_agentsettings(agentconfig,json_object,"windows")
-    				elif (policy_type == "linux"):
-    					parse_header(policy_header,policy_type)
-    					parse_agentsettings(agentconfig,json_object,"linux")
-
-
-	    	except KeyError as e:
-	    		print("\t[!] Not supported yet (could be Network-only or mobile) policy")
-
-
+	    	out.text("#" * 75)
+	    	if policy_xml is None:
+	    		# Error body is not a policy - only this policy is skipped (and not recorded as audited)
+	    		out.status("\t[!] WARNING, policy could not be fetched. NAME: {} GUID: {} {}".format(policy_detail.get('name'), policy_detail['guid'], error))
+	    		failed += 1
+	    		continue
+	    	out.begin_policy(policy_detail['guid'], policy_detail['product'], policy_detail.get('name'))
+	    	if impact is not None:
+	    		out.text("[+] Connectors using policy: {}".format(impact.endpoints))
+	    	if cache is not None:
+	    		# Report depends on policy XML, product reported by API and groups policy is used in
+	    		key = cache.key(policy_xml, policy_detail['product'], json.dumps(groups_used, sort_keys=True))
+	    		entry = cache.get(key)
+	    		if entry is None:
+	    			recorder = RecordingEmitter()
+	    			entry = (audit_policy_xml(policy_xml, policy_detail['product'], groups_used, recorder), recorder.events)
+	    			cache.put(key, entry[0], entry[1])
+	    		replay(entry[1], out)
+	    		result = entry[0]
+	    	else:
+	    		result = audit_policy_xml(policy_xml, policy_detail['product'], groups_used, out)
+	    	if not result:
+	    		failed += 1
+	    	out.end_policy()
+
+	    if failed:
+	    	out.status("\t[!] WARNING, {} policies could not be fetched or audited".format(failed))
+	    if not policies.complete:
+	    	out.status("\t[!] WARNING, policy listing is incomplete, {} of {} policies audited: {}".format(policies.count, policies.total, policies.error))
+	    if cache is not None:
+	    	out.status("[+] {}, {} entries evicted".format(cache.summary(), cache.prune()))
+	    if impact is not None:
+	    	report_impact(out, impact, args.impact_top)
+	    # Show how much time was lost waiting for API rate limits
+	    out.status("[+] {}".format(limiter.summary()))
+	    if args.findings_db:
+	    	out.run.finish()
+	    	out.status("[+] {}".format(out.run.summary()))
 	finally:
-		print("[+] Done")
-		gc.collect()
+		out.status("[+] Done")
+		out.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import time
+import datetime
+import argparse
+import os
+from amp_policy_kit.findingsdb import FindingsDB
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Ensure that findings database exists, to be used by ArgumentParser 'type' option
+def validate_file(f):
+	if not os.path.isfile(f):
+		# Raise exception if specified path does not exist
+		raise argparse.ArgumentTypeError("Findings database {0} does not exist".format(f))
+	return f
+
+def format_time(timestamp):
+	return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+# Epoch seconds 'days' ago, None if not given
+def days_ago(days):
+	return None if days is None else time.time() - days * 24 * 3600
+
+# Run given on command line or newest one
+def selected_run(db, args):
+	run_id = args.run if args.run is not None else db.latest_run(args.tool)
+	if run_id is None:
+		print("\t[!] WARNING, findings database does not contain any finished run")
+		sys.exit(1)
+	return run_id
+
+#####################################################################################
+# QUERIES
+#####################################################################################
+
+def query_runs(db, args):
+	print("{:>6}  {:<16}  {:<20}  {:>8}  {:>8}  {}".format("run", "started", "tool", "policies", "findings", "source"))
+	for run_id, started, finished, tool, source, policies, findings in db.runs(args.limit):
+		print("{:>6}  {:<16}  {:<20}  {:>8}  {:>8}  {}".format(run_id, format_time(started), tool or "", policies, findings, source or ""))
+
+def query_top(db, args):
+	run_id = selected_run(db, args)
+	print("[+] Top {} {} of run {}".format(args.limit, args.by.replace("_", " "), run_id))
+	print("{:>8}  {:>8}  {}".format("findings", "policies", args.by))
+	for key, findings, policies in db.top(run_id, args.by, args.limit, args.product, args.rule, args.severity):
+		print("{:>8}  {:>8}  {}".format(findings, policies, key))
+
+def query_trend(db, args):
+	print("{:>6}  {:<16}  {:<20}  {:>8}  {:>8}".format("run", "started", "tool", "findings", "policies"))
+	for run_id, started, tool, findings, policies in db.trend(args.product, args.rule, args.guid, days_ago(args.days)):
+		print("{:>6}  {:<16}  {:<20}  {:>8}  {:>8}".format(run_id, format_time(started), tool or "", findings, policies))
+
+def query_persistent(db, args):
+	run_id = selected_run(db, args)
+	rows = db.persistent(args.rule, run_id, days_ago(args.days), args.product)
+	print("[+] Policies with '{}' in run {} and every run since at least {} days: {}".format(args.rule, run_id, args.days, len(rows)))
+	for guid, name, product, since in rows:
+		print("\t[!] {} ({}, {}) since {}".format(name, product, guid, format_time(since)))
+
+def query_findings(db, args):
+	run_id = selected_run(db, args)
+	for guid, product, rule_id, severity, message, value in db.findings(run_id, args.product, args.rule, args.guid, args.severity):
+		print("{}\t{}\t{}\t{}\t{}".format(guid, product, rule_id, severity, message))
+
+#####################################################################################
+# MAIN
+#####################################################################################
+def main():
+	# Parse arguments
+	ap = argparse.ArgumentParser(description="Query findings recorded by audit scripts with --findings-db")
+	ap.add_argument("-d", "--db", dest="db_path", required=True, help="path to findings database", type=validate_file, metavar="FILE")
+	commands = ap.add_subparsers(dest="command", metavar="COMMAND")
+	commands.required = True
+
+	runs = commands.add_parser("runs", help="list recorded runs, newest first")
+	runs.add_argument("-n", "--limit", dest="limit", type=int, default=20, help="number of runs shown (default: 20)")
+	runs.set_defaults(query=query_runs)
+
+	top = commands.add_parser("top", help="rules, policies or products with most findings in one run")
+	top.add_argument("-b", "--by", dest="by", default="rule_id", choices=["rule_id", "policy_guid", "product"], help="what findings are counted by (default: rule_id)")
+	top.add_argument("-n", "--limit", dest="limit", type=int, default=10, help="number of rows shown (default: 10)")
+	top.set_defaults(query=query_top)
+
+	trend = commands.add_parser("trend", help="number of findings and affected policies in every run")
+	trend.add_argument("--days", dest="days", type=float, default=None, help="only runs of last DAYS days")
+	trend.set_defaults(query=query_trend)
+
+	persistent = commands.add_parser("persistent", help="policies which have had finding in every run for at least DAYS days")
+	persistent.add_argument("--days", dest="days", type=float, required=True, help="minimum number of days the finding has been present")
+	persistent.set_defaults(query=query_persistent)
+
+	findings = commands.add_parser("findings", help="findings of one run")
+	findings.set_defaults(query=query_findings)
+
+	# Filters shared by queries
+	for command in (top, trend, persistent, findings):
+		command.add_argument("-p", "--product", dest="product", default=None, choices=["windows", "mac", "linux"], help="only findings of this product")
+		command.add_argument("-r", "--rule", dest="rule", required=command is persistent, default=None, help="only findings of this rule, e.g. tetra-deepscan-disabled")
+	for command in (top, findings):
+		command.add_argument("-s", "--severity", dest="severity", default=None, choices=["high", "medium", "low"], help="only findings of this severity")
+	for command in (trend, findings):
+		command.add_argument("-g", "--guid", dest="guid", default=None, help="only findings of this policy")
+	for command in (top, persistent, findings):
+		command.add_argument("--run", dest="run", type=int, default=None, help="run to query (default: newest)")
+		command.add_argument("--tool", dest="tool", default=None, help="newest run of this tool, e.g. online-policy-audit")
+	args = ap.parse_args()
+
+	try:
+		db = FindingsDB(args.db_path, readonly=True)
+	except ValueError as e:
+		ap.error(str(e))
+	with db:
+		args.query(db, args)
+
+if __name__ == "__main__":
+	main()
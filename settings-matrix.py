@@ -0,0 +1,109 @@
+#####################################################################################
+# IMPORTS
+#####################################################################################
+
+import sys
+import argparse
+from amp_policy_kit.store import select_sources, expand_input
+from amp_policy_kit.workers import available_cpus
+from amp_policy_kit.matrix import SettingsMatrix, read_row
+
+#####################################################################################
+# HELPERS
+#####################################################################################
+
+# Row of one policy file in worker process: (row, error). Bad or truncated file should not abort the whole run
+def read_row_worker(path):
+	try:
+		return read_row(path), None
+	except Exception as e:
+		return None, repr(e)
+
+# Rows are added in input order, policies without security settings and files which could not be read are counted
+def fill_matrix(policy_files, results):
+	matrix = SettingsMatrix()
+	skipped = 0
+	failed = 0
+	for path, (row, error) in zip(policy_files, results):
+		if error is not None:
+			print("\t[!] ERROR, unable to read policy file {}: {}".format(path, error))
+			failed += 1
+		elif row is None:
+			skipped += 1
+		else:
+			matrix.add_row(*row)
+	return matrix, skipped, failed
+
+# Settings of all policies are extracted in worker processes, parent only appends rows to columns
+def build_matrix(policy_files, workers):
+	if workers == 1:
+		return fill_matrix(policy_files, map(read_row_worker, policy_files))
+	# Hand out files in chunks so thousands of small policies do not pay IPC round trip each
+	chunksize = max(1, min(64, len(policy_files) // (workers * 4)))
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return fill_matrix(policy_files, executor.map(read_row_worker, policy_files, chunksize=chunksize))
+
+def format_value(value):
+	if value is None:
+		return "(empty)"
+	if isinstance(value, dict):
+		return "(present)"
+	if not isinstance(value, str):
+		return "(missing)"
+	return value
+
+def percent(count, total):
+	return 100.0 * count / total if total else 0.0
+
+#####################################################################################
+# MAIN
+#####################################################################################
+
+def main():
+	# Parse arguments
+	ap = argparse.ArgumentParser(description="Extract every setting checked by audit rules of all policies into columnar settings matrix and report fleet-wide statistics")
+	ap.add_argument("-i", "--input", dest="config_path", required=True, help="folder with XML files, glob pattern (quoted) or policy store", metavar="PATH")
+	ap.add_argument("-p", "--product", dest="product", default=None, choices=["windows", "mac", "linux"], help="only policies of this product")
+	ap.add_argument("-s", "--setting", dest="settings", nargs="+", default=[], help="show distribution of values of these settings, e.g. agent/apde/mode", metavar="PATH")
+	ap.add_argument("-e", "--export", dest="export", default=None, help="write settings matrix to CSV file, or Parquet file if name ends with .parquet (needs pyarrow)", metavar="FILE")
+	ap.add_argument("-w", "--workers", dest="workers", type=int, default=available_cpus(), help="number of worker processes reading policies (default: available cores)")
+	args = ap.parse_args()
+
+	policy_files = select_sources(expand_input(args.config_path), None, args.product)
+	if len(policy_files) == 0:
+		ap.error("Path {0} does not exist or does not contain any matching policies".format(args.config_path))
+	matrix = SettingsMatrix()
+	unknown = [path for path in args.settings if path not in matrix.column]
+	if unknown:
+		ap.error("Settings not checked by any rule: {}".format(", ".join(unknown)))
+
+	print("[+] Total number of policy files: {}".format(len(policy_files)))
+	matrix, skipped, failed = build_matrix(policy_files, max(1, min(args.workers, len(policy_files))))
+	print("[+] Settings matrix: {} policies, {} settings, {} policies without security settings".format(len(matrix), len(matrix.paths), skipped))
+	if failed:
+		print("\t[!] WARNING, {} policy files could not be read".format(failed))
+	products = (args.product,) if args.product else ("windows", "mac", "linux")
+
+	print("[+] Rule failures:")
+	print("\t{:<40} {:<8} {:>8} {:>8} {:>7}".format("rule", "product", "failing", "policies", "%"))
+	for rule, product, failing, evaluated in matrix.rule_stats(products):
+		if evaluated:
+			print("\t{:<40} {:<8} {:>8} {:>8} {:>6.1f}%".format(rule.rule_id, product, failing, evaluated, percent(failing, evaluated)))
+
+	for path in args.settings:
+		print("[+] Setting {}:".format(path))
+		for product in products:
+			for value, count, total in sorted(matrix.value_stats(path, product), key=lambda s: -s[1]):
+				print("\t{:<8} {:<24} {:>8} {:>6.1f}%".format(product, format_value(value), count, percent(count, total)))
+
+	if args.export:
+		try:
+			matrix.export(args.export)
+		except ImportError as e:
+			print("\t[!] WARNING, {}".format(e))
+			sys.exit(1)
+		print("[+] Settings matrix written to {}".format(args.export))
+
+if __name__ == "__main__":
+	main()